@@ -0,0 +1,134 @@
+import argparse
+import base64
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+import socketio
+
+from telemetry import RAW, JPEG, TelemetryDecoder, encode_telemetry
+
+# Stand-in for the simulator: sends telemetry to drive.py and measures the
+# time until the steering decision comes back, for the base64/JSON path and
+# for the binary raw and JPEG paths.
+
+
+def synthetic_frame(height=160, width=320, seed=0):
+    rng = np.random.RandomState(seed)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:height // 2] = (135, 180, 230)
+    frame[height // 2:] = (90, 90, 90)
+    frame += rng.randint(0, 20, frame.shape).astype(np.uint8)
+    return frame
+
+
+def legacy_message(frame, speed=10.0):
+    buf = BytesIO()
+    Image.fromarray(frame).save(buf, format='JPEG')
+    return {
+        'steering_angle': '0.0',
+        'throttle': '0.0',
+        'speed': str(speed),
+        'image': base64.b64encode(buf.getvalue()).decode('ascii'),
+    }
+
+
+def percentiles(samples):
+    samples = np.array(samples) * 1e3
+    return 'mean {:7.2f} ms  p50 {:7.2f} ms  p99 {:7.2f} ms'.format(
+        samples.mean(), np.percentile(samples, 50), np.percentile(samples, 99))
+
+
+def run_car(url, event, messages, latencies):
+    sio = socketio.Client()
+    replied = threading.Event()
+
+    @sio.on('steer')
+    def steer(data):
+        float(data['steering_angle']), float(data['throttle'])
+        replied.set()
+
+    @sio.on('steer_bin')
+    def steer_bin(data):
+        steering_angle, throttle = data
+        replied.set()
+
+    sio.connect(url)
+    # drive.py answers the connect with a zero control
+    replied.wait(5)
+
+    for message in messages:
+        replied.clear()
+        start = time.time()
+        sio.emit(event, message)
+        if not replied.wait(5):
+            raise RuntimeError('no reply from drive.py for {}'.format(event))
+        latencies.append(time.time() - start)
+    sio.disconnect()
+
+
+def run_online(url, frames, modes, cars=1):
+    # every car runs in its own thread with its own connection
+    for mode in modes:
+        if mode == 'legacy':
+            event, messages = 'telemetry', [legacy_message(f) for f in frames]
+        else:
+            fmt = RAW if mode == 'raw' else JPEG
+            event, messages = 'telemetry_bin', [encode_telemetry(f, 10.0, 0.0, 0.0, fmt) for f in frames]
+        latencies = []
+        threads = [threading.Thread(target=run_car, args=(url, event, messages, latencies))
+                   for i in range(cars)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+        print('{:>7}: {}  {:7.1f} decisions/s'.format(mode, percentiles(latencies),
+                                                     len(latencies) / elapsed))
+
+
+def run_offline(frames, modes, repeat=5):
+    # decode cost only, no server needed
+    decoder = TelemetryDecoder()
+    for mode in modes:
+        if mode == 'legacy':
+            messages = [legacy_message(f) for f in frames]
+
+            def decode(data):
+                image = Image.open(BytesIO(base64.b64decode(data['image'])))
+                return np.asarray(image), float(data['speed'])
+        else:
+            fmt = RAW if mode == 'raw' else JPEG
+            messages = [encode_telemetry(f, 10.0, 0.0, 0.0, fmt) for f in frames]
+            decode = decoder.decode
+        latencies = []
+        for r in range(repeat):
+            for message in messages:
+                start = time.time()
+                decode(message)
+                latencies.append(time.time() - start)
+        size = np.mean([len(m['image']) if mode == 'legacy' else len(m) for m in messages])
+        print('{:>7}: {}  {:8.0f} bytes/frame'.format(mode, percentiles(latencies), size))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake simulator client')
+    parser.add_argument('--url', type=str, default='http://localhost:4567',
+                        help='drive.py server address.')
+    parser.add_argument('--frames', type=int, default=200, help='Frames sent per mode and car.')
+    parser.add_argument('--cars', type=int, default=1, help='Simulated cars sending concurrently.')
+    parser.add_argument('--modes', type=str, default='legacy,raw,jpeg',
+                        help='Comma separated subset of legacy, raw, jpeg.')
+    parser.add_argument('--offline', action='store_true',
+                        help='Only measure decoding, without a running drive.py.')
+    args = parser.parse_args()
+
+    frames = [synthetic_frame(seed=i) for i in range(args.frames)]
+    modes = args.modes.split(',')
+    if args.offline:
+        run_offline(frames, modes)
+    else:
+        run_online(args.url, frames, modes, args.cars)
@@ -0,0 +1,116 @@
+import time
+
+import numpy as np
+import eventlet
+from eventlet import tpool
+from eventlet.event import Event
+from eventlet.queue import LightQueue, Empty
+
+
+class MicroBatcher:
+    """
+    Collects frames from concurrent telemetry handlers into micro-batches.
+
+    Every handler calls predict() from its own green thread and blocks until
+    its row of the batch is ready. One batching green thread takes the
+    first waiting frame, gathers more for at most `max_wait` seconds or
+    until `max_batch_size` frames are queued, and runs the model once on the
+    stacked batch. While the model runs, new frames queue up for the next
+    batch.
+
+    With `threaded` set, the model runs in eventlet's OS thread pool so the
+    socket.io server keeps accepting frames meanwhile. TF1 Keras models
+    then need `predict_fn` to enter their graph, see keras_predict().
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait=0.002, threaded=False):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.threaded = threaded
+        self.queue = LightQueue()
+        self.buffer = None
+        self.requests = 0
+        self.batches = 0
+        self.queue_time = 0.
+        self.compute_time = 0.
+        self.thread = eventlet.spawn(self._run)
+
+    def predict(self, image):
+        """Returns (output, queue_latency, compute_latency) for one frame."""
+        done = Event()
+        self.queue.put((image, time.time(), done))
+        return done.wait()
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = batch[0][1] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            shape = batch[0][0].shape
+            if any(item[0].shape != shape for item in batch):
+                # mixed resolutions, fall back to one frame at a time
+                for item in batch:
+                    self._execute([item])
+                continue
+            self._execute(batch)
+
+    def _execute(self, batch):
+        n = len(batch)
+        shape = batch[0][0].shape
+        if self.buffer is None or self.buffer.shape[1:] != shape:
+            self.buffer = np.empty((self.max_batch_size,) + shape, dtype=batch[0][0].dtype)
+        for i, item in enumerate(batch):
+            self.buffer[i] = item[0]
+
+        start = time.time()
+        try:
+            if self.threaded:
+                outputs = tpool.execute(self.predict_fn, self.buffer[:n])
+            else:
+                outputs = self.predict_fn(self.buffer[:n])
+        except Exception as e:
+            for item in batch:
+                item[2].send_exception(e)
+            return
+        compute = time.time() - start
+
+        self.requests += n
+        self.batches += 1
+        self.compute_time += compute
+        for i, (image, queued, done) in enumerate(batch):
+            self.queue_time += start - queued
+            done.send((outputs[i], start - queued, compute))
+
+    def summary(self):
+        if not self.batches:
+            return 'no requests'
+        return '{} requests in {} batches (avg {:.1f}), queue {:.2f} ms, compute {:.2f} ms/batch'.format(
+            self.requests, self.batches, self.requests / float(self.batches),
+            self.queue_time / self.requests * 1e3, self.compute_time / self.batches * 1e3)
+
+
+def keras_predict(model):
+    """Wraps model.predict so it can run off the loading thread with TF1 graphs."""
+    try:
+        import tensorflow as tf
+        graph = tf.get_default_graph()
+    except (ImportError, AttributeError):
+        return lambda batch: model.predict(batch, batch_size=len(batch))
+
+    def predict(batch):
+        with graph.as_default():
+            return model.predict(batch, batch_size=len(batch))
+    return predict
@@ -0,0 +1,59 @@
+import struct
+
+import numpy as np
+import cv2
+
+# Binary telemetry frame: fixed little-endian header followed by the image
+# payload, either raw RGB rows (height * width * 3 bytes) or a JPEG.
+#
+#   magic 'TL' | version | format | height | width | speed | steering | throttle
+HEADER = struct.Struct('<2sBBHHfff')
+MAGIC = b'TL'
+VERSION = 1
+RAW = 0
+JPEG = 1
+
+
+def encode_telemetry(image, speed, steering_angle, throttle, fmt=RAW, quality=75):
+    """Pack an RGB uint8 image and the car state into one binary frame."""
+    height, width = image.shape[:2]
+    header = HEADER.pack(MAGIC, VERSION, fmt, height, width, speed, steering_angle, throttle)
+    if fmt == JPEG:
+        ok, payload = cv2.imencode('.jpg', cv2.cvtColor(image, cv2.COLOR_RGB2BGR),
+                                   [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError('JPEG encoding failed')
+        return header + payload.tobytes()
+    return header + np.ascontiguousarray(image, dtype=np.uint8).tobytes()
+
+
+class TelemetryDecoder:
+    """
+    Decodes binary telemetry frames without intermediate copies.
+
+    Raw frames are returned as a read-only view on the received bytes. JPEG
+    frames are decoded and converted to RGB into a buffer that is reused as
+    long as the resolution does not change, so the returned array is only
+    valid until the next decode().
+    """
+
+    def __init__(self):
+        self.buffer = None
+
+    def decode(self, data):
+        magic, version, fmt, height, width, speed, steering_angle, throttle = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a telemetry frame')
+        payload = np.frombuffer(data, dtype=np.uint8, offset=HEADER.size)
+        if fmt == RAW:
+            image = payload.reshape(height, width, 3)
+        elif fmt == JPEG:
+            if self.buffer is None or self.buffer.shape != (height, width, 3):
+                self.buffer = np.empty((height, width, 3), dtype=np.uint8)
+            decoded = cv2.imdecode(payload, cv2.IMREAD_COLOR)
+            if decoded is None:
+                raise ValueError('JPEG decoding failed')
+            image = cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB, dst=self.buffer)
+        else:
+            raise ValueError('unknown image format {}'.format(fmt))
+        return image, speed, steering_angle, throttle
@@ -0,0 +1,44 @@
+from __future__ import print_function
+import timeit
+import numpy as np
+
+from kalman import trackers
+
+
+# per-update latency of the batch filters for different numbers of tracks
+def bench(backend, n_tracks, repeat=20, seed=0):
+    rng = np.random.RandomState(seed)
+    tracker = trackers[backend](n_tracks)
+    tracker.x[:, 0] = rng.uniform(1., 20., n_tracks)
+    tracker.x[:, 1] = rng.uniform(1., 20., n_tracks)
+    tracker.x[:, 2] = rng.uniform(0., 10., n_tracks)
+    tracker.x[:, 3] = rng.uniform(-np.pi, np.pi, n_tracks)
+    tracker.x[:, 4] = rng.uniform(-0.5, 0.5, n_tracks)
+
+    z_lidar = tracker.x[:, :2] + rng.normal(0., 0.15, (n_tracks, 2))
+    z_radar = np.stack([np.hypot(tracker.x[:, 0], tracker.x[:, 1]),
+                        np.arctan2(tracker.x[:, 1], tracker.x[:, 0]),
+                        tracker.x[:, 2]], axis=1)
+    state = [0.]
+
+    def lidar():
+        state[0] += 50000.
+        tracker.step(0.0, z_lidar, state[0])
+
+    def radar():
+        state[0] += 50000.
+        tracker.step(1.0, z_radar, state[0])
+
+    t_lidar = min(timeit.repeat(lidar, number=1, repeat=repeat))
+    t_radar = min(timeit.repeat(radar, number=1, repeat=repeat))
+    return t_lidar, t_radar
+
+
+if __name__ == '__main__':
+    print('{:>8} {:>8} {:>14} {:>14} {:>16}'.format(
+        'filter', 'tracks', 'lidar ms', 'radar ms', 'us/track/update'))
+    for backend in sorted(trackers):
+        for n in (1, 100, 10000):
+            t_lidar, t_radar = bench(backend, n)
+            print('{:>8} {:>8} {:>14.3f} {:>14.3f} {:>16.3f}'.format(
+                backend, n, t_lidar * 1e3, t_radar * 1e3, 0.5 * (t_lidar + t_radar) / n * 1e6))
@@ -1,251 +1,473 @@
 from __future__ import print_function
+import sys
+import time
+import argparse
 import numpy as np
-import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
-from scipy.stats import norm
-from sympy import Symbol, symbols, Matrix, sin, cos, sqrt, atan2
-from sympy import init_printing
-init_printing(use_latex=True)
-import numdifftools as nd
-import math
-
-
-dataset = []
-
-# read the measurement data, use 0.0 to stand LIDAR data
-# and 1.0 stand RADAR data
-with open('data_synthetic.txt', 'rb') as f:
-    lines = f.readlines()
-    for line in lines:
-        line = line.strip('\n')
-        line = line.strip()
-        numbers = line.split()
-        result = []
-        for i, item in enumerate(numbers):
-            item.strip()
-            if i == 0:
-                if item == 'L':
-                    result.append(0.0)
-                else:
-                    result.append(1.0)
-            else:
-                result.append(float(item))
-        dataset.append(result)
-    f.close()
-
 
 
 P = np.diag([1.0, 1.0, 1.0, 1.0, 1.0])
-print(P, P.shape)
 H_lidar = np.array([[ 1.,  0.,  0.,  0.,  0.],
        [ 0.,  1.,  0.,  0.,  0.]])
-print(H_lidar, H_lidar.shape)
 
 R_lidar = np.array([[0.0225, 0.],[0., 0.0225]])
 R_radar = np.array([[0.09, 0., 0.],[0., 0.0009, 0.], [0., 0., 0.09]])
-print(R_lidar, R_lidar.shape)
-print(R_radar, R_radar.shape)
 
 # process noise standard deviation for a
 std_noise_a = 2.0
 # process noise standard deviation for yaw acceleration
 std_noise_yaw_dd = 0.3
 
+# below this yaw rate the CTRV model is treated as driving straight
+omega_eps = 0.0001
 
-def control_psi(psi):
-    while (psi > np.pi or psi < -np.pi):
-        if psi > np.pi:
-            psi = psi - 2 * np.pi
-        if psi < -np.pi:
-            psi = psi + 2 * np.pi
-    return psi
-
-state = np.zeros(5)
-init_measurement = dataset[0]
-current_time = 0.0
-if init_measurement[0] == 0.0:
-    print('Initialize with LIDAR measurement!')
-    current_time = init_measurement[3]
-    state[0] = init_measurement[1]
-    state[1] = init_measurement[2]
-
-else:
-    print('Initialize with RADAR measurement!')
-    current_time = init_measurement[4]
-    init_rho = init_measurement[1]
-    init_psi = init_measurement[2]
-    init_psi = control_psi(init_psi)
-    state[0] = init_rho * np.cos(init_psi)
-    state[1] = init_rho * np.sin(init_psi)
-print(state, state.shape)
-
-
-# Preallocation for Saving
-px = []
-py = []
-vx = []
-vy = []
-
-gpx = []
-gpy = []
-gvx = []
-gvy = []
-
-mx = []
-my = []
-
-def savestates(ss, gx, gy, gv1, gv2, m1, m2):
-    px.append(ss[0])
-    py.append(ss[1])
-    vx.append(np.cos(ss[3]) * ss[2])
-    vy.append(np.sin(ss[3]) * ss[2])
-
-    gpx.append(gx)
-    gpy.append(gy)
-    gvx.append(gv1)
-    gvy.append(gv2)
-    mx.append(m1)
-    my.append(m2)
-
-measurement_step = len(dataset)
-state = state.reshape([5, 1])
-dt = 0.05
-
-I = np.eye(5)
-
-transition_function = lambda y: np.vstack((
-    y[0] + (y[2] / y[4]) * (np.sin(y[3] + y[4] * dt) - np.sin(y[3])),
-    y[1] + (y[2] / y[4]) * (-np.cos(y[3] + y[4] * dt) + np.cos(y[3])),
-    y[2],
-    y[3] + y[4] * dt,
-    y[4]))
-
-# when omega is 0
-transition_function_1 = lambda m: np.vstack((m[0] + m[2] * np.cos(m[3]) * dt,
-                                             m[1] + m[2] * np.sin(m[3]) * dt,
-                                             m[2],
-                                             m[3] + m[4] * dt,
-                                             m[4]))
-
-J_A = nd.Jacobian(transition_function)
-J_A_1 = nd.Jacobian(transition_function_1)
-# print(J_A([1., 2., 3., 4., 5.]))
-
-measurement_function = lambda k: np.vstack((np.sqrt(k[0] * k[0] + k[1] * k[1]),
-                                            math.atan2(k[1], k[0]),
-                                            (k[0] * k[2] * np.cos(k[3]) + k[1] * k[2] * np.sin(k[3])) / np.sqrt(k[0] * k[0] + k[1] * k[1])))
-J_H = nd.Jacobian(measurement_function)
-# J_H([1., 2., 3., 4., 5.])
-
-
-
-for step in range(1, measurement_step):
-    
-    # Prediction
-    # ========================
-    t_measurement = dataset[step]
-    if t_measurement[0] == 0.0:
-        m_x = t_measurement[1]
-        m_y = t_measurement[2]
-        z = np.array([[m_x], [m_y]])
-
-        dt = (t_measurement[3] - current_time) / 1000000.0
-        current_time = t_measurement[3]
-
-        # true position
-        g_x = t_measurement[4]
-        g_y = t_measurement[5]
-        g_v_x = t_measurement[6]
-        g_v_y = t_measurement[7]
-
-    else:
-        m_rho = t_measurement[1]
-        m_psi = t_measurement[2]
-        m_dot_rho = t_measurement[3]
-        z = np.array([[m_rho], [m_psi], [m_dot_rho]])
-
-        dt = (t_measurement[4] - current_time) / 1000000.0
-        current_time = t_measurement[4]
-
-        # true position
-        g_x = t_measurement[5]
-        g_y = t_measurement[6]
-        g_v_x = t_measurement[7]
-        g_v_y = t_measurement[8]
-
-    if np.abs(state[4, 0]) < 0.0001:  # omega is 0, Driving straight
-        state = transition_function_1(state.ravel().tolist())
-        state[3, 0] = control_psi(state[3, 0])
-        JA = J_A_1(state.ravel().tolist())
-    else:  # otherwise
-        state = transition_function(state.ravel().tolist())
-        state[3, 0] = control_psi(state[3, 0])
-        JA = J_A(state.ravel().tolist())
-
-
-    G = np.zeros([5, 2])
-    G[0, 0] = 0.5 * dt * dt * np.cos(state[3, 0])
-    G[1, 0] = 0.5 * dt * dt * np.sin(state[3, 0])
-    G[2, 0] = dt
-    G[3, 1] = 0.5 * dt * dt
-    G[4, 1] = dt
-
-    Q_v = np.diag([std_noise_a*std_noise_a, std_noise_yaw_dd*std_noise_yaw_dd])
-    Q = np.dot(np.dot(G, Q_v), G.T)
-
-    # Project the error covariance ahead
-    P = np.dot(np.dot(JA, P), JA.T) + Q
-
-    # Measurement Update (Correction)
-    # ===============================
-    if t_measurement[0] == 0.0:
-        # Lidar
-        S = np.dot(np.dot(H_lidar, P), H_lidar.T) + R_lidar
-        K = np.dot(np.dot(P, H_lidar.T), np.linalg.inv(S))
-
-        y = z - np.dot(H_lidar, state)
-        y[1, 0] = control_psi(y[1, 0])
-        state = state + np.dot(K, y)
-        state[3, 0] = control_psi(state[3, 0])
-        # Update the error covariance
-        P = np.dot((I - np.dot(K, H_lidar)), P)
-
-        # Save states for Plotting
-        savestates(state.ravel().tolist(), g_x, g_y, g_v_x, g_v_y, m_x, m_y)
-
-    else:
-        # Radar
-        JH = J_H(state.ravel().tolist())
-
-        S = np.dot(np.dot(JH, P), JH.T) + R_radar
-        K = np.dot(np.dot(P, JH.T), np.linalg.inv(S))
-        map_pred = measurement_function(state.ravel().tolist())
-        if np.abs(map_pred[0, 0]) < 0.0001:
-            # if rho is 0
-            map_pred[2, 0] = 0
 
-        y = z - map_pred
-        y[1, 0] = control_psi(y[1, 0])
-
-        state = state + np.dot(K, y)
-        state[3, 0] = control_psi(state[3, 0])
+def control_psi(psi):
+    # wrap angle(s) into [-pi, pi], values already inside are left untouched
+    psi = np.asarray(psi, dtype=np.float64)
+    wrapped = np.where(np.abs(psi) > np.pi, (psi + np.pi) % (2 * np.pi) - np.pi, psi)
+    return wrapped[()]
+
+
+def ctrv_transition(x, dt):
+    """CTRV motion model for stacked states x of shape (N, 5) and dt of shape (N,)."""
+    px, py, v, psi, omega = x.T
+    straight = np.abs(omega) < omega_eps
+    omega_safe = np.where(straight, 1.0, omega)
+    psi_dt = psi + omega * dt
+
+    out = np.empty_like(x)
+    out[:, 0] = np.where(straight,
+                         px + v * np.cos(psi) * dt,
+                         px + (v / omega_safe) * (np.sin(psi_dt) - np.sin(psi)))
+    out[:, 1] = np.where(straight,
+                         py + v * np.sin(psi) * dt,
+                         py + (v / omega_safe) * (-np.cos(psi_dt) + np.cos(psi)))
+    out[:, 2] = v
+    out[:, 3] = psi_dt
+    out[:, 4] = omega
+    return out
+
+
+def ctrv_jacobian(x, dt, straight):
+    """Closed-form Jacobian of ctrv_transition, shape (N, 5, 5)."""
+    n = x.shape[0]
+    _, _, v, psi, omega = x.T
+    omega_safe = np.where(straight, 1.0, omega)
+    s0, c0 = np.sin(psi), np.cos(psi)
+    s1, c1 = np.sin(psi + omega * dt), np.cos(psi + omega * dt)
+
+    J = np.zeros((n, 5, 5))
+    J[:, 0, 0] = 1.
+    J[:, 1, 1] = 1.
+    J[:, 2, 2] = 1.
+    J[:, 3, 3] = 1.
+    J[:, 3, 4] = dt
+    J[:, 4, 4] = 1.
+    J[:, 0, 2] = np.where(straight, c0 * dt, (s1 - s0) / omega_safe)
+    J[:, 0, 3] = np.where(straight, -v * s0 * dt, (v / omega_safe) * (c1 - c0))
+    J[:, 0, 4] = np.where(straight, 0.,
+                          v * dt * c1 / omega_safe - (v / omega_safe ** 2) * (s1 - s0))
+    J[:, 1, 2] = np.where(straight, s0 * dt, (c0 - c1) / omega_safe)
+    J[:, 1, 3] = np.where(straight, v * c0 * dt, (v / omega_safe) * (s1 - s0))
+    J[:, 1, 4] = np.where(straight, 0.,
+                          v * dt * s1 / omega_safe - (v / omega_safe ** 2) * (c0 - c1))
+    return J
+
+
+def radar_measurement(x):
+    """Polar radar model (rho, phi, rho_dot) for stacked states, shape (N, 3)."""
+    px, py, v, psi = x[:, 0], x[:, 1], x[:, 2], x[:, 3]
+    rho = np.sqrt(px * px + py * py)
+    rho_safe = np.where(rho < 0.0001, 1.0, rho)
+    out = np.empty((x.shape[0], 3))
+    out[:, 0] = rho
+    out[:, 1] = np.arctan2(py, px)
+    # if rho is 0
+    out[:, 2] = np.where(rho < 0.0001, 0.,
+                         (px * v * np.cos(psi) + py * v * np.sin(psi)) / rho_safe)
+    return out
+
+
+def radar_jacobian(x):
+    """Closed-form Jacobian of radar_measurement, shape (N, 3, 5)."""
+    px, py, v, psi = x[:, 0], x[:, 1], x[:, 2], x[:, 3]
+    rho2 = np.maximum(px * px + py * py, 1e-8)
+    rho = np.sqrt(rho2)
+    rho3 = rho2 * rho
+    vx, vy = v * np.cos(psi), v * np.sin(psi)
+
+    J = np.zeros((x.shape[0], 3, 5))
+    J[:, 0, 0] = px / rho
+    J[:, 0, 1] = py / rho
+    J[:, 1, 0] = -py / rho2
+    J[:, 1, 1] = px / rho2
+    J[:, 2, 0] = py * (vx * py - vy * px) / rho3
+    J[:, 2, 1] = px * (vy * px - vx * py) / rho3
+    J[:, 2, 2] = (px * np.cos(psi) + py * np.sin(psi)) / rho
+    J[:, 2, 3] = (py * vx - px * vy) / rho
+    return J
+
+
+class EKFTracker(object):
+    """
+    CTRV extended Kalman filter stepping N independent tracks at once.
+
+    The state of every track is stored as rows of `x` (N, 5) holding
+    px, py, v, psi, omega and the covariances as `P` (N, 5, 5). All methods
+    take an optional `idx` (index array or boolean mask) so that tracks
+    receiving LIDAR and RADAR measurements in the same tick can be stepped
+    separately.
+    """
+
+    def __init__(self, n_tracks=1, P0=P, R_lidar=R_lidar, R_radar=R_radar,
+                 std_a=std_noise_a, std_yaw_dd=std_noise_yaw_dd):
+        self.n_tracks = n_tracks
+        self.x = np.zeros((n_tracks, 5))
+        self.P = np.tile(np.asarray(P0, dtype=np.float64), (n_tracks, 1, 1))
+        # timestamp of the last measurement per track, in microseconds
+        self.t = np.zeros(n_tracks)
+        self.R_lidar = np.asarray(R_lidar, dtype=np.float64)
+        self.R_radar = np.asarray(R_radar, dtype=np.float64)
+        self.Q_v = np.array([std_a * std_a, std_yaw_dd * std_yaw_dd])
+
+    @staticmethod
+    def _index(idx):
+        return slice(None) if idx is None else idx
+
+    def init_lidar(self, z, t, idx=None):
+        idx = self._index(idx)
+        z = np.atleast_2d(z)
+        self.x[idx] = 0.
+        self.x[idx, 0] = z[:, 0]
+        self.x[idx, 1] = z[:, 1]
+        self.t[idx] = t
+
+    def init_radar(self, z, t, idx=None):
+        idx = self._index(idx)
+        z = np.atleast_2d(z)
+        psi = control_psi(z[:, 1])
+        self.x[idx] = 0.
+        self.x[idx, 0] = z[:, 0] * np.cos(psi)
+        self.x[idx, 1] = z[:, 0] * np.sin(psi)
+        self.t[idx] = t
+
+    def predict(self, dt, idx=None):
+        idx = self._index(idx)
+        x = self.x[idx]
+        P = self.P[idx]
+        dt = np.broadcast_to(np.asarray(dt, dtype=np.float64), x.shape[:1])
+
+        straight = np.abs(x[:, 4]) < omega_eps
+        x = ctrv_transition(x, dt)
+        x[:, 3] = control_psi(x[:, 3])
+        # linearised at the predicted state, as the numerical version did
+        JA = ctrv_jacobian(x, dt, straight)
+
+        G = np.zeros((x.shape[0], 5, 2))
+        G[:, 0, 0] = 0.5 * dt * dt * np.cos(x[:, 3])
+        G[:, 1, 0] = 0.5 * dt * dt * np.sin(x[:, 3])
+        G[:, 2, 0] = dt
+        G[:, 3, 1] = 0.5 * dt * dt
+        G[:, 4, 1] = dt
+        Q = np.matmul(G * self.Q_v, G.transpose(0, 2, 1))
+
+        # Project the error covariance ahead
+        self.P[idx] = np.matmul(np.matmul(JA, P), JA.transpose(0, 2, 1)) + Q
+        self.x[idx] = x
+
+    def _correct(self, idx, y, H, HP, R):
+        # K = P H^T S^-1, solved instead of inverting S explicitly
+        P = self.P[idx]
+        S = np.matmul(HP, H.transpose(0, 2, 1)) + R
+        K = np.linalg.solve(S, HP).transpose(0, 2, 1)
+
+        x = self.x[idx] + np.matmul(K, y[:, :, None])[:, :, 0]
+        x[:, 3] = control_psi(x[:, 3])
+        self.x[idx] = x
         # Update the error covariance
-        P = np.dot((I - np.dot(K, JH)), P)
-
-        savestates(state.ravel().tolist(), g_x, g_y, g_v_x, g_v_y, m_rho * np.cos(m_psi), m_rho * np.sin(m_psi))
+        self.P[idx] = P - np.matmul(K, HP)
+
+    def update_lidar(self, z, idx=None):
+        idx = self._index(idx)
+        z = np.atleast_2d(z)
+        P = self.P[idx]
+        H = np.broadcast_to(H_lidar, (P.shape[0], 2, 5))
+        y = z - self.x[idx, :2]
+        self._correct(idx, y, H, P[:, :2, :], self.R_lidar)
+
+    def update_radar(self, z, idx=None):
+        idx = self._index(idx)
+        z = np.atleast_2d(z)
+        x = self.x[idx]
+        JH = radar_jacobian(x)
+        y = z - radar_measurement(x)
+        y[:, 1] = control_psi(y[:, 1])
+        self._correct(idx, y, JH, np.matmul(JH, self.P[idx]), self.R_radar)
+
+    def step(self, sensor, z, t, idx=None):
+        """Predict to timestamp `t` (microseconds) and correct with `z`.
+
+        `sensor` is 0.0 for LIDAR (z = px, py) and 1.0 for RADAR
+        (z = rho, phi, rho_dot), matching the encoding of the log reader.
+        """
+        i = self._index(idx)
+        dt = (np.asarray(t, dtype=np.float64) - self.t[i]) / 1000000.0
+        self.t[i] = t
+        self.predict(dt, idx)
+        if sensor == 0.0:
+            self.update_lidar(z, idx)
+        else:
+            self.update_radar(z, idx)
+
+    def velocities(self, idx=None):
+        x = self.x[self._index(idx)]
+        return np.cos(x[:, 3]) * x[:, 2], np.sin(x[:, 3]) * x[:, 2]
+
+
+def sigma_points(x, P, lam):
+    """Sigma points of shape (N, 2n+1, n) for means (N, n) and covariances (N, n, n)."""
+    n = x.shape[1]
+    L = np.linalg.cholesky(P) * np.sqrt(lam + n)
+    # columns of L become the offsets of the 2n spread points
+    offsets = L.transpose(0, 2, 1)
+    return np.concatenate((x[:, None, :],
+                           x[:, None, :] + offsets,
+                           x[:, None, :] - offsets), axis=1)
+
+
+def sigma_weights(n, lam):
+    weights = np.full(2 * n + 1, 0.5 / (lam + n))
+    weights[0] = lam / (lam + n)
+    return weights
+
+
+class UKFTracker(EKFTracker):
+    """
+    CTRV unscented Kalman filter with the same interface as EKFTracker.
+
+    Prediction propagates the 2n+1 sigma points of the noise-augmented state
+    (n = 7) of all tracks through the CTRV model in one call, so neither a
+    separate straight-driving branch nor Jacobians are needed. RADAR updates
+    push sigma points through the shared polar model; LIDAR stays linear and
+    uses the EKF update.
+    """
+
+    n_x = 5
+    n_aug = 7
+
+    def __init__(self, *args, **kwargs):
+        super(UKFTracker, self).__init__(*args, **kwargs)
+        self.lam_aug = 3. - self.n_aug
+        self.lam = 3. - self.n_x
+        self.weights_aug = sigma_weights(self.n_aug, self.lam_aug)
+        self.weights = sigma_weights(self.n_x, self.lam)
+
+    def _moments(self, X, weights, angle):
+        # weighted mean and covariance of sigma points, wrapping column `angle`
+        mean = np.einsum('k,nkj->nj', weights, X)
+        diff = X - mean[:, None, :]
+        diff[:, :, angle] = control_psi(diff[:, :, angle])
+        return mean, diff, np.einsum('k,nki,nkj->nij', weights, diff, diff)
+
+    def predict(self, dt, idx=None):
+        idx = self._index(idx)
+        x = self.x[idx]
+        P = self.P[idx]
+        n = x.shape[0]
+        dt = np.broadcast_to(np.asarray(dt, dtype=np.float64), (n,))
+
+        x_aug = np.zeros((n, self.n_aug))
+        x_aug[:, :self.n_x] = x
+        P_aug = np.zeros((n, self.n_aug, self.n_aug))
+        P_aug[:, :self.n_x, :self.n_x] = P
+        P_aug[:, 5, 5] = self.Q_v[0]
+        P_aug[:, 6, 6] = self.Q_v[1]
+
+        X = sigma_points(x_aug, P_aug, self.lam_aug)
+        k = X.shape[1]
+        dt_k = np.repeat(dt, k)
+        X_flat = X.reshape(n * k, self.n_aug)
+        nu_a, nu_yaw_dd = X_flat[:, 5], X_flat[:, 6]
+        X_pred = ctrv_transition(X_flat[:, :self.n_x], dt_k)
+        X_pred[:, 0] += 0.5 * dt_k * dt_k * np.cos(X_flat[:, 3]) * nu_a
+        X_pred[:, 1] += 0.5 * dt_k * dt_k * np.sin(X_flat[:, 3]) * nu_a
+        X_pred[:, 2] += dt_k * nu_a
+        X_pred[:, 3] += 0.5 * dt_k * dt_k * nu_yaw_dd
+        X_pred[:, 4] += dt_k * nu_yaw_dd
+        X_pred = X_pred.reshape(n, k, self.n_x)
+
+        x, _, P = self._moments(X_pred, self.weights_aug, 3)
+        x[:, 3] = control_psi(x[:, 3])
+        self.x[idx] = x
+        self.P[idx] = P
+
+    def update_radar(self, z, idx=None):
+        idx = self._index(idx)
+        z = np.atleast_2d(z)
+        x = self.x[idx]
+        P = self.P[idx]
+        n = x.shape[0]
+
+        X = sigma_points(x, P, self.lam)
+        k = X.shape[1]
+        Z = radar_measurement(X.reshape(n * k, self.n_x)).reshape(n, k, 3)
+        z_pred, dZ, S = self._moments(Z, self.weights, 1)
+        S += self.R_radar
+
+        dX = X - x[:, None, :]
+        dX[:, :, 3] = control_psi(dX[:, :, 3])
+        T = np.einsum('k,nki,nkj->nij', self.weights, dX, dZ)
+        # K = T S^-1 with S symmetric
+        K = np.linalg.solve(S, T.transpose(0, 2, 1)).transpose(0, 2, 1)
+
+        y = z - z_pred
+        y[:, 1] = control_psi(y[:, 1])
+        x = x + np.matmul(K, y[:, :, None])[:, :, 0]
+        x[:, 3] = control_psi(x[:, 3])
+        self.x[idx] = x
+        self.P[idx] = P - np.matmul(np.matmul(K, S), K.transpose(0, 2, 1))
+
+
+trackers = {'ekf': EKFTracker, 'ukf': UKFTracker}
 
 
 def rmse(estimates, actual):
     result = np.sqrt(np.mean((estimates-actual)**2))
     return result
 
-print(rmse(np.array(px), np.array(gpx)),
-      rmse(np.array(py), np.array(gpy)),
-      rmse(np.array(vx), np.array(gvx)),
-      rmse(np.array(vy), np.array(gvy)))
 
-# write to the output file
-stack = [px, py, vx, vy, mx, my, gpx, gpy, gvx, gvy]
-stack = np.array(stack)
-stack = stack.T
-np.savetxt('output.csv', stack, '%.6f')
+# one parsed line of the sensor log, sensor is 0.0 for LIDAR and 1.0 for RADAR,
+# z holds px, py (LIDAR, third entry unused) or rho, phi, rho_dot (RADAR)
+measurement_dtype = np.dtype([('sensor', np.float64),
+                              ('z', np.float64, (3,)),
+                              ('t', np.int64),
+                              ('truth', np.float64, (4,))])
+
+
+def read_measurements(source, chunk_size=1024):
+    """
+    Parse a LIDAR/RADAR log into record arrays of `measurement_dtype`.
+
+    `source` is a file name, '-' for stdin, or an open file object. Yields
+    chunks of at most `chunk_size` records so that the whole log is never
+    held in memory.
+    """
+    if source == '-':
+        f, close = sys.stdin, False
+    elif hasattr(source, 'readline'):
+        f, close = source, False
+    else:
+        f, close = open(source, 'r'), True
+
+    chunk = np.zeros(chunk_size, dtype=measurement_dtype)
+    count = 0
+    try:
+        for line in f:
+            numbers = line.split()
+            if not numbers:
+                continue
+            record = chunk[count]
+            if numbers[0] == 'L':
+                record['sensor'] = 0.0
+                record['z'] = (float(numbers[1]), float(numbers[2]), 0.0)
+                record['t'] = int(numbers[3])
+                record['truth'] = [float(item) for item in numbers[4:8]]
+            else:
+                record['sensor'] = 1.0
+                record['z'] = [float(item) for item in numbers[1:4]]
+                record['t'] = int(numbers[4])
+                record['truth'] = [float(item) for item in numbers[5:9]]
+            count += 1
+            if count == chunk_size:
+                yield chunk.copy()
+                count = 0
+        if count:
+            yield chunk[:count].copy()
+    finally:
+        if close:
+            f.close()
+
+
+def iter_measurements(source, chunk_size=1024):
+    for chunk in read_measurements(source, chunk_size):
+        for record in chunk:
+            yield record
+
+
+def run_fusion(source, output='output.csv', tracker=None, chunk_size=1024):
+    """
+    Stream a sensor log through a single-track filter.
+
+    Rows of px, py, vx, vy, mx, my, gpx, gpy, gvx, gvy are appended to
+    `output` (file name or open file, None to skip) once per chunk, and the
+    RMSE of px, py, vx, vy is accumulated on the fly. Returns the RMSE and
+    the mean time per filter update in seconds.
+    """
+    if tracker is None:
+        tracker = EKFTracker(1)
+    if output is None or hasattr(output, 'write'):
+        fout, close = output, False
+    else:
+        fout, close = open(output, 'w'), True
+
+    # columns: px, py, vx, vy, mx, my, gpx, gpy, gvx, gvy
+    rows = np.zeros((chunk_size, 10))
+    sq_err = np.zeros(4)
+    n_rows = 0
+    elapsed = 0.
+    initialized = False
+    try:
+        for chunk in read_measurements(source, chunk_size):
+            count = 0
+            for record in chunk:
+                z = record['z']
+                if not initialized:
+                    if record['sensor'] == 0.0:
+                        print('Initialize with LIDAR measurement!')
+                        tracker.init_lidar(z[:2], record['t'])
+                    else:
+                        print('Initialize with RADAR measurement!')
+                        tracker.init_radar(z, record['t'])
+                    initialized = True
+                    continue
+
+                start = time.time()
+                if record['sensor'] == 0.0:
+                    tracker.step(0.0, z[:2], record['t'])
+                    m_x, m_y = z[0], z[1]
+                else:
+                    tracker.step(1.0, z, record['t'])
+                    m_x, m_y = z[0] * np.cos(z[1]), z[0] * np.sin(z[1])
+                elapsed += time.time() - start
+
+                v_x, v_y = tracker.velocities()
+                row = rows[count]
+                row[:4] = tracker.x[0, 0], tracker.x[0, 1], v_x[0], v_y[0]
+                row[4:6] = m_x, m_y
+                row[6:] = record['truth']
+                count += 1
+
+            sq_err += ((rows[:count, :4] - rows[:count, 6:]) ** 2).sum(axis=0)
+            n_rows += count
+            if fout is not None and count:
+                np.savetxt(fout, rows[:count], '%.6f')
+    finally:
+        if close:
+            fout.close()
+
+    return np.sqrt(sq_err / max(n_rows, 1)), elapsed / max(n_rows, 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='LIDAR/RADAR sensor fusion')
+    parser.add_argument('log', type=str, nargs='?', default='data_synthetic.txt',
+                        help='Sensor log, - to read from stdin.')
+    parser.add_argument('output', type=str, nargs='?', default='output.csv',
+                        help='CSV file the estimates and ground truth are written to.')
+    parser.add_argument('--filter', type=str, default='ekf', choices=sorted(trackers),
+                        help='Filter backend.')
+    args = parser.parse_args()
+
+    error, per_update = run_fusion(args.log, args.output, trackers[args.filter](1))
+    print('RMSE px, py, vx, vy:', *error)
+    print('{} update: {:.1f} us'.format(args.filter.upper(), per_update * 1e6))
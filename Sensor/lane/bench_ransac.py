@@ -0,0 +1,65 @@
+from __future__ import print_function
+import os
+import sys
+import timeit
+import numpy as np
+import cv2
+
+from image import (LaneDetector, Collect_points, collect_points, ransac_fit,
+                   get_random_samples, compute_model_parameter, model_verification,
+                   erase_outliers)
+from lane_pipeline import synthetic_road
+
+
+# loop RANSAC as done by ransac_line_fitting, without the module globals
+def legacy_ransac(lines, min=100):
+    best_line = np.array([0,0,0])
+    for i in range(30):
+        sample = get_random_samples(lines)
+        parameter = compute_model_parameter(sample)
+        cost = model_verification(parameter, lines)
+        if cost < min: # update best_line
+            min = cost
+            best_line = parameter
+        if min < 3: break
+    return best_line, erase_outliers(best_line, lines)
+
+
+def load_images(folder):
+    names = sorted(os.listdir(folder))
+    images = [cv2.imread(os.path.join(folder, name)) for name in names]
+    return [img for img in images if img is not None]
+
+
+if __name__ == '__main__':
+    # usage: python bench_ransac.py [image_folder], e.g. img/
+    if len(sys.argv) > 1:
+        images = load_images(sys.argv[1])
+    else:
+        images = [synthetic_road(seed=i) for i in range(10)]
+
+    detector = LaneDetector(seed=0)
+    groups = []
+    for img in images:
+        for lines in detector.find_lines(img):
+            if len(lines):
+                groups.append(lines)
+    print('{} images, {} line groups'.format(len(images), len(groups)))
+
+    for lines in groups:
+        assert np.array_equal(Collect_points(lines), collect_points(lines))
+
+    def old():
+        for lines in groups:
+            legacy_ransac(Collect_points(lines))
+
+    rng = np.random.RandomState(0)
+
+    def new():
+        for lines in groups:
+            ransac_fit(collect_points(lines), rng)
+
+    t_old = min(timeit.repeat(old, number=1, repeat=5)) / len(groups)
+    t_new = min(timeit.repeat(new, number=1, repeat=5)) / len(groups)
+    print('loop RANSAC      : {:.3f} ms per lane'.format(t_old * 1e3))
+    print('vectorized RANSAC: {:.3f} ms per lane ({:.1f}x)'.format(t_new * 1e3, t_old / t_new))
@@ -6,6 +6,7 @@ import numpy as np
 import cv2
 import math
 import time
+from collections import deque
 
 def gaussian_blur(img, kernel_size):
     """Applies a Gaussian Noise kernel"""
@@ -134,7 +135,7 @@ def weighted_img(img, initial_img, a=0.8, b=1., r=0.):
 	
 	
 import random
-fit_result, l_fit_result, r_fit_result, L_lane, R_lane = [], [], [], [], []
+fit_result, l_fit_result, r_fit_result = [], [], []
 
 def Collect_points(lines):
 
@@ -155,6 +156,61 @@ def Collect_points(lines):
                     interp = np.concatenate((interp,new_point),axis = 0)                
     return interp
 
+def collect_points(lines, step=5):
+    """
+    Vectorized Collect_points.
+
+    Returns the segment end points followed by points interpolated every
+    `step` rows along each segment, generated as one array.
+    """
+    lines = np.asarray(lines).reshape(-1, 4)
+    ends = lines.reshape(-1, 2)
+    dx = lines[:,2] - lines[:,0]
+    dy = lines[:,3] - lines[:,1]
+    valid = (np.abs(dy) > step) & (dx != 0)
+    lines, dx, dy = lines[valid], dx[valid], dy[valid]
+    slope = dx / dy.astype(np.float64)
+
+    counts = (np.abs(dy) + step - 1) // step
+    seg = np.repeat(np.arange(len(lines)), counts)
+    m = (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)) * step
+    sign = np.sign(slope)[seg]
+    interp = np.empty((len(seg), 2), dtype=ends.dtype)
+    interp[:,0] = lines[seg,0] + sign * m * slope[seg]
+    interp[:,1] = lines[seg,1] + sign * m
+    return np.concatenate((ends, interp), axis=0)
+
+def ransac_fit(points, rng=np.random, n_hypotheses=30, min=100, inlier_dist=13):
+    """
+    Vectorized RANSAC line fit.
+
+    Draws all `n_hypotheses` point pairs at once, scores every hypothesis
+    against every point with one broadcast distance computation and returns
+    the best (a, b, c) of ax+by+c = 0 with its inliers, or (None, None) if no
+    hypothesis has an average distance below `min`.
+    """
+    points = np.asarray(points)
+    if len(points) < 2:
+        return None, None
+    # oversample to replace pairs sharing an x value
+    i = rng.randint(len(points), size=3 * n_hypotheses)
+    j = rng.randint(len(points), size=3 * n_hypotheses)
+    ok = points[i,0] != points[j,0]
+    i, j = i[ok][:n_hypotheses], j[ok][:n_hypotheses]
+    if len(i) == 0:
+        return None, None
+
+    p1, p2 = points[i].astype(np.float64), points[j].astype(np.float64)
+    # y = mx+n
+    m = (p2[:,1] - p1[:,1]) / (p2[:,0] - p1[:,0])
+    n = p1[:,1] - m * p1[:,0]
+    distance = np.abs(m[:,None] * points[:,0] - points[:,1] + n[:,None]) / np.sqrt(m * m + 1)[:,None]
+    cost = distance.mean(axis=1)
+    best = np.argmin(cost)
+    if cost[best] >= min:
+        return None, None
+    return np.array([m[best], -1, n[best]]), points[distance[best] < inlier_dist]
+
 def get_random_samples(lines):
     one = random.choice(lines)
     two = random.choice(lines)
@@ -201,7 +257,7 @@ def get_fitline(img, f_lines):
 
     rows,cols = img.shape[:2]
     output = cv2.fitLine(f_lines,cv2.DIST_L2,0, 0.01, 0.01)
-    vx, vy, x, y = output[0], output[1], output[2], output[3]
+    vx, vy, x, y = output.ravel()
     x1, y1 = int(((img.shape[0]-1)-y)/vy*vx + x) , img.shape[0]-1
     x2, y2 = int(((img.shape[0]/2+100)-y)/vy*vx + x) , int(img.shape[0]/2+100)
     result = [x1,y1,x2,y2]
@@ -268,66 +324,135 @@ def ransac_line_fitting(img, lines, min=100):
         r_fit_result = fit_result
         return r_fit_result
     
-def detect_lanes_img(img):
-
-    height, width = img.shape[:2]
-
-    # Set ROI
-    vertices = np.array([[(50,height),(width/2-45, height/2+60), (width/2+45, height/2+60), (width-50,height)]], dtype=np.int32)
-    ROI_img = region_of_interest(img, vertices)
-    
-    # Convert to grayimage
-    #g_img = grayscale(img)
-       
-    # Apply gaussian filter
-    blur_img = gaussian_blur(ROI_img, 3)
-        
-    # Apply Canny edge transform
-    canny_img = canny(blur_img, 60, 210)
-    # to except contours of ROI image
-    vertices2 = np.array([[(52,height),(width/2-43, height/2+62), (width/2+43, height/2+62), (width-52,height)]], dtype=np.int32)
-    canny_img = region_of_interest(canny_img, vertices2)
-
-    # Perform hough transform
-    # Get first candidates for real lane lines  
-    line_arr = hough_lines(canny_img, 2, 1 * np.pi/180, 50, 100, 150)
-    
-    #draw_lines(img, line_arr, thickness=2)
-
-    line_arr = np.squeeze(line_arr)
-    # Get slope degree to separate 2 group (+ slope , - slope)
-    slope_degree = (np.arctan2(line_arr[:,1] - line_arr[:,3], line_arr[:,0] - line_arr[:,2]) * 180) / np.pi
-
-    # ignore horizontal slope lines
-    line_arr = line_arr[np.abs(slope_degree)<160]
-    slope_degree = slope_degree[np.abs(slope_degree)<160]
-    # ignore vertical slope lines
-    line_arr = line_arr[np.abs(slope_degree)>95]
-    slope_degree = slope_degree[np.abs(slope_degree)>95]
-    L_lines, R_lines = line_arr[(slope_degree>0),:], line_arr[(slope_degree<0),:]
-    #print(line_arr.shape,'  ',L_lines.shape,'  ',R_lines.shape)
-    
-    # interpolation & collecting points for RANSAC
-    L_interp = Collect_points(L_lines)
-    R_interp = Collect_points(R_lines)
+class LaneDetector(object):
+    """
+    RANSAC lane detector holding its own state, one instance per camera stream.
 
-    #draw_circle(img,L_interp,(255,255,0))
-    #draw_circle(img,R_interp,(0,255,255))
+    ROI masks and all intermediate images are allocated once per input
+    resolution and reused on every frame. Past fits are kept in bounded ring
+    buffers of `history` frames and averaged for smoothing.
 
-    # erase outliers based on best line
-    left_fit_line = ransac_line_fitting(img, L_interp)
-    right_fit_line = ransac_line_fitting(img, R_interp)
+    The image returned by detect() is an internal buffer that is overwritten
+    by the next call unless `out` is given.
+    """
 
-    # smoothing by using previous frames
-    L_lane.append(left_fit_line), R_lane.append(right_fit_line)
+    def __init__(self, history=10, seed=None):
+        self.history = history
+        self.rng = np.random.RandomState(seed)
+        self.L_lane = deque(maxlen=history)
+        self.R_lane = deque(maxlen=history)
+        self.left_fit = None
+        self.right_fit = None
+        self._buffers = {}
+
+    def _prepare(self, shape):
+        buffers = self._buffers.get(shape)
+        if buffers is not None:
+            return buffers
+
+        height, width = shape[:2]
+        # Set ROI
+        vertices = np.array([[(50,height),(width/2-45, height/2+60), (width/2+45, height/2+60), (width-50,height)]], dtype=np.int32)
+        # to except contours of ROI image
+        vertices2 = np.array([[(52,height),(width/2-43, height/2+62), (width/2+43, height/2+62), (width-52,height)]], dtype=np.int32)
+
+        mask = np.zeros(shape, dtype=np.uint8)
+        cv2.fillPoly(mask, vertices, (255,) * shape[2] if len(shape) > 2 else 255)
+        mask2 = np.zeros((height, width), dtype=np.uint8)
+        cv2.fillPoly(mask2, vertices2, 255)
+
+        buffers = {
+            'mask': mask,
+            'mask2': mask2,
+            'roi': np.empty(shape, dtype=np.uint8),
+            'blur': np.empty(shape, dtype=np.uint8),
+            'canny': np.empty((height, width), dtype=np.uint8),
+            'lane': np.empty(shape, dtype=np.uint8),
+            'out': np.empty(shape, dtype=np.uint8),
+        }
+        self._buffers[shape] = buffers
+        return buffers
+
+    def reset(self):
+        self.L_lane.clear()
+        self.R_lane.clear()
+        self.left_fit = None
+        self.right_fit = None
+
+    def _fit(self, img, points):
+        # RANSAC on the collected points, None if no line was found
+        par, inliers = ransac_fit(points, self.rng)
+        if par is None or len(inliers) < 2:
+            return None
+        return get_fitline(img, inliers.astype(np.float32))
+
+    def find_lines(self, img):
+        buffers = self._prepare(img.shape)
+
+        ROI_img = cv2.bitwise_and(img, buffers['mask'], dst=buffers['roi'])
+        # Apply gaussian filter
+        blur_img = cv2.GaussianBlur(ROI_img, (3, 3), 0, dst=buffers['blur'])
+        # Apply Canny edge transform
+        canny_img = cv2.Canny(blur_img, 60, 210, edges=buffers['canny'])
+        canny_img = cv2.bitwise_and(canny_img, buffers['mask2'], dst=buffers['canny'])
+
+        # Perform hough transform
+        # Get first candidates for real lane lines
+        lines = cv2.HoughLinesP(canny_img, 2, 1 * np.pi/180, 50, np.array([]), minLineLength=100, maxLineGap=150)
+        if lines is None:
+            return np.zeros((0, 4), dtype=np.int32), np.zeros((0, 4), dtype=np.int32)
+        line_arr = lines.reshape(-1, 4)
+
+        # Get slope degree to separate 2 group (+ slope , - slope)
+        slope_degree = (np.arctan2(line_arr[:,1] - line_arr[:,3], line_arr[:,0] - line_arr[:,2]) * 180) / np.pi
+        # ignore horizontal and vertical slope lines
+        keep = (np.abs(slope_degree) < 160) & (np.abs(slope_degree) > 95)
+        line_arr, slope_degree = line_arr[keep], slope_degree[keep]
+        return line_arr[(slope_degree>0),:], line_arr[(slope_degree<0),:]
+
+    def fit(self, img):
+        """Raw (left, right) fits of one frame, None where no line was found. Keeps no history."""
+        L_lines, R_lines = self.find_lines(img)
+        # interpolation & collecting points for RANSAC
+        return self._fit(img, collect_points(L_lines)), self._fit(img, collect_points(R_lines))
+
+    def smooth(self, left, right):
+        """Adds the fits of the next frame to the history, returns the smoothed lines to draw."""
+        # missing fits fall back to the previous ones
+        if left is not None:
+            self.left_fit = left
+        if right is not None:
+            self.right_fit = right
+
+        # smoothing by using previous frames
+        if self.left_fit is not None:
+            self.L_lane.append(self.left_fit)
+        if self.right_fit is not None:
+            self.R_lane.append(self.right_fit)
+        return tuple(np.mean(history, axis=0) if len(history) == self.history else history[-1]
+                     for history in (self.L_lane, self.R_lane) if history)
+
+    def draw(self, img, lines, out=None):
+        buffers = self._prepare(img.shape)
+        lane = buffers['lane']
+        lane.fill(0)
+        for line in lines:
+            cv2.line(lane, (int(line[0]), int(line[1])), (int(line[2]), int(line[3])), (255,0,255), 10)
+
+        # add original image & extracted lane lines
+        if out is None:
+            out = buffers['out']
+        return cv2.addWeighted(img, 1, lane, 0.5, 0., dst=out)
+
+    def detect(self, img, out=None):
+        return self.draw(img, self.smooth(*self.fit(img)), out)
+
+
+_default_detector = LaneDetector()
 
-    if len(L_lane) > 10:
-        left_fit_line = smoothing(L_lane, 10)
-    if len(R_lane) > 10:
-        right_fit_line = smoothing(R_lane, 10)
-    final = draw_fitline(img, left_fit_line, right_fit_line)
 
-    return final
+def detect_lanes_img(img):
+    return _default_detector.detect(img).copy()
 	
 	
 def pipeline(image):
@@ -364,14 +489,15 @@ def pipeline(image):
     
     return lines_edges
    
-img=cv2.imread("img/solidWhiteRight.jpg")
-#image=pipeline("img/solidWhiteRight.jpg")
-#image=pipeline("img/gta.jpg")
-image = detect_lanes_img(img)
-#print ("this image is:",type(image),'with dimesions:',image.shape)
-#plt.imshow(image,cmap='gray')
-plt.imshow(image,cmap='gray')
-plt.show()
+if __name__ == '__main__':
+    img=cv2.imread("img/solidWhiteRight.jpg")
+    #image=pipeline("img/solidWhiteRight.jpg")
+    #image=pipeline("img/gta.jpg")
+    image = detect_lanes_img(img)
+    #print ("this image is:",type(image),'with dimesions:',image.shape)
+    #plt.imshow(image,cmap='gray')
+    plt.imshow(image,cmap='gray')
+    plt.show()
 
 """
 last_time = time.time()
@@ -0,0 +1,284 @@
+from __future__ import print_function
+import os
+import time
+import heapq
+import argparse
+import threading
+from collections import deque
+import numpy as np
+import cv2
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from image import LaneDetector
+
+
+# frame sources, all generators of BGR uint8 frames
+
+def video_frames(path):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError('cannot open video {}'.format(path))
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            yield frame
+    finally:
+        cap.release()
+
+
+def image_frames(folder):
+    for name in sorted(os.listdir(folder)):
+        frame = cv2.imread(os.path.join(folder, name))
+        if frame is not None:
+            yield frame
+
+
+def synthetic_road(height=540, width=960, seed=0):
+    rng = np.random.RandomState(seed)
+    img = (rng.rand(height, width, 3) * 40 + 60).astype(np.uint8)
+    shift = rng.randint(-20, 20)
+    cv2.line(img, (150 + shift, height), (width//2 - 30 + shift, height//2 + 70), (255, 255, 255), 8)
+    cv2.line(img, (width - 150 + shift, height), (width//2 + 30 + shift, height//2 + 70), (255, 255, 255), 8)
+    return img
+
+
+def synthetic_frames(n_frames=300, height=540, width=960):
+    for i in range(n_frames):
+        yield synthetic_road(height, width, seed=i)
+
+
+class VideoSink(object):
+    """Writes annotated frames to a video file, opened on the first frame."""
+
+    def __init__(self, path, fps=25., fourcc='MJPG'):
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self.writer = None
+
+    def write(self, frame):
+        if self.writer is None:
+            height, width = frame.shape[:2]
+            self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc),
+                                          self.fps, (width, height))
+        self.writer.write(frame)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+class StageStats(object):
+    """Latency samples of one stage, keeps the last `maxlen` for percentiles."""
+
+    def __init__(self, name, maxlen=10000):
+        self.name = name
+        self.samples = deque(maxlen=maxlen)
+        self.count = 0
+        self.total = 0.
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+
+    def summary(self):
+        if not self.count:
+            return '{:>10}: no samples'.format(self.name)
+        samples = np.array(self.samples) * 1e3
+        return '{:>10}: n={:<6d} mean={:7.2f} ms  p50={:7.2f} ms  p99={:7.2f} ms'.format(
+            self.name, self.count, self.total / self.count * 1e3,
+            np.percentile(samples, 50), np.percentile(samples, 99))
+
+
+_DONE = object()
+
+
+class LanePipeline(object):
+    """
+    capture -> detect -> render pipeline over bounded queues.
+
+    One thread pulls frames from `source`, `workers` threads each fit lanes
+    with their own LaneDetector (OpenCV releases the GIL, so they overlap),
+    and one thread smooths the fits, draws them and hands the annotated
+    frames to `sink` in capture order. The workers keep no history, so the
+    smoothing always sees consecutive frames whatever the number of workers.
+    When `drop` is set, frames arriving while the detector queue is full are
+    dropped instead of waiting, so a live source never builds up latency.
+    """
+
+    def __init__(self, source, sink=None, workers=2, queue_size=4, drop=True,
+                 detector_factory=LaneDetector):
+        self.source = source
+        self.sink = sink
+        self.workers = workers
+        self.drop = drop
+        self.detector_factory = detector_factory
+        # the one detector that smooths and draws, fed in capture order
+        self.smoother = detector_factory()
+        self.in_queue = queue.Queue(maxsize=queue_size)
+        self.out_queue = queue.Queue(maxsize=queue_size)
+        self.stats = dict((name, StageStats(name)) for name in
+                          ('capture', 'queue', 'detect', 'render', 'write', 'total'))
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0
+        self.error = None
+        self.sink_error = False
+
+    def _fail(self, error):
+        # the first error of any stage, raised by run()
+        if self.error is None:
+            self.error = error
+
+    def _capture(self):
+        seq = 0
+        try:
+            frames = iter(self.source)
+            while True:
+                start = time.time()
+                try:
+                    frame = next(frames)
+                except StopIteration:
+                    break
+                now = time.time()
+                self.stats['capture'].add(now - start)
+                self.captured += 1
+                item = (seq, frame, now)
+                if self.drop:
+                    try:
+                        self.in_queue.put_nowait(item)
+                    except queue.Full:
+                        self.dropped += 1
+                        continue
+                else:
+                    self.in_queue.put(item)
+                seq += 1
+        except Exception as e:
+            self._fail(e)
+        finally:
+            for i in range(self.workers):
+                self.in_queue.put(_DONE)
+
+    def _detect(self):
+        item = None
+        try:
+            detector = self.detector_factory()
+            while True:
+                item = self.in_queue.get()
+                if item is _DONE:
+                    return
+                seq, frame, captured = item
+                start = time.time()
+                self.stats['queue'].add(start - captured)
+                fits = detector.fit(frame)
+                self.stats['detect'].add(time.time() - start)
+                self.out_queue.put((seq, frame, captured, fits))
+        except Exception as e:
+            self._fail(e)
+            # keep consuming, so the capture thread never blocks on a full queue, and pass the
+            # frames on as lost so the render thread does not wait for them
+            while item is not _DONE:
+                if item is not None:
+                    self.out_queue.put((item[0], None, item[2], None))
+                item = self.in_queue.get()
+        finally:
+            self.out_queue.put(_DONE)
+
+    def _render(self):
+        pending = []
+        next_seq = 0
+        finished = 0
+        # keep consuming after a render or sink error, so the detect threads never block on a full queue
+        while finished < self.workers:
+            item = self.out_queue.get()
+            if item is _DONE:
+                finished += 1
+                continue
+            heapq.heappush(pending, item)
+            # write in capture order
+            while pending and pending[0][0] == next_seq:
+                self._write(*heapq.heappop(pending))
+                next_seq += 1
+        # frames behind a sequence number that never arrived
+        while pending:
+            self._write(*heapq.heappop(pending))
+
+    def _write(self, seq, frame, captured, fits):
+        # lost frames and frames after a render or sink error are not written
+        if frame is None or self.sink_error:
+            return
+        try:
+            start = time.time()
+            # the input frame is not needed afterwards, render into it
+            self.smoother.draw(frame, self.smoother.smooth(*fits), out=frame)
+            rendered = time.time()
+            if self.sink is not None:
+                self.sink.write(frame)
+        except Exception as e:
+            self.sink_error = True
+            self._fail(e)
+            return
+        now = time.time()
+        self.stats['render'].add(rendered - start)
+        self.stats['write'].add(now - rendered)
+        self.stats['total'].add(now - captured)
+        self.written += 1
+
+    def run(self):
+        threads = [threading.Thread(target=self._capture)]
+        threads += [threading.Thread(target=self._detect) for i in range(self.workers)]
+        threads += [threading.Thread(target=self._render)]
+        start = time.time()
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        if self.sink is not None:
+            self.sink.close()
+        self.elapsed = time.time() - start
+        if self.error is not None:
+            raise self.error
+        return self.stats
+
+    def report(self):
+        lines = ['captured {} frames, dropped {}, wrote {} in {:.2f} s ({:.1f} fps)'.format(
+            self.captured, self.dropped, self.written, self.elapsed,
+            self.written / max(self.elapsed, 1e-9))]
+        lines += [self.stats[name].summary() for name in ('capture', 'queue', 'detect', 'render', 'write', 'total')]
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless lane detection pipeline')
+    parser.add_argument('source', type=str,
+                        help='Video file, image folder, or "synthetic".')
+    parser.add_argument('output', type=str, nargs='?', default='',
+                        help='Annotated output video, nothing is written if omitted.')
+    parser.add_argument('--workers', type=int, default=2, help='Detector threads.')
+    parser.add_argument('--queue', type=int, default=4, help='Bounded queue size.')
+    parser.add_argument('--fps', type=float, default=25., help='Output frame rate.')
+    parser.add_argument('--no-drop', action='store_true',
+                        help='Block the source instead of dropping frames.')
+    args = parser.parse_args()
+
+    if args.source == 'synthetic':
+        source = synthetic_frames()
+    elif os.path.isdir(args.source):
+        source = image_frames(args.source)
+    else:
+        source = video_frames(args.source)
+    sink = VideoSink(args.output, args.fps) if args.output else None
+
+    pipeline = LanePipeline(source, sink, workers=args.workers, queue_size=args.queue,
+                            drop=not args.no_drop)
+    pipeline.run()
+    print(pipeline.report())
@@ -1,82 +1,162 @@
 # encoding: UTF-8
 # 系统模块
-from Queue import Queue, Empty
+try:
+    from Queue import PriorityQueue, Empty
+except ImportError:
+    from queue import PriorityQueue, Empty
+from itertools import count
 from threading import *
+
+# 停止标记,优先级最高,保证Stop不用等待队列中的事件
+_STOP = (float('-inf'), -1, None)
+
 ########################################################################
 class EventManager:
     #----------------------------------------------------------------------
-    def __init__(self):
-        """初始化事件管理器"""
-        # 事件对象列表
-        self.__eventQueue = Queue()
+    def __init__(self, workers=0, batchSize=1):
+        """初始化事件管理器
+
+        workers为0时所有事件在同一个线程中处理(原来的模式);
+        大于0时每种事件类型有自己的队列和workers个处理线程,
+        一个慢的处理函数只会阻塞它自己的事件类型。
+        batchSize为每次从队列中最多取出的事件数,批量交给处理函数。
+        """
+        self.__workers = workers
+        self.__batchSize = max(1, batchSize)
         # 事件管理器开关
         self.__active = False
-        # 事件处理线程
-        self.__thread = Thread(target = self.__Run)
+        # 事件序号,同优先级的事件按发送顺序处理
+        self.__counter = count()
+        self.__lock = Lock()
 
         # 这里的__handlers是一个字典，用来保存对应的事件的响应函数
-        # 其中每个键对应的值是一个列表，列表中保存了对该事件监听的响应函数，一对多
+        # 其中每个键对应的值是一个元组，元组中保存了对该事件监听的(响应函数, 是否批量)，一对多
+        # 修改时整体替换元组，处理线程无需加锁
         self.__handlers = {}
 
+        # 事件队列和事件处理线程,单线程模式下键为None
+        self.__queues = {}
+        self.__threads = []
+        if self.__workers <= 0:
+            self.__queues[None] = PriorityQueue()
+
     #----------------------------------------------------------------------
-    def __Run(self):
+    def __Run(self, queue):
         """引擎运行"""
-        while self.__active == True:
-            try:
-                # 获取事件的阻塞时间设为1秒
-                event = self.__eventQueue.get(block = True, timeout = 1)  
-                self.__EventProcess(event)
-            except Empty:
-                pass
+        batchSize = self.__batchSize
+        while True:
+            # 阻塞等待事件,Stop时放入停止标记立即唤醒
+            item = queue.get()
+            if item is _STOP:
+                break
+            events = [item[2]]
+            while len(events) < batchSize:
+                try:
+                    item = queue.get_nowait()
+                except Empty:
+                    break
+                if item is _STOP:
+                    queue.put(_STOP)
+                    break
+                events.append(item[2])
+            self.__EventProcess(events)
 
     #----------------------------------------------------------------------
-    def __EventProcess(self, event):
+    def __EventProcess(self, events):
         """处理事件"""
-        # 检查是否存在对该事件进行监听的处理函数
-        if event.type_ in self.__handlers:
+        # 同一批中按事件类型分组,保持各类型内部的顺序
+        groups = {}
+        for event in events:
+            groups.setdefault(event.type_, []).append(event)
+        for type_, group in groups.items():
+            # 检查是否存在对该事件进行监听的处理函数
             # 若存在，则按顺序将事件传递给处理函数执行
-            for handler in self.__handlers[event.type_]:
-                handler(event)
+            for handler, batch in self.__handlers.get(type_, ()):
+                if batch:
+                    handler(group)
+                else:
+                    for event in group:
+                        handler(event)
+
+    #----------------------------------------------------------------------
+    def __StartThreads(self, queue):
+        """为一个队列启动处理线程"""
+        for i in range(max(1, self.__workers)):
+            thread = Thread(target=self.__Run, args=(queue,))
+            thread.start()
+            self.__threads.append((queue, thread))
+
+    #----------------------------------------------------------------------
+    def __GetQueue(self, type_):
+        """获取事件类型对应的队列,多线程模式下按需创建"""
+        if self.__workers <= 0:
+            return self.__queues[None]
+        queue = self.__queues.get(type_)
+        if queue is None:
+            with self.__lock:
+                queue = self.__queues.get(type_)
+                if queue is None:
+                    queue = PriorityQueue()
+                    self.__queues[type_] = queue
+                    if self.__active:
+                        self.__StartThreads(queue)
+        return queue
 
     #----------------------------------------------------------------------
     def Start(self):
         """启动"""
-        # 将事件管理器设为启动
-        self.__active = True
-        # 启动事件处理线程
-        self.__thread.start()
+        with self.__lock:
+            # 将事件管理器设为启动
+            self.__active = True
+            # 启动事件处理线程
+            for queue in self.__queues.values():
+                self.__StartThreads(queue)
 
     #----------------------------------------------------------------------
     def Stop(self):
         """停止"""
-        # 将事件管理器设为停止
-        self.__active = False
+        with self.__lock:
+            # 将事件管理器设为停止
+            self.__active = False
+            threads, self.__threads = self.__threads, []
+        # 每个线程一个停止标记,不再轮询等待
+        for queue, thread in threads:
+            queue.put(_STOP)
         # 等待事件处理线程退出
-        self.__thread.join()
+        for queue, thread in threads:
+            thread.join()
 
     #----------------------------------------------------------------------
-    def AddEventListener(self, type_, handler):
-        """绑定事件和监听器处理函数"""
-        # 尝试获取该事件类型对应的处理函数列表，若无则创建
-        try:
-            handlerList = self.__handlers[type_]
-        except KeyError:
-            handlerList = []
-            
-        self.__handlers[type_] = handlerList
-        # 若要注册的处理器不在该事件的处理器列表中，则注册该事件
-        if handler not in handlerList:
-            handlerList.append(handler)
-            
+    def AddEventListener(self, type_, handler, batch=False):
+        """绑定事件和监听器处理函数
+
+        batch为True时处理函数每次收到一个事件列表
+        """
+        with self.__lock:
+            # 尝试获取该事件类型对应的处理函数列表，若无则创建
+            handlerList = self.__handlers.get(type_, ())
+            # 若要注册的处理器不在该事件的处理器列表中，则注册该事件
+            if handler not in [h for h, b in handlerList]:
+                self.__handlers[type_] = handlerList + ((handler, batch),)
+        self.__GetQueue(type_)
+
     #----------------------------------------------------------------------
     def RemoveEventListener(self, type_, handler):
         """移除监听器的处理函数"""
-        #读者自己试着实现
-        
+        with self.__lock:
+            handlerList = tuple((h, b) for h, b in self.__handlers.get(type_, ()) if h != handler)
+            if handlerList:
+                self.__handlers[type_] = handlerList
+            else:
+                self.__handlers.pop(type_, None)
+
     #----------------------------------------------------------------------
-    def SendEvent(self, event):
-        """发送事件，向事件队列中存入事件"""
-        self.__eventQueue.put(event)
+    def SendEvent(self, event, priority=0):
+        """发送事件，向事件队列中存入事件
+
+        priority越大越先处理,相同优先级按发送顺序
+        """
+        self.__GetQueue(event.type_).put((-priority, next(self.__counter), event))
 
 ########################################################################
 """事件对象"""
@@ -84,6 +164,3 @@ class Event:
     def __init__(self, type_=None):
         self.type_ = type_      # 事件类型
         self.dict = {}          # 字典用于保存具体的事件数据
-
-
-
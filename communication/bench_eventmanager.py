@@ -0,0 +1,56 @@
+# encoding: UTF-8
+# 事件吞吐量测试: 1/8/64个处理函数,比较单线程模式和按类型分线程+批量模式
+# 用法: python bench_eventmanager.py [事件数]
+from __future__ import print_function
+import sys
+import time
+from threading import Event as Flag, Lock
+
+from EventManager import EventManager, Event
+
+
+def bench(n_handlers, n_events, workers, batchSize, batch):
+    # 每个处理函数监听一种事件类型,事件轮流发送到各类型
+    done = Flag()
+    lock = Lock()
+    received = [0]
+
+    def count(n):
+        with lock:
+            received[0] += n
+            if received[0] == n_events:
+                done.set()
+
+    def handler(event):
+        count(1)
+
+    def batchHandler(events):
+        count(len(events))
+
+    eventManager = EventManager(workers=workers, batchSize=batchSize)
+    types = ['Event_%d' % i for i in range(n_handlers)]
+    for type_ in types:
+        eventManager.AddEventListener(type_, batchHandler if batch else handler, batch=batch)
+    events = [Event(type_=types[i % n_handlers]) for i in range(n_events)]
+
+    eventManager.Start()
+    start = time.time()
+    for event in events:
+        eventManager.SendEvent(event)
+    done.wait()
+    elapsed = time.time() - start
+    stop = time.time()
+    eventManager.Stop()
+    return n_events / elapsed, time.time() - stop
+
+
+if __name__ == '__main__':
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    modes = [('single thread', 0, 1, False),
+             ('per-type worker', 1, 1, False),
+             ('per-type, batch 64', 1, 64, True)]
+    print('%-20s %9s %14s %10s' % ('mode', 'handlers', 'events/s', 'stop ms'))
+    for n_handlers in (1, 8, 64):
+        for name, workers, batchSize, batch in modes:
+            rate, stop = bench(n_handlers, n_events, workers, batchSize, batch)
+            print('%-20s %9d %14.0f %10.2f' % (name, n_handlers, rate, stop * 1e3))
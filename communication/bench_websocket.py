@@ -0,0 +1,115 @@
+#coding=utf-8
+# 广播压力测试: N个本地客户端接收遥测数据流,统计消息吞吐量和p99扇出延迟
+# 用法: python bench_websocket.py [--clients 1000] [--messages 500] [--rate 100]
+
+import argparse
+import asyncio
+import base64
+import multiprocessing
+import os
+import struct
+import time
+
+from websocket import WebSocketServer, read_frame, encode_frame, OP_BINARY, OP_TEXT, OP_CLOSE
+
+# 遥测包: 发送时间戳, 序号, 速度, 转向, 油门, 再补齐到固定长度
+TELEMETRY = struct.Struct('!dIfff')
+
+
+async def client(host, port, latencies, ready):
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    writer.write(('GET / HTTP/1.1\r\nHost: %s:%d\r\nUpgrade: websocket\r\n'
+                  'Connection: Upgrade\r\nSec-WebSocket-Key: %s\r\n'
+                  'Sec-WebSocket-Version: 13\r\n\r\n' % (host, port, key)).encode('ascii'))
+    await reader.readuntil(b'\r\n\r\n')
+    ready.release()
+    while True:
+        fin, opcode, payload = await read_frame(reader, require_mask=False)
+        if opcode == OP_BINARY:
+            sent = TELEMETRY.unpack_from(payload)[0]
+            latencies.append(time.time() - sent)
+        elif opcode == OP_TEXT and payload == b'done':
+            break
+        elif opcode == OP_CLOSE:
+            break
+    writer.write(encode_frame(struct.pack('!H', 1000), OP_CLOSE, mask=True))
+    writer.close()
+
+
+def client_process(host, port, n_clients, connected, results):
+    async def run():
+        latencies = []
+        ready = asyncio.Semaphore(0)
+        tasks = [asyncio.ensure_future(client(host, port, latencies, ready)) for i in range(n_clients)]
+        for i in range(n_clients):
+            await ready.acquire()
+        connected.put(n_clients)
+        await asyncio.gather(*tasks)
+        return latencies
+    results.put(asyncio.run(run()))
+
+
+async def serve(args, connected, results, workers):
+    server = WebSocketServer(args.host, args.port, queue_size=args.queue, greet=False)
+    await server.start()
+    loop = asyncio.get_event_loop()
+    n = 0
+    while n < args.clients:
+        n += await loop.run_in_executor(None, connected.get)
+
+    padding = b'\x00' * max(args.size - TELEMETRY.size, 0)
+    interval = 1.0 / args.rate if args.rate > 0 else 0.
+    start = time.time()
+    for seq in range(args.messages):
+        server.broadcast(TELEMETRY.pack(time.time(), seq, 20.0, 0.1, 0.3) + padding)
+        # 按目标频率发送, 同时让出事件循环给发送协程
+        delay = start + (seq + 1) * interval - time.time()
+        await asyncio.sleep(max(delay, 0))
+    server.broadcast('done')
+
+    latencies = []
+    for i in range(workers):
+        latencies.extend(await loop.run_in_executor(None, results.get))
+    elapsed = time.time() - start
+    await server.close()
+    return latencies, elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='WebSocket broadcast benchmark')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--clients', type=int, default=1000, help='Number of subscribers.')
+    parser.add_argument('--messages', type=int, default=500, help='Telemetry messages to broadcast.')
+    parser.add_argument('--rate', type=float, default=100., help='Messages per second, 0 for unthrottled.')
+    parser.add_argument('--size', type=int, default=256, help='Telemetry payload bytes.')
+    parser.add_argument('--queue', type=int, default=64, help='Per-client send queue length.')
+    parser.add_argument('--procs', type=int, default=4, help='Client processes.')
+    args = parser.parse_args()
+
+    connected = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    per_proc = [args.clients // args.procs + (i < args.clients % args.procs) for i in range(args.procs)]
+    procs = [multiprocessing.Process(target=client_process,
+                                     args=(args.host, args.port, n, connected, results))
+             for n in per_proc if n]
+    # 先启动服务端再启动客户端
+    async def main():
+        task = asyncio.ensure_future(serve(args, connected, results, len(procs)))
+        await asyncio.sleep(0.2)
+        for p in procs:
+            p.start()
+        return await task
+    latencies, elapsed = asyncio.run(main())
+    for p in procs:
+        p.join()
+
+    latencies.sort()
+    count = len(latencies)
+    print('clients: %d  messages: %d  delivered: %d  dropped: %d' % (
+        args.clients, args.messages, count, args.clients * args.messages - count))
+    print('throughput: %.0f messages/s' % (count / elapsed))
+    if count:
+        print('fan-out latency: p50 %.2f ms  p99 %.2f ms  max %.2f ms' % (
+            latencies[count // 2] * 1e3, latencies[int(count * 0.99)] * 1e3, latencies[-1] * 1e3))
@@ -1,196 +1,285 @@
-#coding=utf-8
-
-import socket  
-import struct  
-import hashlib,base64  
-import threading,random  
-#线程,套接字,哈希表,随机数  
-  
-#存放链接客户fd,元组  
-connectionlist = {}  
-  
-#发送指定的消息  
-def sendMessage(message):  
-    #对全局变量的引用  
-    global connectionlist  
-    #向客户端集合中每个成员发送消息  
-    # %:字符串合成  
-    # ,:字符串叠加  
-    for connection in connectionlist.values():  
-        connection.send("\x00%s\xFF" % message)  
-  
-#删除连接,从集合中删除连接对象item(建立一个连接追加到连接中)  
-def deleteconnection(item):  
-    global connectionlist  
-    del connectionlist['connection'+item]  
-  
-#定义WebSocket对象(基于线程对象)  
-class WebSocket(threading.Thread):  
-    #  
-    def __init__(self,conn,index,name,remote, path="/"):  
-        #初始化线程  
-        threading.Thread.__init__(self)  
-        #初始化数据,全部存储到自己的数据结构中self  
-        self.conn = conn  
-        self.index = index  
-        self.name = name  
-        self.remote = remote  
-        self.path = path  
-        self.buffer = ""  
-      
-    #运行线程  
-    def run(self):  
-        #Log输出,套接字index启动  
-        print ('Socket%s Start!' % self.index ) 
-        headers = {}  
-        #Socket是否握手的标志,初始化为false.  
-        self.handshaken = False  
-        #循环执行如下逻辑  
-        while True:  
-            #如果没有进行握手  
-            if self.handshaken == False:  
-                #Log输出,Socket x开始与远程客户y进行握手过程  
-                print ('Socket%s Start Handshaken with %s!' % (self.index,self.remote)  )
-                #从客户端接受1kb数据，存放到buffer中  
-                self.buffer += self.conn.recv(1024)  
-                #如果接受数据中有\r\n\r\n的标志  
-                if self.buffer.find('\r\n\r\n') != -1:  
-                    #按照这种标志分割一次,结果为：header data(网页的解析)  
-                    #再对header 和 data部分进行单独的解析  
-                    header, data = self.buffer.split('\r\n\r\n', 1)  
-                    #对header进行分割后，取出后面的n-1个部分  
-                    for line in header.split("\r\n")[1:]:  
-                        #逐行的解析Request Header信息(Key,Value)  
-                        key, value = line.split(": ", 1)  
-                        #然后存放在一个Hash表中,方便访问  
-                        headers[key] = value  
-                    #人为定义Location的item的信息  
-                    #构造location:ws://localhost/path ?  
-                    headers["Location"] = "ws://%s%s" %(headers["Host"], self.path)  
-                    print ("Location:",headers["Location"] ) 
-                    print ("headers:",headers )
-                    #取出其中两项信息key1 key2  
-                    #key1 = headers["Sec-WebSocket-Key1"]  
-                      
-                    #key2 = headers["Sec-WebSocket-Key2"]  
-                    #Header解析完毕后，分析data部分  
-                    #如果data部分长度小于8的话，从客户端那边接续接受数据使得data变为8字节  
-                    if len(data) < 8:  
-                        data += self.conn.recv(8-len(data))  
-                    #将data的数据信息存放为key3变量(前面的第一个八个字节为key3)  
-                    #key3 = data[:8]  
-                    #将data后面的数据作为buffer进行存放  
-                    self.buffer = data[8:]  
-                    #根据key1,key2,key3产生token？  
-                    #根据客户的key1、key2、8字节的关键字  
-                    #产生一个16位的安全秘钥  
-                    #old-Protocol  
-                    #token = self.generate_token(key1, key2, key3)  
-                    #new Protocol  
-                    token = generate_token_2(self, key)  
-                    #握手过程,服务器构建握手的信息,进行验证和匹配  
-                    #Upgrade: WebSocket 表示为一个特殊的http请求,请求目的为从http协议升级到websocket协议  
-                    handshake = '\  
-                    HTTP/1.1 101 Web Socket Protocol Handshake\r\n\  
-                    Upgrade: WebSocket\r\n\  
-                    Connection: Upgrade\r\n\  
-                    Sec-WebSocket-Origin: %s\r\n\  
-                    Sec-WebSocket-Location: %s\r\n\r\n\  
-                    ' %(headers['Origin'], headers['Location'])  
-                    #服务端发送握手数据 & 根据Key产生的Token值  
-                    self.conn.send(handshake+token)  
-                    #这个操作之后才设定为握手状态  
-                    self.handshaken = True  
-                    #Log输出状态：套接字x与客户y握手成功。  
-                    print 'Socket%s Handshaken with %s success!' % (self.index,self.remote)  
-                    #向全部连接客户端集合发送消息,(环境套接字x的到来)  
-                    sendMessage('Welcome, '+self.name+' !')  
-            else:  
-                #如果已经握手  
-                #从客户端读取64字节的数据  
-                self.buffer += self.conn.recv(64)  
-                #如果数据中存在FF的标志，则按照此标志进行分解  
-                if self.buffer.find("\xFF")!=-1:  
-                    #分解方式啥含义??  
-                    s = self.buffer.split("\xFF")[0][1:]  
-                    #如果消息是'终止',则打印Socket退出  
-                    if s=='quit':  
-                        print 'Socket%s Logout!' % (self.index)  
-                        #全体同志Socket退出的状态(进行GUI更新准备)  
-                        sendMessage(self.name+' Logout')  
-                        #同时删除socket连接集合  
-                        deleteconnection(str(self.index))  
-                        #同时关闭对应的WebSocket连接(多线程关系)  
-                        self.conn.close()  
-                        break  
-                    else:  
-                        #否则输出,Socket x收到客户端的消息 y  
-                        print 'Socket%s Got msg:%s from %s!' % (self.index,s,self.remote)  
-                        #向全体的客户端输出连接的信息  
-                        sendMessage(self.name+':'+s)  
-                    #Buffer信息再一次的清空  
-                    self.buffer = ""  
-  
-def generate_token_2(self, key):  
-        key = key + '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'  
-        ser_key = hashlib.sha1(key).digest()  
-        return base64.b64encode(ser_key)  
-              
-def generate_token(self, key1, key2, key3):  
-    #list/tuple(ls)-list元组相互转换  
-    #这句话没看懂,如何理解key是否为数字  
-    num1 = int("".join([digit for digit in list(key1) if digit.isdigit()]))  
-    #解析key1中空格的个数  
-    spaces1 = len([char for char in list(key1) if char == " "])  
-    #解析后number2对象  
-    num2 = int("".join([digit for digit in list(key2) if digit.isdigit()]))  
-    #统计空格的个数?安全性验证  
-    spaces2 = len([char for char in list(key2) if char == " "])  
-    #按照一定的格式进行打包,然后进行网络传输(格式可以自己进行预订)  
-    #struck.pack：http://blog.sina.com.cn/s/blog_4b5039210100f1tu.html  
-    combined = struct.pack(">II", num1/spaces1, num2/spaces2) + key3  
-    #对打包的值进行md5解码后,并返回二进制的形式  
-    ##hexdigest() 为十六进制值，digest()为二进制值  
-    #处理MD5: http://wuqinzhong.blog.163.com/blog/static/4522231200942225810117/  
-    return hashlib.md5(combined).digest()  
-      
-#创建WebSocket服务器对象()  
-class WebSocketServer(object):  
-    #初始化时,socket为空  
-    def __init__(self):  
-        self.socket = None  
-    #开启操作  
-    def begin(self):  
-        #服务器尽心启动Log输出  
-        print 'WebSocketServer Start!'  
-        #创建TCP的套接字,监听IP、Port  
-        #这里可以自己进行设置,最多可以收听50个请求客户  
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  
-        ip = 'localhost'  
-        port = 8080  
-          
-        #print "WebServer is listening %s,%d" % ip,port  
-        #self.socket.bind(ip,port)  
-        self.socket.bind((ip,port))  
-        self.socket.listen(50)  
-        #声明全局连接集合  
-        global connectionlist  
-          
-        i=0  
-        while True:  
-            #服务器响应请求,返回连接客户的信息(连接fd,客户地址)  
-            connection, address = self.socket.accept()  
-            #address信息中的第1个字符串为username对象  
-            username=address[0]  
-            #根据连接的客户信息,创建WebSocket对象(本质为一个线程)  
-            #连接后sockfd，连接index，用户名，地址  
-            newSocket = WebSocket(connection,i,username,address)  
-            #线程启动  
-            newSocket.start()  
-            #更新连接的集合(hash表的对应关系)-name->sockfd  
-            connectionlist['connection'+str(i)]=connection  
-            i = i + 1  
-  
-if __name__ == "__main__":  
-    server = WebSocketServer()  
-    server.begin()  
\ No newline at end of file
+#coding=utf-8
+# 基于asyncio的RFC 6455 WebSocket服务器
+# 单线程事件循环处理全部连接,每个客户端有独立的有界发送队列,
+# 慢客户端只会丢弃自己的旧消息,不会阻塞广播
+
+import asyncio
+import base64
+import hashlib
+import os
+import struct
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# 帧类型
+OP_CONT = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class ProtocolError(Exception):
+    pass
+
+
+#根据客户端的Sec-WebSocket-Key生成Sec-WebSocket-Accept
+def generate_token(key):
+    ser_key = hashlib.sha1((key + GUID).encode('ascii')).digest()
+    return base64.b64encode(ser_key).decode('ascii')
+
+
+#用4字节掩码对数据做异或,整体转成大整数一次完成
+def apply_mask(payload, mask):
+    n = len(payload)
+    if n == 0:
+        return payload
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little')).to_bytes(n, 'little')
+
+
+#构造一个完整的帧(FIN=1),服务端发送不加掩码,客户端发送必须加掩码
+def encode_frame(payload, opcode=OP_TEXT, mask=False):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    n = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if n < 126:
+        header = struct.pack('!BB', 0x80 | opcode, mask_bit | n)
+    elif n < (1 << 16):
+        header = struct.pack('!BBH', 0x80 | opcode, mask_bit | 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, mask_bit | 127, n)
+    if mask:
+        key = os.urandom(4)
+        return header + key + apply_mask(payload, key)
+    return header + payload
+
+
+#读取一个帧,返回(fin, opcode, payload)
+#require_mask: 服务端读取客户端帧时必须带掩码(RFC 6455 5.1),客户端读取服务端帧时传False
+async def read_frame(reader, max_size=1 << 20, require_mask=True):
+    b1, b2 = await reader.readexactly(2)
+    fin = bool(b1 & 0x80)
+    if b1 & 0x70:
+        raise ProtocolError('reserved bits set')
+    opcode = b1 & 0x0F
+    masked = bool(b2 & 0x80)
+    if require_mask and not masked:
+        raise ProtocolError('unmasked client frame')
+    n = b2 & 0x7F
+    if n == 126:
+        n, = struct.unpack('!H', await reader.readexactly(2))
+    elif n == 127:
+        n, = struct.unpack('!Q', await reader.readexactly(8))
+    if opcode >= OP_CLOSE and (n > 125 or not fin):
+        raise ProtocolError('invalid control frame')
+    if n > max_size:
+        raise ProtocolError('frame too large')
+    key = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(n)
+    if masked:
+        payload = apply_mask(payload, key)
+    return fin, opcode, payload
+
+
+#读取一条完整消息,拼接分片;控制帧出现时直接返回
+#fragments为调用者保存的分片状态[opcode, [payload...]]
+async def read_message(reader, fragments, max_size=1 << 20, require_mask=True):
+    while True:
+        fin, opcode, payload = await read_frame(reader, max_size, require_mask)
+        if opcode >= OP_CLOSE:
+            return opcode, payload
+        if opcode == OP_CONT:
+            if fragments[0] is None:
+                raise ProtocolError('unexpected continuation frame')
+        elif fragments[0] is not None:
+            raise ProtocolError('expected continuation frame')
+        else:
+            fragments[0] = opcode
+        fragments[1].append(payload)
+        if sum(len(p) for p in fragments[1]) > max_size:
+            raise ProtocolError('message too large')
+        if fin:
+            opcode, data = fragments[0], b''.join(fragments[1])
+            fragments[0], fragments[1] = None, []
+            return opcode, data
+
+
+#单个客户端连接
+class Connection(object):
+    def __init__(self, reader, writer, index, name, queue_size):
+        self.reader = reader
+        self.writer = writer
+        self.index = index
+        self.name = name
+        #有界发送队列,保存已编码好的帧
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closing = False
+        self.task = None
+
+    def _put(self, item):
+        #队列满时丢弃最旧的一帧
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.queue.get_nowait()
+            self.dropped += 1
+            self.queue.put_nowait(item)
+
+    def send_frame(self, frame):
+        """非阻塞发送已编码的帧"""
+        if not self.closing:
+            self._put(frame)
+
+    def send(self, message):
+        binary = isinstance(message, (bytes, bytearray, memoryview))
+        self.send_frame(encode_frame(message, OP_BINARY if binary else OP_TEXT))
+
+    async def write_loop(self):
+        """发送协程,一次写出队列中已有的全部帧后再等待drain,遇到None结束"""
+        try:
+            done = False
+            while not done:
+                frames = [await self.queue.get()]
+                while not self.queue.empty():
+                    frames.append(self.queue.get_nowait())
+                if None in frames:
+                    frames = frames[:frames.index(None)]
+                    done = True
+                self.writer.write(b''.join(frames))
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.writer.close()
+
+    def close(self, code=1000):
+        """发送关闭帧,写完队列中的数据后断开"""
+        if not self.closing:
+            self._put(encode_frame(struct.pack('!H', code), OP_CLOSE))
+            self._put(None)
+            self.closing = True
+
+
+#创建WebSocket服务器对象
+class WebSocketServer(object):
+    def __init__(self, host='localhost', port=8080, queue_size=64, max_size=1 << 20,
+                 on_message=None, greet=True):
+        self.host = host
+        self.port = port
+        #连接和退出时是否向全体广播
+        self.greet = greet
+        self.queue_size = queue_size
+        self.max_size = max_size
+        #收到客户端消息的回调on_message(server, connection, opcode, payload),
+        #默认行为与原来一致:广播 name:msg
+        self.on_message = on_message or WebSocketServer.chat
+        #存放连接客户,index -> Connection
+        self.connections = {}
+        self.server = None
+        self.count = 0
+
+    @staticmethod
+    def chat(server, connection, opcode, payload):
+        if opcode == OP_TEXT:
+            server.broadcast(connection.name + ':' + payload.decode('utf-8', 'replace'))
+
+    def broadcast(self, message):
+        """向全部客户端发送消息,帧只编码一次"""
+        binary = isinstance(message, (bytes, bytearray, memoryview))
+        frame = encode_frame(message, OP_BINARY if binary else OP_TEXT)
+        for connection in list(self.connections.values()):
+            connection.send_frame(frame)
+
+    #握手过程,解析请求头并回复101
+    async def handshake(self, reader, writer):
+        request = await reader.readuntil(b'\r\n\r\n')
+        lines = request.decode('latin-1').split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            if ': ' in line:
+                key, value = line.split(': ', 1)
+                headers[key.lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if key is None or 'websocket' not in headers.get('upgrade', '').lower():
+            writer.write(b'HTTP/1.1 400 Bad Request\r\n\r\n')
+            raise ProtocolError('not a websocket handshake')
+        handshake = ('HTTP/1.1 101 Switching Protocols\r\n'
+                     'Upgrade: websocket\r\n'
+                     'Connection: Upgrade\r\n'
+                     'Sec-WebSocket-Accept: %s\r\n\r\n' % generate_token(key))
+        writer.write(handshake.encode('ascii'))
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        index = self.count
+        self.count += 1
+        remote = writer.get_extra_info('peername')
+        try:
+            await self.handshake(reader, writer)
+        except (ProtocolError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        #address信息中的第1个字符串为username
+        connection = Connection(reader, writer, index, str(remote[0]) if remote else str(index),
+                                self.queue_size)
+        connection.task = asyncio.ensure_future(connection.write_loop())
+        self.connections[index] = connection
+        if self.greet:
+            self.broadcast('Welcome, ' + connection.name + ' !')
+
+        fragments = [None, []]
+        try:
+            while not connection.closing:
+                opcode, payload = await read_message(reader, fragments, self.max_size, require_mask=True)
+                if opcode == OP_CLOSE:
+                    connection.close()
+                    break
+                elif opcode == OP_PING:
+                    connection.send_frame(encode_frame(payload, OP_PONG))
+                elif opcode == OP_PONG:
+                    pass
+                elif opcode == OP_TEXT and payload == b'quit':
+                    #客户端退出
+                    connection.close()
+                    if self.greet:
+                        self.broadcast(connection.name + ' Logout')
+                    break
+                else:
+                    self.on_message(self, connection, opcode, payload)
+        except ProtocolError:
+            connection.close(1002)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.connections[index]
+            connection.close()
+            await connection.task
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, backlog=1024)
+        return self.server
+
+    async def close(self):
+        for connection in list(self.connections.values()):
+            connection.close(1001)
+        self.server.close()
+        await self.server.wait_closed()
+
+    #开启服务,阻塞运行
+    def begin(self):
+        print('WebSocketServer Start!')
+
+        async def serve():
+            await self.start()
+            await self.server.serve_forever()
+        asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    server = WebSocketServer()
+    server.begin()
@@ -45,6 +45,16 @@ tf.app.flags.DEFINE_integer('num_batch_join', 4,
                             """How many batch_join, large enough to avoid single threaded dequeue many""")
 
 
+def _shard_files(data_files, index, count):
+  # every file goes to one shard, the same one in every process
+  data_files = sorted(data_files)
+  if len(data_files) < count:
+    print('Warning: %d data files for %d shards, shards will overlap' %
+          (len(data_files), count))
+    return [data_files[index % len(data_files)]]
+  return data_files[index::count]
+
+
 def inputs(dataset, batch_size=None, num_preprocess_threads=None):
   """Generate batches of ImageNet images for evaluation.
 
@@ -78,7 +88,8 @@ def inputs(dataset, batch_size=None, num_preprocess_threads=None):
   # tensors is net_inputs, net_outputs
   return tensors
 
-def distorted_inputs(dataset, batch_size=None, num_preprocess_threads=None):
+def distorted_inputs(dataset, batch_size=None, num_preprocess_threads=None,
+                     shard=None):
   """Generate batches of distorted versions of ImageNet images.
 
   Use this function as the inputs for training a network.
@@ -92,6 +103,8 @@ def distorted_inputs(dataset, batch_size=None, num_preprocess_threads=None):
     batch_size: integer, number of examples in batch
     num_preprocess_threads: integer, total number of preprocessing threads but
       None defaults to FLAGS.num_preprocess_threads.
+    shard: None, or a tuple (index, count) to only read the index-th of count
+      disjoint subsets of the data files.
 
   Returns:
     images: Images. 4D tensor of size [batch_size, FLAGS.image_size,
@@ -107,12 +120,13 @@ def distorted_inputs(dataset, batch_size=None, num_preprocess_threads=None):
     tensors = batch_inputs(
         dataset, batch_size, train=True,
         num_preprocess_threads=num_preprocess_threads,
-        num_readers=FLAGS.num_readers)
+        num_readers=FLAGS.num_readers,
+        shard=shard)
 
   return tensors
 
 def batch_inputs(dataset, batch_size, train, num_preprocess_threads=None,
-                 num_readers=1):
+                 num_readers=1, shard=None):
   """Contruct batches of training or evaluation examples from the image dataset.
 
   Args:
@@ -122,6 +136,8 @@ def batch_inputs(dataset, batch_size, train, num_preprocess_threads=None,
     train: boolean
     num_preprocess_threads: integer, total number of preprocessing threads
     num_readers: integer, number of parallel readers
+    shard: None, or a tuple (index, count) to only read the index-th of count
+      disjoint subsets of the data files.
 
   Returns:
     images: 4-D float Tensor of a batch of images
@@ -134,6 +150,8 @@ def batch_inputs(dataset, batch_size, train, num_preprocess_threads=None,
     data_files = dataset.data_files()
     if data_files is None:
       raise ValueError('No data files found for this dataset')
+    if shard is not None:
+      data_files = _shard_files(data_files, *shard)
 
     # Create filename_queue
     if train:
@@ -0,0 +1,120 @@
+'''
+Training throughput of train.py --cpu_workers=N for N = 1, 2, 4, 8 on one machine.
+
+With a config name, train.py runs with the flags of that config.py function for every worker count,
+and the examples/sec it reports are averaged after the first report. batch_size is the per worker
+batch times N, so every worker does the same work whatever N (weak scaling); use --strong to keep
+the batch of the config and split it instead.
+
+    python bench_cpu_train.py discrete_tcnn1 --steps 200 --workers 1 2 4 8
+
+Without a config (or without TensorFlow) a synthetic step stands in for the model: every worker
+computes the gradient of a least squares layer of --floats parameters on its own batch with numpy,
+then the gradients go through the same SharedAllReduce as train.py. It measures the all reduce
+overhead and the scaling that is possible on the machine.
+
+    python bench_cpu_train.py --floats 4000000 --workers 1 2 4 8
+'''
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# one BLAS thread per worker, the workers are the parallelism
+for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(name, '1')
+
+import numpy as np
+
+import cpu_parallel
+
+
+def synthetic_step_times(workers, args):
+    # (examples/sec, all reduce ms per step) of the synthetic step with this many workers
+    inputs = max(1, int(np.sqrt(args.floats)))
+    outputs = max(1, args.floats // inputs)
+    reports = cpu_parallel.mp.Queue()
+
+    def target(reducer):
+        rng = np.random.RandomState(reducer.rank)
+        weights = reducer.broadcast([rng.randn(inputs, outputs).astype(np.float32) * 0.01])[0]
+        x = rng.randn(args.batch_size, inputs).astype(np.float32)
+        y = rng.randn(args.batch_size, outputs).astype(np.float32)
+        reduce_time = 0.0
+        for step in range(args.warmup + args.steps):
+            if step == args.warmup:
+                start, reduce_time = time.time(), 0.0
+            grad = x.T.dot(x.dot(weights) - y) / args.batch_size
+            t = time.time()
+            grad, = reducer.all_reduce([grad])
+            reduce_time += time.time() - t
+            # 1 / inputs keeps the step below 2 / the largest eigenvalue of x.T x / batch, so it converges
+            weights -= grad / inputs
+        if reducer.rank == 0:
+            reports.put((time.time() - start, reduce_time))
+
+    cpu_parallel.run_workers(target, workers)
+    duration, reduce_time = reports.get()
+    return workers * args.batch_size * args.steps / duration, 1000 * reduce_time / args.steps
+
+
+def train_flags(config_name):
+    import config
+    config.common_config('train')
+    getattr(config, config_name)('train')
+    config.common_config_post('train')
+    return config.flags_to_cmd(), config.FLAGS.batch_size
+
+
+def train_examples_per_sec(workers, args, flags, config_batch_size):
+    train_dir = tempfile.mkdtemp(prefix='bench_cpu_train-')
+    batch_size = config_batch_size if args.strong else args.batch_size * workers
+    cmd = ([sys.executable, 'train.py'] + flags +
+           ['--cpu_workers=%d' % workers, '--batch_size=%d' % batch_size,
+            '--max_steps=%d' % args.steps, '--train_dir=%s' % train_dir,
+            '--pretrained_model_checkpoint_path=', '--checkpoint_interval=%d' % (10 * args.steps),
+            '--display_summary=%d' % (10 * args.steps), '--display_loss=10'])
+    try:
+        output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True)
+    finally:
+        shutil.rmtree(train_dir, ignore_errors=True)
+    rates = [float(x) for x in re.findall(r'\(([\d.]+) examples/sec;', output)]
+    if len(rates) < 2:
+        raise RuntimeError('train.py reported %d rates, run more steps:\n%s' % (len(rates), output[-2000:]))
+    return np.mean(rates[1:]), None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CPU data parallel training benchmark')
+    parser.add_argument('config', nargs='?', help='A model config of config.py, e.g. discrete_tcnn1.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--batch_size', type=int, default=4, help='Per worker batch.')
+    parser.add_argument('--strong', action='store_true', help='Split the batch of the config instead.')
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5, help='Synthetic steps that are not timed.')
+    parser.add_argument('--floats', type=int, default=4000000, help='Synthetic parameter count.')
+    args = parser.parse_args()
+
+    if args.config:
+        flags, config_batch_size = train_flags(args.config)
+        measure = lambda workers: train_examples_per_sec(workers, args, flags, config_batch_size)
+        print('train.py %s, %d steps, %d cores' % (args.config, args.steps, cpu_parallel.mp.cpu_count()))
+    else:
+        measure = lambda workers: synthetic_step_times(workers, args)
+        print('synthetic step, %d parameters, batch %d per worker, %d steps, %d cores' % (
+            args.floats, args.batch_size, args.steps, cpu_parallel.mp.cpu_count()))
+
+    base = None
+    for workers in args.workers:
+        rate, reduce_ms = measure(workers)
+        base = base or rate
+        line = '%2d workers: %9.1f examples/sec, speedup %5.2f, efficiency %4.0f%%' % (
+            workers, rate, rate / base, 100 * rate / base / workers)
+        if reduce_ms is not None:
+            line += ', all reduce %.2f ms/step' % reduce_ms
+        print(line)
@@ -0,0 +1,119 @@
+'''
+Decode time of one segment of JPEG frames for every fast_jpeg_decode mode.
+
+The frames are the image/encoded of the first record of a TFRecord, or synthetic dashcam sized
+frames. Without TensorFlow, or for modes whose .so is not compiled, only the python decoders run:
+the cv2 loop of MyDataset.decode_batch and the threaded BatchJpegDecoder. Outputs of every mode
+are compared with the threaded one.
+
+    python bench_jpeg_decode.py --tfrecord $DATA_ROOT/tfrecords/validation/xxx.tfrecords
+    python bench_jpeg_decode.py --downsample 2 --threads 8
+'''
+
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from data_providers.jpeg_batch import BatchJpegDecoder
+
+
+def synthetic_frames(n, height, width, quality=90):
+    rng = np.random.RandomState(0)
+    base = cv2.resize(rng.randint(0, 256, (height // 8, width // 8, 3)).astype(np.uint8), (width, height))
+    noise = rng.randint(0, 16, (height, width, 3)).astype(np.uint8)
+    return [cv2.imencode('.jpg', np.roll(base, 4 * i, axis=1) + noise,
+                         [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes() for i in range(n)]
+
+
+def tfrecord_frames(path, n):
+    import tensorflow as tf
+    from tensorflow.core.example import example_pb2
+    serialized = next(tf.python_io.tf_record_iterator(path))
+    encoded = example_pb2.Example.FromString(serialized).features.feature['image/encoded'].bytes_list.value
+    return list(encoded[:n])
+
+
+def cv2_loop(image_strs, H, W, downsample):
+    # MyDataset.decode_batch, which only supports downsample 1
+    ans = np.zeros([len(image_strs), H, W, 3], dtype=np.uint8)
+    for i, st in enumerate(image_strs):
+        ans[i, :, :, :] = cv2.imdecode(np.asarray(bytearray(st), dtype=np.uint8), cv2.IMREAD_COLOR)
+    return ans[:, :, :, [2, 1, 0]]
+
+
+def tf_modes(image_strs, H, W, args):
+    # (mode, decode function) of the fast_jpeg_decode modes that can run here
+    import tensorflow as tf
+    from data_providers.nexar_large_speed import MyDataset
+    FLAGS = tf.app.flags.FLAGS
+    FLAGS.IM_HEIGHT, FLAGS.IM_WIDTH = H * args.downsample, W * args.downsample
+    FLAGS.decode_downsample_factor = args.downsample
+    FLAGS.temporal_downsample_factor = 1
+    FLAGS.FRAMES_IN_SEG = len(image_strs)
+    FLAGS.jpeg_decode_threads = args.threads
+    so_files = {'pyfunc': 'data_providers/decode_jpeg_memory/decode_memory.so',
+                'tf': 'data_providers/decode_jpeg_memory/decode_jpeg_batch.so'}
+    dataset = MyDataset('validation')
+    modes = []
+    for mode in ('default', 'pyfunc', 'tf', 'threaded'):
+        if mode in so_files and not os.path.exists(so_files[mode]):
+            print('%s: %s not compiled, skipped' % (mode, so_files[mode]))
+            continue
+        if mode in ('pyfunc', 'tf') and args.downsample != 1:
+            print('%s: only supports downsample 1, skipped' % mode)
+            continue
+        FLAGS.fast_jpeg_decode = mode
+        graph = tf.Graph()
+        with graph.as_default():
+            buffer = tf.placeholder(tf.string, [len(image_strs)])
+            decoded = dataset.decode_jpeg(buffer)
+            sess = tf.Session()
+        modes.append(('tf graph ' + mode,
+                      lambda sess=sess, decoded=decoded, buffer=buffer: sess.run(decoded, {buffer: image_strs})))
+    return modes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch JPEG decode benchmark')
+    parser.add_argument('--tfrecord', help='Take the frames of the first record of this file.')
+    parser.add_argument('--frames', type=int, default=108)
+    parser.add_argument('--height', type=int, default=360)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--downsample', type=int, default=1, help='decode_downsample_factor')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.tfrecord:
+        image_strs = tfrecord_frames(args.tfrecord, args.frames)
+    else:
+        image_strs = synthetic_frames(args.frames, args.height, args.width)
+    image_strs = np.array(image_strs, dtype=object)
+    H, W = args.height // args.downsample, args.width // args.downsample
+    print('%d frames, %.1f KB per frame, decoded to %dx%d' % (
+        len(image_strs), np.mean([len(s) for s in image_strs]) / 1024, W, H))
+
+    decoder = BatchJpegDecoder(args.threads)
+    modes = [('threaded, %d threads' % args.threads, lambda: decoder.decode(image_strs, H, W, args.downsample)),
+             ('threaded, 1 thread', lambda: BatchJpegDecoder(1).decode(image_strs, H, W, args.downsample))]
+    if args.downsample == 1:
+        modes.append(('cv2 loop (decode_batch)', lambda: cv2_loop(image_strs, H, W, args.downsample)))
+    try:
+        modes += tf_modes(image_strs, H, W, args)
+    except ImportError:
+        print('tensorflow not available, the tf graph modes are skipped')
+
+    reference = modes[0][1]()
+    for name, decode in modes:
+        decode()
+        times = []
+        for _ in range(args.repeat):
+            start = time.time()
+            out = decode()
+            times.append(time.time() - start)
+        diff = np.abs(out.astype(np.int16) - reference).max()
+        print('%28s: %7.1f ms per segment, %5.2f ms per frame, max abs difference %d' % (
+            name, 1000 * np.median(times), 1000 * np.median(times) / len(image_strs), diff))
@@ -0,0 +1,74 @@
+'''
+Per frame latency of Wrapper.observe_a_frame, sliding window mode against the incremental mode.
+
+Every mode runs in its own process, since a Wrapper builds into the default graph and changes FLAGS.
+Both see the same random dashcam sized frames, and the logits of every frame are compared. For
+LSTM configs the incremental mode carries the state instead of rerunning a window from zero, so the
+outputs are expected to differ.
+
+    python bench_wrapper.py discrete_tcnn1 data/discrete_tcnn1/model.ckpt-126001.bestmodel
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def run(args):
+    from wrapper import Wrapper
+    wrapper = Wrapper(args.model_config_name, args.model_path, truncate_len=args.truncate_len,
+                      incremental=args.incremental)
+    rng = np.random.RandomState(0)
+    frames = rng.randint(0, 256, (8, args.height, args.width, 3)).astype(np.uint8)
+    latency, logits = [], []
+    for i in range(args.warmup + args.frames):
+        start = time.time()
+        logits.append(wrapper.observe_a_frame(frames[i % len(frames)])[0])
+        if i >= args.warmup:
+            latency.append(time.time() - start)
+    np.savez(args.out, latency=latency, logits=np.concatenate(logits))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Wrapper latency benchmark')
+    parser.add_argument('model_config_name', help='config function in config.py, e.g. discrete_tcnn1')
+    parser.add_argument('model_path')
+    parser.add_argument('--truncate-len', dest='truncate_len', type=int, default=20)
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--warmup', type=int, default=25, help='Frames not timed, fills the window too.')
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--out', help='Run one mode and save its results here.')
+    args, _ = parser.parse_known_args()
+
+    if args.out:
+        run(args)
+        sys.exit(0)
+
+    folder = tempfile.mkdtemp()
+    results = {}
+    for incremental in (False, True):
+        out = os.path.join(folder, 'incremental.npz' if incremental else 'window.npz')
+        command = [sys.executable, __file__, args.model_config_name, args.model_path,
+                   '--truncate-len', str(args.truncate_len), '--frames', str(args.frames),
+                   '--warmup', str(args.warmup), '--height', str(args.height), '--width', str(args.width),
+                   '--out', out] + (['--incremental'] if incremental else [])
+        subprocess.check_call(command, stdout=open(os.devnull, 'w'))
+        with np.load(out) as f:
+            results[incremental] = f['latency'], f['logits']
+        os.remove(out)
+    os.rmdir(folder)
+
+    for incremental, name in ((False, 'sliding window'), (True, 'incremental')):
+        latency = results[incremental][0]
+        print('%15s: median %7.1f ms  mean %7.1f ms per frame' % (
+            name, 1000 * np.median(latency), 1000 * np.mean(latency)))
+    print('speedup %.1fx, window of %d frames' % (
+        np.median(results[False][0]) / np.median(results[True][0]), args.truncate_len))
+    print('max abs logit difference %g' % np.abs(results[False][1] - results[True][1]).max())
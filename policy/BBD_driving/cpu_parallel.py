@@ -0,0 +1,220 @@
+'''
+Data parallel training on the cores of one machine, for train.py --cpu_workers=N.
+
+Every worker is a process with its own graph, session and shard of the input files. After each step
+the workers average their gradients with SharedAllReduce and all apply the same average, so their
+variables stay equal without a parameter server. The buffers are files in /dev/shm mapped by every
+worker: each worker writes its gradients to its own slot, sums one contiguous chunk of all the
+slots, and reads the averaged chunks of the others back, two barriers per step. broadcast copies
+the variables of worker 0 to the others, at startup and before every checkpoint.
+
+    def train(reducer):
+        ...
+        grads = reducer.all_reduce(sess.run(local_grads))
+
+    run_workers(train, 4)
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+
+import numpy as np
+
+# workers are forked, the session of a worker is only created after the fork
+if hasattr(multiprocessing, 'get_context'):
+    mp = multiprocessing.get_context('fork')
+else:
+    mp = multiprocessing
+
+
+class WorkerAborted(Exception):
+    pass
+
+
+class Barrier(object):
+    '''multiprocessing.Barrier, which python 2 lacks. After abort() every incomplete wait raises WorkerAborted.'''
+
+    def __init__(self, parties):
+        self.parties = parties
+        self.cond = mp.Condition()
+        self.count = mp.RawValue('i', 0)
+        self.generation = mp.RawValue('i', 0)
+        self.broken = mp.RawValue('i', 0)
+
+    def wait(self):
+        with self.cond:
+            generation = self.generation.value
+            self.count.value += 1
+            if self.count.value == self.parties:
+                self.count.value = 0
+                self.generation.value += 1
+                self.cond.notify_all()
+            while self.generation.value == generation and not self.broken.value:
+                self.cond.wait()
+            # a waiter released by the last party before the abort passes
+            if self.generation.value == generation:
+                raise WorkerAborted()
+
+    def abort(self):
+        with self.cond:
+            self.broken.value = 1
+            self.cond.notify_all()
+
+
+def shm_dir():
+    # a RAM backed folder when there is one
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class SharedAllReduce(object):
+    '''
+    Created by the parent before forking nworkers workers, rank is set in each worker. all_reduce and
+    broadcast take a list of arrays and give a list of arrays of the same shapes, every worker has to
+    make the same calls with arrays of the same shapes.
+    '''
+
+    def __init__(self, nworkers):
+        self.nworkers = nworkers
+        self.rank = None
+        self.barrier = Barrier(nworkers)
+        self.folder = tempfile.mkdtemp(prefix='allreduce-', dir=shm_dir())
+        self.size = None
+
+    def path(self, name, rank):
+        return os.path.join(self.folder, '%s-%d' % (name, rank))
+
+    def open_buffers(self, size):
+        # every worker creates the buffers it writes, then maps those of the others
+        self.size = size
+        self.bounds = np.linspace(0, size, self.nworkers + 1).astype(np.int64)
+        lo, hi = self.bounds[self.rank], self.bounds[self.rank + 1]
+        np.memmap(self.path('slot', self.rank), dtype=np.float32, mode='w+', shape=(size,))
+        np.memmap(self.path('mean', self.rank), dtype=np.float32, mode='w+', shape=(max(hi - lo, 1),))
+        self.barrier.wait()
+        self.slots = [np.memmap(self.path('slot', k), dtype=np.float32, mode='r+', shape=(size,))
+                      for k in range(self.nworkers)]
+        self.means = [np.memmap(self.path('mean', k), dtype=np.float32, mode='r+',
+                                shape=(max(self.bounds[k + 1] - self.bounds[k], 1),))
+                      for k in range(self.nworkers)]
+
+    def all_reduce(self, arrays):
+        '''The mean over the workers of every array, as float32.'''
+        sizes = [np.size(a) for a in arrays]
+        size = int(np.sum(sizes))
+        if self.size is None:
+            self.open_buffers(size)
+        assert size == self.size, "all_reduce of %d values, the buffers hold %d" % (size, self.size)
+
+        slot = self.slots[self.rank]
+        start = 0
+        for a, n in zip(arrays, sizes):
+            slot[start:start + n] = np.ravel(a)
+            start += n
+        self.barrier.wait()
+
+        # a fixed summation order, so the result does not depend on which worker reduces a chunk
+        lo, hi = self.bounds[self.rank], self.bounds[self.rank + 1]
+        mean = self.means[self.rank][:hi - lo]
+        mean[:] = self.slots[0][lo:hi]
+        for k in range(1, self.nworkers):
+            mean += self.slots[k][lo:hi]
+        mean *= np.float32(1.0 / self.nworkers)
+        self.barrier.wait()
+
+        flat = np.concatenate([self.means[k][:self.bounds[k + 1] - self.bounds[k]]
+                               for k in range(self.nworkers)])
+        out = []
+        start = 0
+        for a, n in zip(arrays, sizes):
+            out.append(flat[start:start + n].reshape(np.shape(a)))
+            start += n
+        return out
+
+    def broadcast(self, arrays, root=0):
+        '''The arrays of worker root, bit exact whatever their dtypes.'''
+        arrays = [np.ascontiguousarray(a) for a in arrays]
+        nbytes = int(np.sum([a.nbytes for a in arrays]))
+        path = self.path('broadcast', root)
+        if self.rank == root:
+            buf = np.memmap(path, dtype=np.uint8, mode='w+', shape=(max(nbytes, 1),))
+            buf[:nbytes] = np.concatenate([a.reshape(-1).view(np.uint8) for a in arrays] + [np.zeros(0, np.uint8)])
+            del buf
+        self.barrier.wait()
+
+        out = arrays
+        if self.rank != root:
+            buf = np.memmap(path, dtype=np.uint8, mode='r', shape=(max(nbytes, 1),))
+            out = []
+            start = 0
+            for a in arrays:
+                out.append(np.array(buf[start:start + a.nbytes]).view(a.dtype).reshape(a.shape))
+                start += a.nbytes
+            del buf
+        # root may only rewrite the buffer once everyone has read it
+        self.barrier.wait()
+        return out
+
+    def close(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def _worker_main(target, reducer, rank, finished):
+    reducer.rank = rank
+    try:
+        target(reducer)
+        finished[rank] = 1
+    except WorkerAborted:
+        # another worker failed, it reported the error
+        sys.exit(1)
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+
+
+def run_workers(target, nworkers):
+    '''
+    Runs target(reducer) in nworkers forked processes. When a worker exits before target returned (an
+    error, or sys.exit on an interrupt) the ones still running are aborted at their next all_reduce or
+    broadcast, and a RuntimeError is raised once all have exited if any of them failed.
+    '''
+    reducer = SharedAllReduce(nworkers)
+    # set by a worker once target has returned
+    finished = mp.RawArray('i', nworkers)
+    workers = [mp.Process(target=_worker_main, args=(target, reducer, rank, finished))
+               for rank in range(nworkers)]
+    try:
+        for w in workers:
+            w.start()
+        running = list(workers)
+        while running:
+            try:
+                running[0].join(1.0)
+            except KeyboardInterrupt:
+                # the workers get the interrupt too, worker 0 saves a checkpoint before exiting
+                continue
+            for rank, w in enumerate(workers):
+                if w in running and w.exitcode is not None:
+                    running.remove(w)
+                    # the workers that are left would wait for it forever. A worker that finished
+                    # made all its barrier calls, the others are released by its last one.
+                    if not finished[rank] and running:
+                        reducer.barrier.abort()
+    finally:
+        for w in workers:
+            if w.is_alive():
+                w.terminate()
+            w.join()
+        reducer.close()
+
+    # after an interrupt every worker exits cleanly without finishing, that is not a failure
+    if any(w.exitcode != 0 for w in workers):
+        unfinished = [rank for rank in range(nworkers) if not finished[rank]]
+        raise RuntimeError("cpu workers %s did not finish" % unfinished)
@@ -4,10 +4,8 @@ from __future__ import print_function
 
 import os
 import sys
-import threading
-import shutil
-from subprocess import call
 import subprocess
+from collections import defaultdict
 
 import tensorflow as tf
 from tensorflow.core.example import example_pb2
@@ -31,10 +29,13 @@ tf.app.flags.DEFINE_string('output_directory', '/data/nx-bdd-20160929/tfrecord_f
 #tf.app.flags.DEFINE_integer('train_shards', 1024, 'Number of shards in training TFRecord files.') 
 #tf.app.flags.DEFINE_integer('validation_shards', 128, 'Number of shards in validation TFRecord files.')
 
-tf.app.flags.DEFINE_integer('num_threads', 16, 'Number of threads to preprocess the images.')
+tf.app.flags.DEFINE_integer('num_threads', 16, 'Number of processes converting videos.')
 # change truncate_frames when low res
 tf.app.flags.DEFINE_integer('truncate_frames', 36*15, 'Number of frames to leave in the saved tfrecords')
-tf.app.flags.DEFINE_string('temp_dir_root', '/tmp/', 'the temp dir to hold ffmpeg outputs')
+tf.app.flags.DEFINE_integer('jpeg_quality', 75, 'JPEG quality of the high res frames, about ffmpeg -qscale:v 10')
+tf.app.flags.DEFINE_string('progress_file', 'progress.txt',
+                           'videos done so far, in the output directory, a restarted run skips them')
+tf.app.flags.DEFINE_integer('report_every', 10, 'print the conversion rate every this many videos')
 
 tf.app.flags.DEFINE_boolean('low_res', False, 'the data we want to use is low res')
 # constant for the low res resolution
@@ -111,11 +112,38 @@ def full_im(pixel, all_num):
     # return (is a full image)
     return num >= 1
 
+def ffmpeg_frames(video_path, rate, width, height, max_frames):
+    '''
+    Decodes video_path at rate frames per second straight into a pipe and yields up to max_frames
+    RGB frames of height*width. The frame buffer is reused, copy a frame to keep it. ffmpeg is
+    stopped as soon as enough frames are read.
+    '''
+    cmnd = ['ffmpeg',
+            '-i', video_path,
+            '-loglevel', 'panic',
+            '-r', str(rate),
+            '-s', '%dx%d' % (width, height),
+            '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24',
+            '-threads', '4',
+            '-']
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    pipe = subprocess.Popen(cmnd, stdout=subprocess.PIPE, bufsize=frame.nbytes)
+    try:
+        for i in range(max_frames):
+            if pipe.stdout.readinto(frame) < frame.nbytes:
+                break
+            yield frame
+    finally:
+        pipe.stdout.close()
+        if pipe.poll() is None:
+            pipe.kill()
+        pipe.wait()
+
 #@profile
 def read_one_video(video_path, jobid):
-    fd, fprefix, cache_images, out_name = parse_path(video_path, jobid)
+    fd, fprefix, out_name = parse_path(video_path, jobid)
 
-    FNULL = open(os.devnull, 'w')
     hz_res = 1 if FLAGS.low_res else 15
     ratio = False
 
@@ -150,24 +178,7 @@ def read_one_video(video_path, jobid):
 
     image_list=[]
     if FLAGS.low_res:
-        cmnd = ['ffmpeg', 
-                '-i', video_path, 
-                '-f', 'image2pipe',
-                '-loglevel', 'panic', 
-                '-pix_fmt','rgb24',
-                '-r','1',
-                '-vcodec', 'rawvideo', '-']
-        pipe = subprocess.Popen(cmnd, stdout = subprocess.PIPE, bufsize=10**7)
-        pout, perr = pipe.communicate()
-        image_buff = np.fromstring(pout, dtype='uint8')
-        if image_buff.size < FLAGS.truncate_frames*HEIGHT*WIDTH*3:
-            print(jobid, video_path, image_buff.size, 'Insufficient video size.')
-            return 0, False
-        image_buff = image_buff[0:FLAGS.truncate_frames*HEIGHT*WIDTH*3]
-        image_buff = image_buff.reshape(FLAGS.truncate_frames,HEIGHT,WIDTH,3)
-
-        for i in range(FLAGS.truncate_frames):
-            image = image_buff[i,:,:,:]
+        for i, image in enumerate(ffmpeg_frames(video_path, 1, WIDTH, HEIGHT, FLAGS.truncate_frames)):
             image_left = image[HEIGHT-pixelh:HEIGHT, 0:pixelw]
             image_right = image[HEIGHT-pixelh:HEIGHT, WIDTH-pixelw:WIDTH]
             image_left_up = image[0:pixelh, 0:pixelw]
@@ -206,31 +217,16 @@ def read_one_video(video_path, jobid):
 
             image_list.append(contents)
     else:
-        # generate the video to images to this dir
-        if os.path.exists(cache_images):
-            shutil.rmtree(cache_images)
-        os.mkdir(cache_images)
-
-        call(['ffmpeg',
-            '-i', video_path,
-            '-r', '15',
-            '-qscale:v', '10',
-            '-s', '640*360',
-            '-threads', '4',
-            cache_images + '/%04d.jpg'],
-            stdout=FNULL,
-            stderr=FNULL)
-
-        for subdir, dirs, files in os.walk(cache_images):
-            for f in sorted(files):
-                with open(os.path.join(subdir, f), 'r') as f:
-                    image_data = f.read()
-                    image_list.append(image_data)
-
-        if len(image_list)<FLAGS.truncate_frames:
-            print('Insufficient video size.')
-            return 0, False
-        image_list = image_list[0:FLAGS.truncate_frames]
+        # frames come through a pipe and are encoded in memory, no temporary JPEG files
+        bgr = np.empty((360, 640, 3), dtype=np.uint8)
+        for image in ffmpeg_frames(video_path, 15, 640, 360, FLAGS.truncate_frames):
+            cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=bgr)
+            st = cv2.imencode(".JPEG", bgr, [cv2.IMWRITE_JPEG_QUALITY, FLAGS.jpeg_quality])
+            image_list.append(st[1].tobytes())
+
+    if len(image_list)<FLAGS.truncate_frames:
+        print(jobid, video_path, len(image_list), 'Insufficient video size.')
+        return 0, False
 
 
     if FLAGS.low_res:
@@ -263,53 +259,84 @@ def read_one_video(video_path, jobid):
 def parse_path(video_path, jobid):
     fd, fname = os.path.split(video_path)
     fprefix = fname.split(".")[0]
-    cache_images = os.path.join(FLAGS.temp_dir_root, "prepare_tfrecords_image_temp_"+str(jobid))
     out_name = os.path.join(FLAGS.output_directory, fprefix+".tfrecords")
     
     # return all sorts of info: 
-    # video_base_path, video_name_wo_prefix, cache_path, out_tfrecord_path
-    return (fd, fprefix, cache_images, out_name)
+    # video_base_path, video_name_wo_prefix, out_tfrecord_path
+    return (fd, fprefix, out_name)
 
 #@profile
 def convert_one(video_path, jobid):
-    fd, fprefix, cache_images, out_name = parse_path(video_path, jobid)
-    if not os.path.exists(out_name):
-        example, state = read_one_video(video_path, jobid)
-        if state:
-            writer = tf.python_io.TFRecordWriter(out_name)
-            writer.write(example.SerializeToString())
-            writer.close()   
-
-def p_convert(video_path_list, jobid):
-    #start = time.time()
-    for video_path in video_path_list:
-        fd, fprefix, cache_images, out_name = parse_path(video_path, jobid)
-        mod = int(fprefix[0:3], 16) % FLAGS.num_threads
-        if mod == jobid:
-            convert_one(video_path, jobid)
-            #end = time.time()
-            #if end-start > 60:
-            #    break
+    # returns (status, bytes of the tfrecord), status is one of written, exists or rejected
+    fd, fprefix, out_name = parse_path(video_path, jobid)
+    if os.path.exists(out_name):
+        return "exists", os.path.getsize(out_name)
+    example, state = read_one_video(video_path, jobid)
+    if not state:
+        return "rejected", 0
+    # written under a temporary name, an interrupted run never leaves a truncated tfrecord
+    tmp_name = out_name + ".tmp"
+    writer = tf.python_io.TFRecordWriter(tmp_name)
+    writer.write(example.SerializeToString())
+    writer.close()
+    os.rename(tmp_name, out_name)
+    return "written", os.path.getsize(out_name)
+
+def p_convert(video_path):
+    # one video per task, so whichever worker is idle takes the next video
+    try:
+        status, nbytes = convert_one(video_path, os.getpid())
+    except Exception as e:
+        print("failed to convert", video_path, e)
+        status, nbytes = "failed", 0
+    sys.stdout.flush()
+    return video_path, status, nbytes
+
+def read_progress(progress_path):
+    # videos of earlier runs, rejected ones too so that they are not probed again
+    done = set()
+    if os.path.exists(progress_path):
+        with open(progress_path) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t", 2)
+                if len(fields) == 3:
+                    done.add(fields[2])
+    return done
 
 def parallel_run():
     with open(FLAGS.video_index) as f:
         content = f.readlines()
     content = [x.strip() for x in content]
-
-    # Create a mechanism for monitoring when all threads are finished.
-    coord = tf.train.Coordinator()
-
-    threads = []
-    for i in range(FLAGS.num_threads):
-        # arguments are (the range to process, train phase or test phase)
-        args = (content, i)
-        t = multiprocessing.Process(target=p_convert, args=args)
-        #t = threading.Thread(target=p_convert, args=args)
-        t.start()
-        threads.append(t)
-
-    # Wait for all the threads to terminate.
-    coord.join(threads)
+    content = [x for x in content if x]
+
+    progress_path = os.path.join(FLAGS.output_directory, FLAGS.progress_file)
+    done = read_progress(progress_path)
+    todo = [x for x in content if x not in done]
+    print('%d videos, %d done by earlier runs, %d to convert with %d processes' %
+          (len(content), len(content) - len(todo), len(todo), FLAGS.num_threads))
+
+    pool = multiprocessing.Pool(FLAGS.num_threads)
+    counts = defaultdict(int)
+    bytes_written = 0
+    start = time.time()
+    with open(progress_path, "a") as progress:
+        for i, (video_path, status, nbytes) in enumerate(pool.imap_unordered(p_convert, todo)):
+            counts[status] += 1
+            if status != "failed":
+                # failed videos are retried by the next run
+                progress.write("%s\t%d\t%s\n" % (status, nbytes, video_path))
+                progress.flush()
+            if status == "written":
+                bytes_written += nbytes
+            if (i + 1) % FLAGS.report_every == 0 or i + 1 == len(todo):
+                elapsed = time.time() - start
+                print('%d/%d videos in %.0f s, %.3f videos/s, %.1f MB written, %.2f MB/s, %s' %
+                      (i + 1, len(todo), elapsed, (i + 1) / elapsed, bytes_written / 2.0**20,
+                       bytes_written / 2.0**20 / elapsed,
+                       ", ".join("%s %d" % kv for kv in sorted(counts.items()))))
+                sys.stdout.flush()
+    pool.close()
+    pool.join()
     print('Finished processing all files')
     sys.stdout.flush()
 
@@ -0,0 +1,349 @@
+'''
+Compares the label functions of MyDataset and util_car.integral against the per frame loops they
+replaced, on random speed tracks: the labels have to be identical, bit for bit. Also times both.
+
+Run from the BBD_driving folder:
+    python -m data_providers.compare_labels
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import time
+
+import numpy as np
+
+import util_car
+from data_providers.nexar_large_speed import MyDataset, FLAGS
+
+
+class Legacy:
+    # the loop implementations, as they were
+
+    @staticmethod
+    def integral(speed, time0):
+        out = np.zeros_like(speed)
+        l = speed.shape[0]
+        for i in range(l):
+            s = speed[i, :]
+            if i > 0:
+                out[i, :] = out[i - 1, :] + s * time0
+        return out
+
+    @staticmethod
+    def future_smooth(actions, naction, nfuture):
+        # TODO: could add weighting differently between near future and far future
+        # given a list of actions, for each time step, return the distribution of future actions
+        l = len(actions) # action is a list of integers, from 0 to naction-1, negative values are ignored
+        out = np.zeros((l, naction), dtype=np.float32)
+        for i in range(l):
+            # for each output position
+            total = 0
+            for j in range(min(nfuture, l-i)):
+                # for each future position
+                # current deal with i+j action
+                acti = i + j
+                if actions[acti]>=0:
+                    out[i, actions[acti]] += 1
+                    total += 1
+            if total == 0:
+                out[i, MyDataset.turn_str2int['straight']] = 1.0
+            else:
+                out[i, :] = out[i, :] / total
+        return out
+
+    @staticmethod
+    def no_stop_dropout_valid(stop_label, drop_prob):
+        nbatch = stop_label.shape[0]
+        ntime  = stop_label.shape[1]
+        out = np.ones(nbatch, dtype=bool)
+        for i in range(nbatch):
+            # determine whether this seq has stop
+            has_stop = False
+            for j in range(ntime):
+                if stop_label[i, j]:
+                    has_stop = True
+                    break
+            if not has_stop:
+                if np.random.rand() < drop_prob:
+                    out[i] = False
+        
+        return out
+
+    @staticmethod
+    def speed_to_course(speed):
+        pi = math.pi
+        if speed[1] == 0:
+            if speed[0] > 0:
+                course = pi / 2
+            elif speed[0] == 0:
+                course = None
+            elif speed[0] < 0:
+                course = 3 * pi / 2
+            return course
+        course = math.atan(speed[0] / speed[1])
+        if course < 0:
+            course = course + 2 * pi
+        if speed[1] > 0:
+            course = course
+        else:
+            course = pi + course
+            if course > 2 * pi:
+                course = course - 2 * pi
+        assert not math.isnan(course)
+        return course
+
+    @staticmethod
+    def to_course_list(speed_list):
+        l = speed_list.shape[0]
+        course_list = []
+        for i in range(l):
+            speed = speed_list[i,:]
+            course_list.append(Legacy.speed_to_course(speed))
+        return course_list
+
+    @staticmethod
+    def turning_heuristics(speed_list, speed_limit_as_stop=0):
+        course_list = Legacy.to_course_list(speed_list)
+        speed_v = np.linalg.norm(speed_list, axis=1)
+        l = len(course_list)
+        action = np.zeros(l).astype(np.int32)
+        course_diff = np.zeros(l).astype(np.float32)
+
+        enum = MyDataset.turn_str2int
+
+        thresh_low = (2*math.pi / 360)*1
+        thresh_high = (2*math.pi / 360)*35
+        thresh_slight_low = (2*math.pi / 360)*3
+
+        def diff(a, b):
+            # return a-b \in -pi to pi
+            d = a - b
+            if d > math.pi:
+                d -= math.pi * 2
+            if d < -math.pi:
+                d += math.pi * 2
+            return d
+
+        for i in range(l):
+            if i == 0:
+                action[i] = enum['not_sure']
+                continue
+
+            # the speed_limit_as_stop should be small,
+            # this detect strict real stop
+            if speed_v[i] < speed_limit_as_stop + 1e-3:
+                # take the smaller speed as stop
+                action[i] = enum['slow_or_stop']
+                continue
+
+            course = course_list[i]
+            prev = course_list[i-1]
+
+            if course is None or prev is None:
+                action[i] = enum['slow_or_stop']
+                course_diff[i] = 9999
+                continue
+
+            course_diff[i] = diff(course, prev)*360/(2*math.pi)
+            if thresh_high > diff(course, prev) > thresh_low:
+                if diff(course, prev) > thresh_slight_low:
+                    action[i] = enum['turn_right']
+                else:
+                    action[i] = enum['turn_right_slight']
+
+            elif -thresh_high < diff(course, prev) < -thresh_low:
+                if diff(course, prev) < -thresh_slight_low:
+                    action[i] = enum['turn_left']
+                else:
+                    action[i] = enum['turn_left_slight']
+            elif diff(course, prev) >= thresh_high or diff(course, prev) <= -thresh_high:
+                action[i] = enum['not_sure']
+            else:
+                action[i] = enum['straight']
+
+            if FLAGS.no_slight_turn:
+                if action[i] == enum['turn_left_slight']:
+                    action[i] = enum['turn_left']
+                if action[i] == enum['turn_right_slight']:
+                    action[i] = enum['turn_right']
+
+            # this detect significant slow down that is not due to going to turn
+            if FLAGS.deceleration_thres > 0 and action[i] == enum['straight']:
+                hz = FLAGS.frame_rate / FLAGS.temporal_downsample_factor
+                acc_now = (speed_v[i] - speed_v[i - 1]) / (1.0 / hz)
+                if acc_now < - FLAGS.deceleration_thres:
+                    action[i] = enum['slow_or_stop']
+                    continue
+
+        # avoid the initial uncertainty
+        action[0] = action[1]
+        return action
+
+    @staticmethod
+    def fix_none_in_course(course_list):
+        l = len(course_list)
+
+        # fix the initial None value
+        not_none_value = 0
+        for i in range(l):
+            if not (course_list[i] is None):
+                not_none_value = course_list[i]
+                break
+        for i in range(l):
+            if course_list[i] is None:
+                course_list[i] = not_none_value
+            else:
+                break
+
+        # a course could be None, use the previous course in that case
+        for i in range(1, l):
+            if course_list[i] is None:
+                course_list[i] = course_list[i - 1]
+        return course_list
+
+    @staticmethod
+    def relative_future_location(speed, nfuture, sample_rate):
+        # given the speed vectors, calculate the future location relative to
+        # the current location, with facing considered
+        course_list = Legacy.to_course_list(speed)
+        course_list = Legacy.fix_none_in_course(course_list)
+
+        # integrate the speed to get the location
+        loc = Legacy.integral(speed, 1.0 / sample_rate)
+
+        # project future motion on to the current facing direction
+        # this is counter clock wise
+        def rotate(vec, theta):
+            c = math.cos(theta)
+            s = math.sin(theta)
+            xp = c * vec[0] - s * vec[1]
+            yp = s * vec[0] + c * vec[1]
+            return np.array([xp, yp])
+
+        out = np.zeros_like(loc)
+        l = out.shape[0]
+        for i in range(l):
+            future = loc[min(i+nfuture, l-1), :]
+            delta = future - loc[i, :]
+            out[i, :] = rotate(delta, course_list[i])
+
+        return out
+
+    @staticmethod
+    def relative_future_course_speed(speed, nfuture, sample_rate):
+        def norm_course_diff(course):
+            if course > math.pi:
+                course = course - 2*math.pi
+            if course < -math.pi:
+                course = course + 2*math.pi
+            return course
+
+        # given the speed vectors, calculate the future location relative to
+        # the current location, with facing considered
+        course_list = Legacy.to_course_list(speed)
+        course_list = Legacy.fix_none_in_course(course_list)
+
+        # integrate the speed to get the location
+        loc = Legacy.integral(speed, 1.0 / sample_rate)
+
+        out = np.zeros_like(loc)
+        l = out.shape[0]
+        for i in range(l):
+            if i+nfuture < l:
+                fi = min(i + nfuture, l - 1)
+                # first is course diff
+                out[i, 0] = norm_course_diff(course_list[fi] - course_list[i])
+                # second is the distance
+                out[i, 1] = np.linalg.norm(loc[fi, :] - loc[i, :])
+            else:
+                # at the end of the video, just use what has before
+                out[i,:] = out[i-1,:]
+
+        # normalize the speed to be per second
+        timediff = 1.0 * nfuture / sample_rate
+        out = out / timediff
+
+        return out
+
+
+def random_track(rng, l):
+    # speed vectors (l, 2) in float32 with turns, stops, sharp turns and pure x motion
+    heading = np.cumsum(rng.normal(0, 0.05, l) + (rng.rand(l) < 0.05) * rng.normal(0, 0.8, l))
+    speed_v = np.abs(np.cumsum(rng.normal(0, 1.0, l))) + rng.uniform(0, 15)
+    speed_v[rng.rand(l) < 0.1] = 0
+    speed = np.stack([speed_v * np.sin(heading), speed_v * np.cos(heading)], axis=1)
+    speed[rng.rand(l) < 0.05, 1] = 0
+    if rng.rand() < 0.1:
+        speed[:rng.randint(l)] = 0
+    return speed.astype(np.float32)
+
+
+def same(a, b):
+    a, b = np.asarray(a), np.asarray(b)
+    if a.dtype == object or b.dtype == object:
+        a = np.array([np.nan if x is None else x for x in a], dtype=np.float64)
+        b = np.array([np.nan if x is None else x for x in b], dtype=np.float64)
+    if a.shape != b.shape or a.dtype != b.dtype:
+        return False
+    if a.dtype.kind == 'f':
+        nan = np.isnan(a)
+        return np.array_equal(nan, np.isnan(b)) and np.array_equal(a[~nan], b[~nan])
+    return np.array_equal(a, b)
+
+
+def check(name, legacy, vectorized, tracks, *args):
+    mismatches = sum(not same(legacy(t, *args), vectorized(t, *args)) for t in tracks)
+    start = time.time()
+    for t in tracks:
+        legacy(t, *args)
+    legacy_time = time.time() - start
+    start = time.time()
+    for t in tracks:
+        vectorized(t, *args)
+    vectorized_time = time.time() - start
+    print('%32s: %4d mismatches in %d tracks, %8.2f ms -> %6.2f ms per 100 tracks' % (
+        name, mismatches, len(tracks), 1e5 * legacy_time / len(tracks), 1e5 * vectorized_time / len(tracks)))
+    return mismatches
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    lengths = [1, 2, 3, 7] + [108] * 300 + list(rng.randint(2, 600, 50))
+    tracks = [random_track(rng, l) for l in lengths]
+    long_tracks = [t for t in tracks if len(t) >= 2]
+    mismatches = 0
+
+    mismatches += check('integral', Legacy.integral, util_car.integral, tracks, 1.0 / 3)
+    mismatches += check('to_course_list', Legacy.to_course_list, MyDataset.to_course_list, tracks)
+    mismatches += check('fix_none_in_course',
+                        lambda t: np.array(Legacy.fix_none_in_course(Legacy.to_course_list(t)), dtype=np.float64),
+                        lambda t: MyDataset.fix_none_in_course(MyDataset.to_course_list(t)), tracks)
+    for no_slight_turn, deceleration_thres in ((True, -1.0), (False, -1.0), (True, 1.0), (False, 0.5)):
+        FLAGS.no_slight_turn = no_slight_turn
+        FLAGS.deceleration_thres = deceleration_thres
+        for limit in (0, 0.5):
+            mismatches += check('turning_heuristics %d %.1f %.1f' % (no_slight_turn, deceleration_thres, limit),
+                                Legacy.turning_heuristics, MyDataset.turning_heuristics, long_tracks, limit)
+    actions = [rng.randint(-1, MyDataset.naction, len(t)).astype(np.int32) for t in tracks]
+    for nfuture in (0, 1, 5, 20):
+        mismatches += check('future_smooth %d' % nfuture, Legacy.future_smooth, MyDataset.future_smooth,
+                            actions, MyDataset.naction, nfuture)
+    for nfuture in (1, 5, 200):
+        mismatches += check('relative_future_location %d' % nfuture, Legacy.relative_future_location,
+                            MyDataset.relative_future_location, tracks, nfuture, 3.0)
+        mismatches += check('relative_future_course_speed %d' % nfuture, Legacy.relative_future_course_speed,
+                            MyDataset.relative_future_course_speed, tracks, nfuture, 3.0)
+
+    stops = [(rng.rand(64, 12) < p).astype(np.int32) for p in rng.uniform(0, 0.2, 200)]
+    def seeded(f):
+        def run(stop_label, drop_prob):
+            np.random.seed(len(stop_label) + int(stop_label.sum()))
+            return f(stop_label, drop_prob)
+        return run
+    mismatches += check('no_stop_dropout_valid', seeded(Legacy.no_stop_dropout_valid),
+                        seeded(MyDataset.no_stop_dropout_valid), stops, 0.5)
+
+    print('all labels identical' if mismatches == 0 else '%d MISMATCHES' % mismatches)
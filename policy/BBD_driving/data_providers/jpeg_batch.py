@@ -0,0 +1,63 @@
+'''
+Batch JPEG decoder for the BDD input pipeline, without any out of tree compilation.
+
+A segment of frames is decoded by a pool of threads directly into one (N, H, W, 3) RGB buffer:
+cv2.imdecode releases the GIL, so the threads decode in parallel, and the BGR to RGB reorder is
+fused with the copy into the buffer. A decode_downsample_factor of 2, 4 or 8 is applied by libjpeg
+while decoding (DCT domain scaling, as the ratio of tf.image.decode_jpeg), so the full resolution
+frame is never materialized.
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from multiprocessing.pool import ThreadPool
+
+import cv2
+import numpy as np
+
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR,
+                 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+class BatchJpegDecoder:
+    '''
+    decode(image_strs, H, W, downsample) decodes a batch of JPEG strings to an (N, H, W, 3) uint8
+    RGB array with nthreads threads. H and W are the size after downsampling.
+    '''
+
+    def __init__(self, nthreads=4):
+        self.nthreads = nthreads
+        # created on first use, so a decoder can be built before forking the data workers
+        self.pool = None
+
+    def decode_into(self, image_strs, out, downsample, start, end):
+        flag = REDUCED_FLAGS[downsample]
+        H, W = out.shape[1:3]
+        for i in range(start, end):
+            bgr = cv2.imdecode(np.frombuffer(image_strs[i], dtype=np.uint8), flag)
+            if bgr is None:
+                raise ValueError("frame %d of the segment is not a valid JPEG" % i)
+            if bgr.shape[:2] != (H, W):
+                # sizes not divisible by the downsample factor are rounded up by libjpeg
+                bgr = cv2.resize(bgr, (W, H), interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=out[i])
+
+    def decode(self, image_strs, H, W, downsample=1, out=None):
+        N = len(image_strs)
+        if out is None:
+            out = np.empty([N, H, W, 3], dtype=np.uint8)
+        # contiguous chunks, one per thread, each thread writes its own frames of out
+        bounds = np.linspace(0, N, min(self.nthreads, N) + 1).astype(np.int64)
+        chunks = [(image_strs, out, int(downsample), bounds[k], bounds[k + 1]) for k in range(len(bounds) - 1)]
+        if len(chunks) <= 1:
+            for chunk in chunks:
+                self.decode_into(*chunk)
+        else:
+            if self.pool is None:
+                self.pool = ThreadPool(self.nthreads)
+            self.pool.map(lambda chunk: self.decode_into(*chunk), chunks)
+        return out
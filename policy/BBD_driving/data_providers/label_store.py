@@ -0,0 +1,102 @@
+'''
+Sidecar store of labels precomputed from the TFRecords, so the reader looks them up instead of
+recomputing them every epoch.
+
+A store holds the labels of every record of one subset for one label configuration, a dict of the
+flags the labels depend on. Stores of different configurations live side by side under one root, in
+a folder named by the hash of the configuration, so label parameter sweeps reuse earlier passes, and
+every subset has its own store in it:
+
+    <root>/labels_<hash>/<subset>/config.json    the configuration, the array names and number of records
+                                  names.npy      video name of every record, as stored in image/class/video_name
+                                  <array>.npy    one row per record, memory-mapped on load
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+def config_hash(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def store_path(root, config, subset):
+    return os.path.join(root, 'labels_' + config_hash(config), subset)
+
+
+def write_label_store(root, config, subset, names, arrays):
+    '''
+    Writes the store of config and subset under root, replacing an existing one. The stores of the
+    other subsets are kept.
+
+    Args:
+        names: video name of every record
+        arrays: dict of array name to a list with the array of every record
+    Returns:
+        the store folder
+    '''
+    path = store_path(root, config, subset)
+    # written to a temporary folder first, an interrupted pass leaves no partial store
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, 'names.npy'), np.array(names, dtype=bytes))
+    for key, rows in arrays.items():
+        np.save(os.path.join(tmp_path, key + '.npy'), np.stack(rows))
+    with open(os.path.join(tmp_path, 'config.json'), 'w') as f:
+        json.dump({'config': config, 'arrays': sorted(arrays.keys()), 'records': len(names)}, f,
+                  sort_keys=True, indent=1)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    return path
+
+
+class LabelStore:
+    '''
+    Opens the store in folder path. row(name) is the row of a video name or None, store[array] the
+    read-only memory-mapped array.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'config.json')) as f:
+            meta = json.load(f)
+        self.config = meta['config']
+        names = np.load(os.path.join(path, 'names.npy'))
+        self.rows = {name: i for i, name in enumerate(names.tolist())}
+        self.missing = set()
+        self.arrays = {key: np.load(os.path.join(path, key + '.npy'), mmap_mode='r') for key in meta['arrays']}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def row(self, name):
+        row = self.rows.get(name)
+        if row is None and name not in self.missing:
+            # the labels of this record are computed, warned once per record
+            self.missing.add(name)
+            print("Warning: %s is not in the label store %s, computing its labels" % (name, self.path))
+        return row
+
+
+def open_label_store(root, config, subset):
+    # the store of config and subset under root, None if no pass has been run for it
+    path = store_path(root, config, subset)
+    if not os.path.exists(os.path.join(path, 'config.json')):
+        return None
+    return LabelStore(path)
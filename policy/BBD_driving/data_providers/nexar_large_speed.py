@@ -17,6 +17,8 @@ import cv2
 import ctypes
 import math, copy
 from scipy import interpolate
+from data_providers.label_store import open_label_store
+from data_providers.jpeg_batch import BatchJpegDecoder
 
 FLAGS = tf.app.flags.FLAGS
 
@@ -64,8 +66,11 @@ tf.app.flags.DEFINE_boolean('no_slight_turn', True,
 tf.app.flags.DEFINE_boolean('non_random_temporal_downsample', False,
                             '''if true, use fixed downsample method''')
 tf.app.flags.DEFINE_string('fast_jpeg_decode', "default",
-                            '''which type of jpeg decode to use: default, tf, pyfunc'''
-                            '''tf is the fastest and could reduce CPU usage a lot, but require compilation''')
+                            '''which type of jpeg decode to use: default, tf, pyfunc, threaded'''
+                            '''tf is the fastest and could reduce CPU usage a lot, but require compilation'''
+                            '''threaded decodes a segment on a thread pool, needs no compilation''')
+tf.app.flags.DEFINE_integer('jpeg_decode_threads', 4,
+                            '''threads decoding one segment when fast_jpeg_decode is threaded''')
 #dataset specified FLAGS
 tf.app.flags.DEFINE_string('city_image_list','/data/hxu/fineGT/trainval_images.txt',
                            'the privilege training segmentation image index')
@@ -110,6 +115,17 @@ tf.app.flags.DEFINE_boolean('use_perspective_augmentation', False,
 tf.app.flags.DEFINE_integer('inflate_MKZ_factor', -1,
                             'inflate the MKZ data if > 0 ')
 
+tf.app.flags.DEFINE_string('label_store', '',
+                           'root of the label stores written by prepare_labels.py, if set the stop, turn and '
+                           'future course/speed labels are looked up instead of computed every epoch')
+
+# the flags that the labels computed from image/speeds depend on, a label store is kept per value
+LABEL_FLAGS = ('FRAMES_IN_SEG', 'temporal_downsample_factor', 'frame_rate', 'stop_future_frames',
+               'speed_limit_as_stop', 'no_slight_turn', 'deceleration_thres')
+
+# the BatchJpegDecoder of fast_jpeg_decode=threaded
+batch_jpeg_decoder = None
+
 
 # the newly designed class has to have those methods
 # especially the reader() that reads the binary record and the
@@ -117,6 +133,7 @@ tf.app.flags.DEFINE_integer('inflate_MKZ_factor', -1,
 class MyDataset(Dataset):
     def __init__(self, subset):
         super(MyDataset, self).__init__('nexar', subset)
+        self.label_store = None
 
     def num_classes(self):
         """Returns the number of classes in the data set."""
@@ -264,6 +281,13 @@ class MyDataset(Dataset):
             ans.set_shape([FLAGS.FRAMES_IN_SEG // FLAGS.temporal_downsample_factor,
                            FLAGS.IM_HEIGHT, FLAGS.IM_WIDTH, 3])
             return ans
+        elif FLAGS.fast_jpeg_decode == "threaded":
+            print("using the threaded batch jpeg decode...")
+            global batch_jpeg_decoder
+            if batch_jpeg_decoder is None:
+                # one pool shared by all the preprocessing threads
+                batch_jpeg_decoder = BatchJpegDecoder(FLAGS.jpeg_decode_threads)
+            return self.decode_jpeg_threaded(image_buffer, scope)
         else:
             return self.decode_jpeg_original(image_buffer, scope)
 
@@ -358,6 +382,22 @@ class MyDataset(Dataset):
 
         return ans
 
+    @staticmethod
+    def decode_batch_threaded(image_strs, H, W, C, downsample):
+        assert (C == 3)
+        return batch_jpeg_decoder.decode(image_strs, H, W, downsample)
+
+    def decode_jpeg_threaded(self, image_buffer, scope=None):
+        with tf.op_scope([image_buffer], scope, 'decode_jpeg'):
+            cN = FLAGS.FRAMES_IN_SEG // FLAGS.temporal_downsample_factor
+            cH = FLAGS.IM_HEIGHT // FLAGS.decode_downsample_factor
+            cW = FLAGS.IM_WIDTH // FLAGS.decode_downsample_factor
+            cC = 3
+            cDown = FLAGS.decode_downsample_factor
+            decoded = tf.py_func(self.decode_batch_threaded, [image_buffer, cH, cW, cC, cDown], [tf.uint8])[0]
+            decoded.set_shape([cN, cH, cW, cC])
+            return decoded
+
     def decode_jpeg_python(self, image_buffer, scope=None):
         with tf.op_scope([image_buffer], scope, 'decode_jpeg'):
             cN = FLAGS.FRAMES_IN_SEG // FLAGS.temporal_downsample_factor
@@ -373,22 +413,22 @@ class MyDataset(Dataset):
     def future_smooth(actions, naction, nfuture):
         # TODO: could add weighting differently between near future and far future
         # given a list of actions, for each time step, return the distribution of future actions
-        l = len(actions) # action is a list of integers, from 0 to naction-1, negative values are ignored
-        out = np.zeros((l, naction), dtype=np.float32)
-        for i in range(l):
-            # for each output position
-            total = 0
-            for j in range(min(nfuture, l-i)):
-                # for each future position
-                # current deal with i+j action
-                acti = i + j
-                if actions[acti]>=0:
-                    out[i, actions[acti]] += 1
-                    total += 1
-            if total == 0:
-                out[i, MyDataset.turn_str2int['straight']] = 1.0
-            else:
-                out[i, :] = out[i, :] / total
+        actions = np.asarray(actions) # action is a list of integers, from 0 to naction-1, negative values are ignored
+        l = len(actions)
+        # counts of every action in the window [i, i+nfuture) from cumulative counts
+        valid = np.flatnonzero(actions >= 0)
+        cumulative = np.zeros((l + 1, naction), dtype=np.int64)
+        cumulative[valid + 1, actions[valid]] = 1
+        np.cumsum(cumulative, axis=0, out=cumulative)
+        start = np.arange(l)
+        end = np.maximum(np.minimum(start + nfuture, l), start)
+        counts = cumulative[end] - cumulative[start]
+        total = counts.sum(axis=1)
+
+        out = counts.astype(np.float32)
+        has_action = total > 0
+        out[has_action] /= total[has_action, np.newaxis].astype(np.float32)
+        out[~has_action, MyDataset.turn_str2int['straight']] = 1.0
         return out
 
     @staticmethod
@@ -406,22 +446,19 @@ class MyDataset(Dataset):
 
     @staticmethod
     def no_stop_dropout_valid(stop_label, drop_prob):
-        nbatch = stop_label.shape[0]
-        ntime  = stop_label.shape[1]
-        out = np.ones(nbatch, dtype=np.bool)
-        for i in range(nbatch):
-            # determine whether this seq has stop
-            has_stop = False
-            for j in range(ntime):
-                if stop_label[i, j]:
-                    has_stop = True
-                    break
-            if not has_stop:
-                if np.random.rand() < drop_prob:
-                    out[i] = False
-        
+        has_stop = np.any(stop_label, axis=1)
+        out = np.ones(stop_label.shape[0], dtype=bool)
+        # one random number per sequence without a stop, in order
+        no_stop = np.flatnonzero(~has_stop)
+        out[no_stop] = ~(np.random.rand(len(no_stop)) < drop_prob)
         return out
 
+    @staticmethod
+    def scalar_float(dtype):
+        # the type of a numpy scalar of dtype times a python float, float32 stays float32 from
+        # numpy 2 on, it used to become float64. Array versions of scalar code cast to it first
+        return type(np.dtype(dtype).type(1) * 1.0)
+
     @staticmethod
     def speed_to_course(speed):
         pi = math.pi
@@ -447,12 +484,25 @@ class MyDataset(Dataset):
 
     @staticmethod
     def to_course_list(speed_list):
-        l = speed_list.shape[0]
-        course_list = []
-        for i in range(l):
-            speed = speed_list[i,:]
-            course_list.append(MyDataset.speed_to_course(speed))
-        return course_list
+        # speed_to_course of every row as a float64 array, None (standing still) is NaN
+        pi = math.pi
+        x = speed_list[:, 0]
+        y = speed_list[:, 1]
+        course = np.full(speed_list.shape[0], np.nan)
+
+        vertical = y == 0
+        course[vertical & (x > 0)] = pi / 2
+        course[vertical & (x < 0)] = 3 * pi / 2
+
+        moving = np.flatnonzero(~vertical)
+        # np.arctan may differ from math.atan in the last bit
+        quotient = x[moving] / y[moving]
+        atan = np.frompyfunc(math.atan, 1, 1)(quotient).astype(np.float64)
+        atan = np.where(atan < 0, atan + 2 * pi, atan)
+        backward = atan + pi
+        backward = np.where(backward > 2 * pi, backward - 2 * pi, backward)
+        course[moving] = np.where(y[moving] > 0, atan, backward)
+        return course
 
     turn_str2int={'not_sure': -1, 'straight': 0, 'slow_or_stop': 1,
                   'turn_left': 2, 'turn_right': 3,
@@ -466,9 +516,6 @@ class MyDataset(Dataset):
     def turning_heuristics(speed_list, speed_limit_as_stop=0):
         course_list = MyDataset.to_course_list(speed_list)
         speed_v = np.linalg.norm(speed_list, axis=1)
-        l = len(course_list)
-        action = np.zeros(l).astype(np.int32)
-        course_diff = np.zeros(l).astype(np.float32)
 
         enum = MyDataset.turn_str2int
 
@@ -476,66 +523,41 @@ class MyDataset(Dataset):
         thresh_high = (2*math.pi / 360)*35
         thresh_slight_low = (2*math.pi / 360)*3
 
-        def diff(a, b):
-            # return a-b \in -pi to pi
-            d = a - b
-            if d > math.pi:
-                d -= math.pi * 2
-            if d < -math.pi:
-                d += math.pi * 2
-            return d
-
-        for i in range(l):
-            if i == 0:
-                action[i] = enum['not_sure']
-                continue
-
-            # the speed_limit_as_stop should be small,
-            # this detect strict real stop
-            if speed_v[i] < speed_limit_as_stop + 1e-3:
-                # take the smaller speed as stop
-                action[i] = enum['slow_or_stop']
-                continue
-
-            course = course_list[i]
-            prev = course_list[i-1]
-
-            if course is None or prev is None:
-                action[i] = enum['slow_or_stop']
-                course_diff[i] = 9999
-                continue
-
-            course_diff[i] = diff(course, prev)*360/(2*math.pi)
-            if thresh_high > diff(course, prev) > thresh_low:
-                if diff(course, prev) > thresh_slight_low:
-                    action[i] = enum['turn_right']
-                else:
-                    action[i] = enum['turn_right_slight']
-
-            elif -thresh_high < diff(course, prev) < -thresh_low:
-                if diff(course, prev) < -thresh_slight_low:
-                    action[i] = enum['turn_left']
-                else:
-                    action[i] = enum['turn_left_slight']
-            elif diff(course, prev) >= thresh_high or diff(course, prev) <= -thresh_high:
-                action[i] = enum['not_sure']
-            else:
-                action[i] = enum['straight']
-
-            if FLAGS.no_slight_turn:
-                if action[i] == enum['turn_left_slight']:
-                    action[i] = enum['turn_left']
-                if action[i] == enum['turn_right_slight']:
-                    action[i] = enum['turn_right']
-
-            # this detect significant slow down that is not due to going to turn
-            if FLAGS.deceleration_thres > 0 and action[i] == enum['straight']:
-                hz = FLAGS.frame_rate / FLAGS.temporal_downsample_factor
-                acc_now = (speed_v[i] - speed_v[i - 1]) / (1.0 / hz)
-                if acc_now < - FLAGS.deceleration_thres:
-                    action[i] = enum['slow_or_stop']
-                    continue
-
+        # course difference to the previous frame, in -pi to pi
+        diff = course_list[1:] - course_list[:-1]
+        diff = np.where(diff > math.pi, diff - math.pi * 2, diff)
+        diff = np.where(diff < -math.pi, diff + math.pi * 2, diff)
+
+        right = (thresh_high > diff) & (diff > thresh_low)
+        left = (-thresh_high < diff) & (diff < -thresh_low)
+        unsure = (diff >= thresh_high) | (diff <= -thresh_high)
+        action = np.select([right & (diff > thresh_slight_low), right,
+                            left & (diff < -thresh_slight_low), left,
+                            unsure],
+                           [enum['turn_right'], enum['turn_right_slight'],
+                            enum['turn_left'], enum['turn_left_slight'],
+                            enum['not_sure']],
+                           enum['straight']).astype(np.int32)
+
+        if FLAGS.no_slight_turn:
+            action[action == enum['turn_left_slight']] = enum['turn_left']
+            action[action == enum['turn_right_slight']] = enum['turn_right']
+
+        # this detect significant slow down that is not due to going to turn
+        speed_s = speed_v.astype(MyDataset.scalar_float(speed_v.dtype))
+        if FLAGS.deceleration_thres > 0:
+            hz = FLAGS.frame_rate / FLAGS.temporal_downsample_factor
+            acc_now = (speed_v[1:] - speed_v[:-1]).astype(speed_s.dtype) / (1.0 / hz)
+            action[(action == enum['straight']) & (acc_now < - FLAGS.deceleration_thres)] = enum['slow_or_stop']
+
+        # a course could be None when standing still
+        action[np.isnan(course_list[1:]) | np.isnan(course_list[:-1])] = enum['slow_or_stop']
+
+        # the speed_limit_as_stop should be small,
+        # this detect strict real stop
+        action[speed_s[1:] < speed_limit_as_stop + 1e-3] = enum['slow_or_stop']
+
+        action = np.concatenate(([enum['not_sure']], action)).astype(np.int32)
         # avoid the initial uncertainty
         action[0] = action[1]
         return action
@@ -549,25 +571,15 @@ class MyDataset(Dataset):
 
     @staticmethod
     def fix_none_in_course(course_list):
-        l = len(course_list)
-
-        # fix the initial None value
-        not_none_value = 0
-        for i in range(l):
-            if not (course_list[i] is None):
-                not_none_value = course_list[i]
-                break
-        for i in range(l):
-            if course_list[i] is None:
-                course_list[i] = not_none_value
-            else:
-                break
-
-        # a course could be None, use the previous course in that case
-        for i in range(1, l):
-            if course_list[i] is None:
-                course_list[i] = course_list[i - 1]
-        return course_list
+        # fill None (NaN) courses with the previous course, the initial ones with the first known
+        course = np.array(course_list, dtype=np.float64)
+        known = ~np.isnan(course)
+        if not known.any():
+            return np.zeros_like(course)
+        index = np.where(known, np.arange(len(course)), 0)
+        index[:np.argmax(known)] = np.argmax(known)
+        np.maximum.accumulate(index, out=index)
+        return course[index]
 
     @staticmethod
     def relative_future_location(speed, nfuture, sample_rate):
@@ -581,31 +593,21 @@ class MyDataset(Dataset):
 
         # project future motion on to the current facing direction
         # this is counter clock wise
-        def rotate(vec, theta):
-            c = math.cos(theta)
-            s = math.sin(theta)
-            xp = c * vec[0] - s * vec[1]
-            yp = s * vec[0] + c * vec[1]
-            return np.array([xp, yp])
+        l = loc.shape[0]
+        future = loc[np.minimum(np.arange(l) + nfuture, l - 1), :]
+        delta = future - loc
+        dtype = MyDataset.scalar_float(delta.dtype)
+        delta = delta.astype(dtype)
+        c = np.cos(course_list).astype(dtype)
+        s = np.sin(course_list).astype(dtype)
 
         out = np.zeros_like(loc)
-        l = out.shape[0]
-        for i in range(l):
-            future = loc[min(i+nfuture, l-1), :]
-            delta = future - loc[i, :]
-            out[i, :] = rotate(delta, course_list[i])
-
+        out[:, 0] = c * delta[:, 0] - s * delta[:, 1]
+        out[:, 1] = s * delta[:, 0] + c * delta[:, 1]
         return out
 
     @staticmethod
     def relative_future_course_speed(speed, nfuture, sample_rate):
-        def norm_course_diff(course):
-            if course > math.pi:
-                course = course - 2*math.pi
-            if course < -math.pi:
-                course = course + 2*math.pi
-            return course
-
         # given the speed vectors, calculate the future location relative to
         # the current location, with facing considered
         course_list = MyDataset.to_course_list(speed)
@@ -616,16 +618,17 @@ class MyDataset(Dataset):
 
         out = np.zeros_like(loc)
         l = out.shape[0]
-        for i in range(l):
-            if i+nfuture < l:
-                fi = min(i + nfuture, l - 1)
-                # first is course diff
-                out[i, 0] = norm_course_diff(course_list[fi] - course_list[i])
-                # second is the distance
-                out[i, 1] = np.linalg.norm(loc[fi, :] - loc[i, :])
-            else:
-                # at the end of the video, just use what has before
-                out[i,:] = out[i-1,:]
+        n = l - nfuture
+        if n > 0:
+            course = course_list[nfuture:] - course_list[:n]
+            course = np.where(course > math.pi, course - 2*math.pi, course)
+            course = np.where(course < -math.pi, course + 2*math.pi, course)
+            # first is course diff
+            out[:n, 0] = course
+            # second is the distance
+            out[:n, 1] = np.linalg.norm(loc[nfuture:, :] - loc[:n, :], axis=1)
+            # at the end of the video, just use what has before
+            out[n:, :] = out[n - 1, :]
 
         # normalize the speed to be per second
         timediff = 1.0 * nfuture / sample_rate
@@ -633,6 +636,47 @@ class MyDataset(Dataset):
 
         return out
 
+    @staticmethod
+    def label_config():
+        config = {name: getattr(FLAGS, name) for name in LABEL_FLAGS}
+        # bump when the label functions change
+        config['version'] = 1
+        return config
+
+    @staticmethod
+    def labels_of_speed(speed):
+        # stop, turn and future course/speed labels of one downsampled speed track, with the
+        # arguments as tf.py_func hands them over: python ints as int32, floats as float32
+        nfuture = np.array(FLAGS.stop_future_frames, dtype=np.int32)
+        limit = np.array(FLAGS.speed_limit_as_stop, dtype=np.float32)
+        sample_rate = np.array(FLAGS.frame_rate / FLAGS.temporal_downsample_factor, dtype=np.float32)
+        return (MyDataset.speed_to_future_has_stop(speed, nfuture, limit),
+                MyDataset.turn_future_smooth(speed, nfuture, limit),
+                MyDataset.relative_future_course_speed(speed, nfuture, sample_rate))
+
+    @staticmethod
+    def labels_of_record(speeds):
+        # labels_of_speed for every temporal downsample start of a record's image/speeds values,
+        # stacked to temporal_downsample_factor * len_downsampled * ..., None if the record is too short
+        factor = FLAGS.temporal_downsample_factor
+        len_downsampled = FLAGS.FRAMES_IN_SEG // factor
+        speed = np.asarray(speeds, dtype=np.float32).reshape(-1, 2)[:FLAGS.FRAMES_IN_SEG, :]
+        tracks = [speed[tstart::factor, :] for tstart in range(factor)]
+        if any(len(track) != len_downsampled for track in tracks):
+            return None
+        labels = [MyDataset.labels_of_speed(track) for track in tracks]
+        return [np.stack(x) for x in zip(*labels)]
+
+    def stored_labels(self, name, tstart, speed):
+        row = self.label_store.row(name[0])
+        if row is None:
+            # records added after the store was written
+            stop_label, turn, locs = MyDataset.labels_of_speed(speed)
+        else:
+            stop_label, turn, locs = [self.label_store[key][row, tstart] for key in ("stop", "turn", "locs")]
+        return [np.array(stop_label, dtype=np.int32),
+                np.array(turn, dtype=np.float32),
+                np.array(locs, dtype=np.float32)]
 
     def decode_png(self, image_buffer, scope=None):
         with tf.op_scope([image_buffer], scope, 'decode_png'):
@@ -791,17 +835,31 @@ class MyDataset(Dataset):
         speed = speed[tstart::FLAGS.temporal_downsample_factor, :]
         speed.set_shape([len_downsampled, 2])
 
-        # from speed to stop labels
-        stop_label = tf.py_func(self.speed_to_future_has_stop,
-                                [speed, FLAGS.stop_future_frames, FLAGS.speed_limit_as_stop],
-                                [tf.int32])[0] #TODO(lowres: length of smoothed time)
-        stop_label.set_shape([len_downsampled])
+        if FLAGS.label_store != "" and self.label_store is None:
+            self.label_store = open_label_store(FLAGS.label_store, self.label_config(), self.subset)
+            if self.label_store is None:
+                print("no label store for the current label flags and subset %s in %s, run prepare_labels.py" %
+                      (self.subset, FLAGS.label_store))
+            else:
+                print("using the label store %s of %d records" % (self.label_store.path, len(self.label_store)))
 
-        # Note that the turning heuristic is tuned for 3Hz video and urban area
-        # Note also that stop_future_frames is reused for the turn
-        turn = tf.py_func(self.turn_future_smooth,
-                               [speed, FLAGS.stop_future_frames, FLAGS.speed_limit_as_stop],
-                               [tf.float32])[0]  #TODO(lowres)
+        if self.label_store is not None:
+            # labels precomputed by prepare_labels.py, only looked up
+            stop_label, turn, stored_locs = tf.py_func(self.stored_labels,
+                                                       [name, tstart, speed],
+                                                       [tf.int32, tf.float32, tf.float32])
+        else:
+            # from speed to stop labels
+            stop_label = tf.py_func(self.speed_to_future_has_stop,
+                                    [speed, FLAGS.stop_future_frames, FLAGS.speed_limit_as_stop],
+                                    [tf.int32])[0] #TODO(lowres: length of smoothed time)
+
+            # Note that the turning heuristic is tuned for 3Hz video and urban area
+            # Note also that stop_future_frames is reused for the turn
+            turn = tf.py_func(self.turn_future_smooth,
+                                   [speed, FLAGS.stop_future_frames, FLAGS.speed_limit_as_stop],
+                                   [tf.float32])[0]  #TODO(lowres)
+        stop_label.set_shape([len_downsampled])
         turn.set_shape([len_downsampled, self.naction])
 
 
@@ -826,9 +884,12 @@ class MyDataset(Dataset):
             # get the relative future location
             # Note that we again abuse the notation a little bit, reusing stop_future_frames
             # TODO: normalize the course and speed by time
-            locs = tf.py_func(self.relative_future_course_speed,
-                              [speed, FLAGS.stop_future_frames, FLAGS.frame_rate / FLAGS.temporal_downsample_factor],
-                              [tf.float32])[0]
+            if self.label_store is not None:
+                locs = stored_locs
+            else:
+                locs = tf.py_func(self.relative_future_course_speed,
+                                  [speed, FLAGS.stop_future_frames, FLAGS.frame_rate / FLAGS.temporal_downsample_factor],
+                                  [tf.float32])[0]
             locs.set_shape([len_downsampled, 2])
 
 
@@ -22,9 +22,10 @@ import tensorflow.contrib.slim as slim
 import batching
 import dataset
 import util
-from sklearn.metrics import roc_auc_score, accuracy_score, confusion_matrix
+from sklearn.metrics import roc_auc_score
 import itertools
 import pickle
+from eval_metrics import ConfusionMatrix, RunningSum, Reservoir, AppendArray
 
 FLAGS = tf.app.flags.FLAGS
 
@@ -77,6 +78,12 @@ tf.app.flags.DEFINE_boolean('save_best_model', False,
 tf.app.flags.DEFINE_string('eval_viz_id', "viz",
                             """the output folder name of the visualization""")
 
+tf.app.flags.DEFINE_integer('eval_reservoir_size', 2000,
+                            """how many batches of (loss, names) are sampled into seg.pickle""")
+tf.app.flags.DEFINE_boolean('eval_spill_logits', False,
+                            """append every logit and label to logits.bin and labels.bin in eval_dir, """
+                            """read them with eval_metrics.load_append_array""")
+
 # the best error global recorder
 best_error = 1e9
 should_save = False
@@ -208,6 +215,26 @@ def plot_confusion_matrix(cm, classes,
   plt.xlabel('Predicted label')
 
 
+def open_spills(nlogit, nlabel):
+  # on-disk logits and labels if eval_spill_logits, otherwise nothing is kept
+  if not FLAGS.eval_spill_logits:
+    return None
+  return (AppendArray(os.path.join(FLAGS.eval_dir, 'logits.bin'), [nlogit]),
+          AppendArray(os.path.join(FLAGS.eval_dir, 'labels.bin'), [nlabel]))
+
+
+def append_spills(spills, logits_v, labels_v):
+  if spills is not None:
+    for spill, v in zip(spills, (logits_v, labels_v)):
+      spill.append(v)
+
+
+def close_spills(spills):
+  if spills is not None:
+    for spill in spills:
+      spill.close()
+
+
 def car_discrete(logits_all, labels_in, loss_op, sess, coord, summary_op, tensors_in, summary_writer):
   logits = tf.nn.softmax(logits_all[0])
   labels = labels_in[1] # since the second entry is the turn label
@@ -240,11 +267,10 @@ def car_discrete(logits_all, labels_in, loss_op, sess, coord, summary_op, tensor
 
   total_loss = 0.0
   real_acc = 0.0
-  logits_all = np.zeros((0, nclass), dtype=np.float32)
-
-  labels_all = np.zeros((0, nclass), dtype=np.float32)
-
-  save_loss = []
+  cnf = ConfusionMatrix(nclass)
+  l1_diff = RunningSum()
+  save_loss = Reservoir(FLAGS.eval_reservoir_size)
+  spills = open_spills(nclass, nclass)
 
   print('%s: starting evaluation on (%s).' % (datetime.now(), FLAGS.subset))
   start_time = time.time()
@@ -284,11 +310,12 @@ def car_discrete(logits_all, labels_in, loss_op, sess, coord, summary_op, tensor
       else:
         real_loss_v, loss_v, labels_v, logits_v, tin_out_v_2 = \
             sess.run([real_loss, loss_op, labels, logits, tensors_in[2]])
-    logits_all = np.concatenate((logits_all, logits_v), axis=0)
-    labels_all = np.concatenate((labels_all, labels_v), axis=0)
+    cnf.update(np.argmax(labels_v, axis=1), np.argmax(logits_v, axis=1))
+    l1_diff.update(np.abs(labels_v - logits_v))
+    append_spills(spills, logits_v, labels_v)
     total_loss = total_loss + loss_v[0]
     real_acc += real_loss_v
-    save_loss.append([real_loss_v, tin_out_v_2])
+    save_loss.add([real_loss_v, tin_out_v_2])
 
     if step % 20 == 19:
       duration = time.time() - start_time
@@ -309,15 +336,12 @@ def car_discrete(logits_all, labels_in, loss_op, sess, coord, summary_op, tensor
   # compute the accuracy, precision, recall, auc, perplexity==loss
   total_loss = total_loss / num_iter
   real_acc /= num_iter
-  label1 = np.argmax(labels_all, axis=1)
-  pred1  = np.argmax(logits_all, axis=1)
-  with open(os.path.join(FLAGS.eval_dir,'seg.pickle'),'w') as f:
-      pickle.dump(save_loss, f)
+  close_spills(spills)
 
-  accuracy = accuracy_score(label1, pred1)
+  accuracy = cnf.accuracy()
   # each class's L1 diff average
   int2str = dataset_module.MyDataset.turn_int2str
-  class_diff = np.sum(np.abs(labels_all - logits_all), axis=0) / labels_all.shape[0]
+  class_diff = l1_diff.mean()
   class_diff = class_diff.ravel()
 
   diff_dict = {}
@@ -345,7 +369,7 @@ def car_discrete(logits_all, labels_in, loss_op, sess, coord, summary_op, tensor
 
   # add the confusion matrix
   np.set_printoptions(precision=2)
-  cnf_matrix = confusion_matrix(label1, pred1)
+  cnf_matrix, _ = cnf.present()
   # Plot normalized confusion matrix
   plt.figure()
   plot_confusion_matrix(cnf_matrix, classes=class_names, normalize=True,
@@ -358,7 +382,7 @@ def car_discrete(logits_all, labels_in, loss_op, sess, coord, summary_op, tensor
               pad_inches=0.3)
 
   with open(os.path.join(FLAGS.eval_dir, 'seg.pickle'), 'w') as f:
-    pickle.dump(save_loss, f)
+    pickle.dump(save_loss.items, f)
 
   return summary
 
@@ -369,6 +393,8 @@ def car_continuous(logits_all_in, labels_in, loss_op, sess, coord, summary_op, t
   labels = tf.reshape(labels, [-1, nclass])
 
   total_loss = 0.0
+  log_likes = RunningSum()
+  spills = open_spills(logits.get_shape()[-1].value, nclass)
 
   print('%s: starting evaluation on (%s).' % (datetime.now(), FLAGS.subset))
   start_time = time.time()
@@ -406,12 +432,9 @@ def car_continuous(logits_all_in, labels_in, loss_op, sess, coord, summary_op, t
 
     else:
       loss_v, labels_v, logits_v = sess.run([loss_op, labels, logits])
-    if step == 0:
-      logits_all = logits_v
-      labels_all = labels_v
-    else:
-      logits_all = np.concatenate((logits_all, logits_v), axis=0)
-      labels_all = np.concatenate((labels_all, labels_v), axis=0)
+    # the log likelihood of every example, only the running sum is kept
+    log_likes.update(model.continous_pdf([logits_v], [labels_v]))
+    append_spills(spills, logits_v, labels_v)
     total_loss = total_loss + loss_v[0]
 
 
@@ -431,9 +454,9 @@ def car_continuous(logits_all_in, labels_in, loss_op, sess, coord, summary_op, t
 
   # compute the accuracy, precision, recall, auc, perplexity==loss
   total_loss = total_loss / num_iter
+  close_spills(spills)
   #MAPs = model.continous_MAP([logits_all])
-  logLikes = model.continous_pdf([logits_all], [labels_all])
-  meanLikes = np.mean(logLikes, axis=0)
+  meanLikes = log_likes.mean()
 
   summary = tf.Summary()
   summary.ParseFromString(sess.run(summary_op))
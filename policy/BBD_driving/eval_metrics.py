@@ -0,0 +1,111 @@
+'''
+Streaming accumulators for eval.py. Every metric is updated batch by batch and keeps a fixed amount
+of state, so an eval over millions of examples runs in constant memory:
+
+    ConfusionMatrix   counts of (label, prediction) pairs, gives the accuracy too
+    RunningSum        column sums and row count, for mean losses, L1 diffs and log-likelihoods
+    Reservoir         a uniform sample of at most capacity items, for the plots and seg.pickle
+    AppendArray       an append-only on-disk array, for spilling every logit when requested
+
+An AppendArray is a raw file <path> of rows plus <path>.json with the dtype, the row shape and the
+number of rows, load_append_array(path) memory-maps it.
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import numpy as np
+
+
+class ConfusionMatrix:
+    def __init__(self, nclass):
+        self.nclass = nclass
+        self.counts = np.zeros((nclass, nclass), dtype=np.int64)
+
+    def update(self, labels, preds):
+        # labels and preds are integer classes, rows of counts are labels and columns are predictions
+        pairs = np.asarray(labels, dtype=np.int64) * self.nclass + np.asarray(preds, dtype=np.int64)
+        self.counts += np.bincount(pairs, minlength=self.nclass ** 2).reshape(self.nclass, self.nclass)
+
+    def accuracy(self):
+        return np.trace(self.counts) / max(self.counts.sum(), 1)
+
+    def present(self):
+        # the matrix over the classes that appear as a label or a prediction, as sklearn's confusion_matrix
+        present = np.flatnonzero(self.counts.sum(axis=0) + self.counts.sum(axis=1))
+        return self.counts[np.ix_(present, present)], present
+
+
+class RunningSum:
+    def __init__(self):
+        self.sum = 0.0
+        self.count = 0
+
+    def update(self, values):
+        # values has one row per example
+        values = np.asarray(values, dtype=np.float64)
+        self.sum = self.sum + values.sum(axis=0)
+        self.count += values.shape[0]
+
+    def mean(self):
+        return self.sum / max(self.count, 1)
+
+
+class Reservoir:
+    '''Uniform sample without replacement of at most capacity of all the items added (algorithm R).'''
+
+    def __init__(self, capacity, rng=np.random):
+        self.capacity = capacity
+        self.rng = rng
+        self.items = []
+        self.seen = 0
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.capacity:
+            self.items.append(item)
+        else:
+            slot = self.rng.randint(self.seen)
+            if slot < self.capacity:
+                self.items[slot] = item
+
+
+class AppendArray:
+    '''Rows appended to the raw file path, with shape (n,) + row_shape.'''
+
+    def __init__(self, path, row_shape, dtype=np.float32):
+        self.path = path
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.file = open(path, 'wb')
+        self.write_meta()
+
+    def write_meta(self):
+        tmp = self.path + '.json.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'dtype': self.dtype.str, 'row_shape': list(self.row_shape), 'rows': self.rows}, f)
+        os.rename(tmp, self.path + '.json')
+
+    def append(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        assert rows.shape[1:] == self.row_shape
+        self.file.write(rows.tobytes())
+        self.rows += rows.shape[0]
+
+    def close(self):
+        self.file.close()
+        self.write_meta()
+
+
+def load_append_array(path):
+    with open(path + '.json') as f:
+        meta = json.load(f)
+    shape = (meta['rows'],) + tuple(meta['row_shape'])
+    if meta['rows'] == 0:
+        return np.zeros(shape, dtype=meta['dtype'])
+    return np.memmap(path, dtype=meta['dtype'], mode='r', shape=shape)
@@ -27,6 +27,7 @@ TOWER_NAME = 'tower'
 BATCHNORM_MOVING_AVERAGE_DECAY=0.9997
 MOVING_AVERAGE_DECAY=0.9999
 IGNORE_LABEL = 255
+TEMPORAL_FEATURES = 'temporal_features'
 
 tf.app.flags.DEFINE_string('arch_selection', 'LRCN',
                            """select which arch to use under this file""")
@@ -417,6 +418,9 @@ def LRCN(net_inputs, num_classes, for_training, initial_state=None):
             all_features = slim.dropout(all_features,
                                         keep_prob=FLAGS.dropout_LSTM_keep_prob,
                                         scope="dropout_before_lstm")
+        # per frame inputs of the temporal net, B, F, #features. Feeding this tensor
+        # skips the CNN, the wrapper uses it to run the CNN only once per frame
+        tf.add_to_collection(TEMPORAL_FEATURES, all_features)
         if FLAGS.temporal_net == "TCNN":
             sa=[x.value for x in all_features.get_shape()]
             all_features = tf.reshape(all_features, [sa[0], sa[1], 1, sa[2]])
@@ -1126,104 +1130,129 @@ def loss(logits, net_outputs, batch_size=None):
     
 
 ####################pdf of continous distribution #######################
-# only used in continous_pdf_car_loc_xy
-def pdf_bins(bins, prob, query):
-    # bins has n+1 numbers
-    # probs has n probs that sum to 1
-    # query is some sample point
-    # return the pdf of that point
-
-    # Make sure that bins[0] and bins[-1] are the same for every method
-    # otherwise the comparision won't be fair
-
-    if query < bins[0]:
-        query = bins[0]
-    if query > bins[-1]:
-        query = bins[-1]
-
-    assert(len(bins) == len(prob)+1)
-    for i in range(len(prob)):
-        if bins[i + 1] >= query >= bins[i]:
-            if FLAGS.pdf_normalize_bins:
-                return prob[i] / (bins[i + 1] - bins[i])
-            else:
-                return prob[i]
+# The bins of every binning as arrays, built once per discretize flag configuration: the edges
+# including the outer bounds, the widths and the MAP course/speed of every bin. Densities and MAPs
+# of all frames are then one searchsorted and one gather, for all the binning types.
+BINNING_FLAGS = ('discretize_bin_type', 'discretize_n_bins', 'discretize_max_angle', 'discretize_min_angle',
+                 'discretize_bound_angle', 'discretize_max_speed', 'discretize_min_speed',
+                 'discretize_bound_speed', 'discretize_datadriven_stat_path', 'pdf_normalize_bins')
 
+binning_cache = {}
 
-def pdf_bins_batch(bins, prob, querys):
-    assert (len(bins) == len(prob) + 1)
+def MAP_bins_log(course_bin, speed_bin):
+    c_factor = course_bin[0] / course_bin[1]
+    course_map = np.append(course_bin, course_bin[-1] * c_factor)
+    # 0-6 7 8-14, n=15, n//2=7
+    k = np.arange(len(course_map))
+    half = FLAGS.discretize_n_bins // 2
+    course_map = np.where(k < half, course_map * math.sqrt(c_factor),
+                          np.where(k > half, course_map / math.sqrt(c_factor), 0.0))
 
-    querys = np.array(querys)
-    bins = np.array(bins)
-    idx = np.digitize(querys, bins[1:-1])
+    s_factor = speed_bin[1] / speed_bin[0]
+    speed_map = np.append(speed_bin, speed_bin[-1] * s_factor) / math.sqrt(s_factor)
+    return course_map, speed_map
 
-    # get the mass
-    masses = prob[idx]
+def MAP_bins_linear(course_bin, speed_bin):
+    maps = []
+    for bins in (course_bin, speed_bin):
+        step = bins[1] - bins[0]
+        maps.append(np.append(bins, bins[-1] + step) - step / 2)
+    return maps
 
-    if FLAGS.pdf_normalize_bins:
-        # get the x bin length
-        xlen = bins[idx + 1] - bins[idx]
-        return masses / xlen
-    else:
+def MAP_bins_joint(course_bin, speed_bin):
+    # the center of every bin, with fixed outer bounds
+    appends = [89.9 / 180 * math.pi, 29.99]
+    prepend = [-89.9 / 180 * math.pi, 0.001]
+    maps = []
+    for i, bins in enumerate((course_bin, speed_bin)):
+        bins = np.insert(np.array(list(bins) + [appends[i]]), 0, prepend[i])
+        maps.append((bins[1:] + bins[:-1]) / 2.0)
+    return maps
+
+def MAP_bins_custom(course_bin, speed_bin):
+    course_map, speed_map = MAP_bins_joint(course_bin, speed_bin)
+    small_angle = 0.3/180*math.pi
+    course_map[np.logical_and(-small_angle < course_map, course_map < small_angle)] = 0.0
+    return course_map, speed_map
+
+def MAP_bins_datadriven(course_bin, speed_bin):
+    return MAP_bins_custom(course_bin, speed_bin)
+
+
+class Binning(object):
+    def __init__(self):
+        course_bin, speed_bin = get_bins()
+        # the inner edges as get_bins, and the edges with the outer bounds
+        self.course_bin = np.array(course_bin)
+        self.speed_bin = np.array(speed_bin)
+        self.course_edges = np.concatenate(([-FLAGS.discretize_bound_angle], self.course_bin,
+                                            [FLAGS.discretize_bound_angle]))
+        self.speed_edges = np.concatenate(([0], self.speed_bin, [FLAGS.discretize_bound_speed]))
+        self.course_width = np.diff(self.course_edges)
+        self.speed_width = np.diff(self.speed_edges)
+        self.normalize = FLAGS.pdf_normalize_bins
+        self.course_map, self.speed_map = \
+            globals()["MAP_bins_%s" % FLAGS.discretize_bin_type](course_bin, speed_bin)
+
+    def index(self, querys, course, side):
+        # bin of every query, values outside the edges go to the outer bins. side="left" puts a query
+        # on an edge to the lower bin and side="right" to the upper one
+        bins = self.course_bin if course else self.speed_bin
+        return np.searchsorted(bins, querys, side=side)
+
+    def density(self, prob, idx, course, per_frame):
+        # prob is #frames * #bins. idx is the bin of one query per frame if per_frame, giving #frames
+        # densities, otherwise the bins of #querys for all frames, giving #frames * #querys
+        width = self.course_width if course else self.speed_width
+        if per_frame:
+            masses = prob[np.arange(prob.shape[0]), idx]
+        else:
+            masses = prob[:, idx]
+        if self.normalize:
+            return masses / width[idx]
         return masses
 
+    def density_2D(self, prob, querys, per_frame):
+        # prob is #frames * (#course bins * #speed bins), querys #querys * 2 (one per frame if per_frame)
+        ncourse = len(self.course_width)
+        prob = np.reshape(prob, (prob.shape[0], ncourse, len(self.speed_width)))
+        cidx = self.index(querys[:, 0], True, "right")
+        sidx = self.index(querys[:, 1], False, "right")
+        if per_frame:
+            masses = prob[np.arange(prob.shape[0]), cidx, sidx]
+        else:
+            masses = prob[:, cidx, sidx]
+        if self.normalize:
+            return masses / (self.course_width[cidx] * self.speed_width[sidx])
+        return masses
 
+    def MAP(self, course_idx, speed_idx):
+        return np.stack((self.course_map[course_idx], self.speed_map[speed_idx]), axis=1)
 
-def pdf_bins_batch_2D(cs_bins, prob, querys):
-    # assume the input cs_bins are augmented with the bounds
-    cbin, sbin = cs_bins
-    cbin = np.array(cbin)
-    sbin = np.array(sbin)
-
-    assert(len(cbin) == len(sbin))
-    prob = np.reshape(prob, (len(cbin)-1, len(cbin)-1))
-
-    querys = np.array(querys)
-    cidx = np.digitize(querys[:, 0], cbin[1:-1])
-    sidx = np.digitize(querys[:, 1], sbin[1:-1])
-
-    # get the mass
-    masses = prob[cidx, sidx]
 
-    if FLAGS.pdf_normalize_bins:
-        # get the x bin length
-        xlen = cbin[cidx + 1] - cbin[cidx]
-        ylen = sbin[sidx + 1] - sbin[sidx]
-
-        return masses / (xlen*ylen)
-    else:
-        return masses
+def binning():
+    # the Binning of the current flags
+    key = tuple(getattr(FLAGS, name) for name in BINNING_FLAGS)
+    if key not in binning_cache:
+        binning_cache[key] = Binning()
+    return binning_cache[key]
 
+def split_softmax(logits):
+    n = FLAGS.discretize_n_bins
+    return util_car.softmax(logits[:, 0:n]), util_car.softmax(logits[:, n:])
 
 # this is called from continous_pdf function
 def continous_pdf_car_loc_xy(logits, labels):
     # the first entry is the predicted logits
     # first part is course and second part is speed
-    logits = logits[0]
-    n = FLAGS.discretize_n_bins
-    course = logits[:, 0:n]
-    speed  = logits[:, n: ]
-    # do the softmax
-    course = util_car.softmax(course)
-    speed  = util_car.softmax(speed)
-
-    # get the bins
-    course_bin, speed_bin = get_bins()
-    course_bin = [-FLAGS.discretize_bound_angle] + course_bin + \
-                 [FLAGS.discretize_bound_angle]
-    course_bin = np.array(course_bin)
-    speed_bin  = [0] + speed_bin + [FLAGS.discretize_bound_speed]
-    speed_bin = np.array(speed_bin)
+    course, speed = split_softmax(logits[0])
+    b = binning()
 
     # the labels also only has one entry
     labels = labels[0]
-    course_label = labels[:, 0]
-    speed_label  = labels[:, 1]
-    out = np.zeros((labels.shape[0],2), dtype=np.float32)
-
-    for i in range(labels.shape[0]):
-        out[i, 0] = pdf_bins(course_bin, course[i,:], course_label[i])
-        out[i, 1] = pdf_bins(speed_bin, speed[i, :], speed_label[i])
+    out = np.zeros((labels.shape[0], 2), dtype=np.float32)
+    out[:, 0] = b.density(course, b.index(labels[:, 0], True, "left"), True, per_frame=True)
+    out[:, 1] = b.density(speed, b.index(labels[:, 1], False, "left"), False, per_frame=True)
 
     out = np.log(out + FLAGS.discretize_min_prob)
 
@@ -1231,77 +1260,33 @@ def continous_pdf_car_loc_xy(logits, labels):
     return out
 
 def continous_pdf_car_joint(logits, labels):
-    logits = logits[0]
-    softmaxed = util_car.softmax(logits)
-
-    # get the bins
-    course_bin, speed_bin = get_bins()
-    course_bin = [-FLAGS.discretize_bound_angle] + course_bin + \
-                 [FLAGS.discretize_bound_angle]
-    speed_bin = [0] + speed_bin + [FLAGS.discretize_bound_speed]
-
-    out = []
-    labels = labels[0]
-    for i in range(labels.shape[0]):
-        this = pdf_bins_batch_2D([course_bin, speed_bin], softmaxed[i, :], labels[i:(i+1),:])
-        out.append(this)
-    out = np.array(out)
-    out = np.log(out + FLAGS.discretize_min_prob)
+    softmaxed = util_car.softmax(logits[0])
+    out = binning().density_2D(softmaxed, np.asarray(labels[0]), per_frame=True)
+    out = np.log(out[:, np.newaxis] + FLAGS.discretize_min_prob)
 
     # return the log prob, Note that this output is not compatible any more
     return out
 
 
-# used in the wrapper and draw_sector
-def multi_querys_car_loc_xy_impl(logits, querys):
-    # the first entry is the predicted logits
-    # first part is course and second part is speed
-    logits = logits[0]
-    n = FLAGS.discretize_n_bins
-    course = logits[:, 0:n]
-    speed = logits[:, n:]
-    # do the softmax
-    course = util_car.softmax(course)
-    speed = util_car.softmax(speed)
-
-    # get the bins
-    course_bin, speed_bin = get_bins()
-    course_bin = [-FLAGS.discretize_bound_angle] + course_bin + \
-                 [FLAGS.discretize_bound_angle]
-    speed_bin = [0] + speed_bin + [FLAGS.discretize_bound_speed]
-
-    # the labels also only has one entry
-    course_querys = copy.deepcopy(querys[0])
-    speed_querys = copy.deepcopy(querys[1])
-
-    course_querys = pdf_bins_batch(course_bin, course[0, :], course_querys)
-    speed_querys = pdf_bins_batch(speed_bin, speed[0, :], speed_querys)
-
-    # return the log prob of each speed and course
-    return [course_querys, speed_querys]
+# density of every frame at every query, #frames * #querys
+def multi_querys_batch_car_loc_xy(logits, querys):
+    course, speed = split_softmax(logits[0])
+    b = binning()
+    querys = np.asarray(querys)
+    course_pdf = b.density(course, b.index(querys[:, 0], True, "right"), True, per_frame=False)
+    speed_pdf = b.density(speed, b.index(querys[:, 1], False, "right"), False, per_frame=False)
+    return course_pdf * speed_pdf
 
+def multi_querys_batch_car_joint(logits, querys):
+    softmaxed = util_car.softmax(logits[0])
+    return binning().density_2D(softmaxed, np.asarray(querys), per_frame=False)
 
+# used in the wrapper and draw_sector, density of the first frame at a list of (c, s) querys
 def multi_querys_car_loc_xy(logits, querys):
-    querys = np.array(querys)
-    course_querys, speed_querys = \
-        multi_querys_car_loc_xy_impl(logits, [querys[:, 0], querys[:, 1]])
-    return course_querys * speed_querys
-
+    return multi_querys_batch_car_loc_xy([logits[0][0:1]], querys)[0]
 
-# change the definition of this function to input a list of (c, s) pairs
 def multi_querys_car_joint(logits, querys):
-    logits = logits[0]
-    softmaxed = util_car.softmax(logits)
-
-    # get the bins
-    course_bin, speed_bin = get_bins()
-    course_bin = [-FLAGS.discretize_bound_angle] + course_bin + \
-                 [FLAGS.discretize_bound_angle]
-    speed_bin = [0] + speed_bin + [FLAGS.discretize_bound_speed]
-
-    out = pdf_bins_batch_2D([course_bin, speed_bin], softmaxed[0, :], querys)
-
-    return out
+    return multi_querys_batch_car_joint([logits[0][0:1]], querys)[0]
 
 
 def continous_pdf(logits, labels, prefix="continous_pdf"):
@@ -1314,106 +1299,20 @@ def continous_pdf(logits, labels, prefix="continous_pdf"):
 
 
 ########## MAP of continous distribution #################
-def continous_MAP_car_loc_xy_log(logits):
+def continous_MAP_car_loc_xy(logits):
     logits = logits[0]
     n = FLAGS.discretize_n_bins
-    course = logits[:, 0:n]
-    speed  = logits[:, n: ]
-
-    # return the interpolated values, course and speed could be distribution
-    course_bin, speed_bin = get_bins()
-
-    c_factor = course_bin[0] / course_bin[1]
-    course_bin = np.array(course_bin)
-    course_bin = np.append(course_bin, course_bin[-1] * c_factor)
-
-    s_factor = speed_bin[1] / speed_bin[0]
-    speed_bin = np.array(speed_bin)
-    speed_bin = np.append(speed_bin, speed_bin[-1] * s_factor)
-
-    course = np.argmax(course, axis=1)
-    course_inter = course_bin[course]
-    for i in range(len(course)):
-        # 0-6 7 8-14, n=15, n//2=7
-        if course[i] < FLAGS.discretize_n_bins // 2:
-            course_inter[i] *= math.sqrt(c_factor)
-        elif course[i] > FLAGS.discretize_n_bins // 2:
-            course_inter[i] /= math.sqrt(c_factor)
-        else:
-            course_inter[i] = 0
-
-    speed = np.argmax(speed, axis=1)
-    speed_inter = speed_bin[speed] / math.sqrt(s_factor)
-
-    return np.stack((course_inter, speed_inter), axis=1)
-
-def continous_MAP_car_loc_xy_linear(logits):
-    logits = logits[0]
-    n = FLAGS.discretize_n_bins
-    predicts = [logits[:, 0:n], logits[:, n: ]]
-
-    # return the interpolated values, course and speed could be distribution
-    cs_bins = get_bins()
-
-    inters=[]
-    # for in range and speed
-    for i in range(2):
-        bins = cs_bins[i]
-        step = bins[1] - bins[0]
-        bins.append(bins[-1]+step)
-        bins = np.array(bins)
+    return binning().MAP(np.argmax(logits[:, 0:n], axis=1), np.argmax(logits[:, n:], axis=1))
 
-        predicted = np.argmax(predicts[i], axis=1)
-        inter = bins[predicted] - step/2
-        inters.append(inter)
-    return np.stack(inters, axis=1)
-
-def MAP_custom_bin_helper(predicted_cs_argmax):
-    # return the interpolated values, course and speed could be distribution
-    cs_bins = get_bins()
-
-    inters = []
-    # for in range and speed
-    appends = [89.9 / 180 * math.pi, 29.99]
-    prepend = [-89.9 / 180 * math.pi, 0.001]
-    for i in range(2):
-        predicted = predicted_cs_argmax[i]
-
-        bins = cs_bins[i]
-        bins.append(appends[i])
-        bins = np.array(bins)
-
-        bins = np.insert(bins, 0, prepend[i])
-        inter = (bins[predicted + 1] + bins[predicted]) / 2.0
-        inters.append(inter)
-    return inters
-
-def continous_MAP_car_loc_xy_custom(logits):
-    logits = logits[0]
-    n = FLAGS.discretize_n_bins
-    predicts = [logits[:, 0:n], logits[:, n: ]]
-
-    predicted_cs_argmax = [np.argmax(predicts[0], axis=1), np.argmax(predicts[1], axis=1)]
-    inters = MAP_custom_bin_helper(predicted_cs_argmax)
-
-    small_angle = 0.3/180*math.pi
-    inters[0][-small_angle < inters[0] < small_angle] = 0.0
-
-    return np.stack(inters, axis=1) # will return a #samples * 2 array
-
-def continous_MAP_car_loc_xy_datadriven(logits):
-    return continous_MAP_car_loc_xy_custom(logits)
+continous_MAP_car_loc_xy_log = continous_MAP_car_loc_xy
+continous_MAP_car_loc_xy_linear = continous_MAP_car_loc_xy
+continous_MAP_car_loc_xy_custom = continous_MAP_car_loc_xy
+continous_MAP_car_loc_xy_datadriven = continous_MAP_car_loc_xy
 
 def continous_MAP_car_joint_joint(logits):
-    logits = logits[0]
     n = int(FLAGS.discretize_n_bins)
-
-    argm = np.argmax(logits, axis=1)
-    predicted_cs_argmax = [(argm / n).astype(int), (argm % n).astype(int)]
-    inters = MAP_custom_bin_helper(predicted_cs_argmax)
-
-    return np.stack(inters, axis=1)  # will return a #samples * 2 array
-
+    argm = np.argmax(logits[0], axis=1)
+    return binning().MAP(argm // n, argm % n)
 
 # We should pick the largest density!!!
 # all of our implementation here is largest bin
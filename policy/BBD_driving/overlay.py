@@ -0,0 +1,124 @@
+'''
+Overlay compositor for the continuous action visualizations of util_car.
+
+The prediction is drawn as a half disk at the bottom center of the frame: the direction of a pixel
+from the center is a course, its distance a speed. Everything that only depends on the image size and
+the radius is computed once per (height, width, radius) and cached: the pixels inside the half disk,
+their course and distance, the course bin or interpolation weights of every pixel, and the border and
+tick marks. A frame is then blended with one gather of its probabilities per pixel, for all the frames
+of a clip at once, without matplotlib.
+
+Courses are in radians, 0 is straight ahead and positive to the right, as the course labels.
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+
+import cv2
+import numpy as np
+
+overlay_cache = {}
+
+
+def sector_overlay(height, width, radius):
+    # the SectorOverlay of an image size and radius, built once
+    key = (height, width, radius)
+    if key not in overlay_cache:
+        overlay_cache[key] = SectorOverlay(height, width, radius)
+    return overlay_cache[key]
+
+
+class SectorOverlay(object):
+    def __init__(self, height, width, radius):
+        self.height = height
+        self.width = width
+        self.radius = radius
+        self.center = (width // 2, height)
+
+        cx, cy = self.center
+        ys, xs = np.mgrid[max(cy - radius, 0):cy, max(cx - radius, 0):min(cx + radius, width)]
+        vx = xs - cx
+        vy = cy - ys
+        dist = np.sqrt(vx ** 2 + vy ** 2)
+        inside = dist < radius
+        # the pixels of the half disk, with their distance to the center and course
+        self.rows = ys[inside]
+        self.cols = xs[inside]
+        self.dist = dist[inside]
+        self.course = np.arctan2(vx[inside], vy[inside])
+        self.luts = {}
+
+    def lut(self, key, build):
+        if key not in self.luts:
+            self.luts[key] = build()
+        return self.luts[key]
+
+    def bin_index(self, edges):
+        # the course bin of every pixel, for increasing bin edges
+        edges = np.asarray(edges, dtype=np.float64)
+        return self.lut(('bins', edges.tobytes()),
+                        lambda: np.clip(np.searchsorted(edges, self.course, side='right') - 1, 0, len(edges) - 2))
+
+    def interp_weights(self, centers):
+        # np.interp(course, centers, values) of every pixel as (lower index, weight of the upper one)
+        centers = np.asarray(centers, dtype=np.float64)
+
+        def build():
+            course = np.clip(self.course, centers[0], centers[-1])
+            idx = np.clip(np.searchsorted(centers, course, side='right') - 1, 0, len(centers) - 2)
+            frac = (course - centers[idx]) / (centers[idx + 1] - centers[idx])
+            return idx, frac
+        return self.lut(('interp', centers.tobytes()), build)
+
+    def binned(self, values, edges):
+        # values is #frames * #bins, gives #frames * #pixels
+        return values[:, self.bin_index(edges)]
+
+    def interpolated(self, values, centers):
+        idx, frac = self.interp_weights(centers)
+        return values[:, idx] * (1 - frac) + values[:, idx + 1] * frac
+
+    def course_speed(self, speed_per_pixel):
+        # (course, speed) of every pixel, #pixels * 2, speed_per_pixel is the speed of a pixel of distance
+        return self.lut(('querys', speed_per_pixel),
+                        lambda: np.stack((self.course, self.dist * speed_per_pixel), axis=1))
+
+    def decoration(self, tick_courses=(), tick_len=20, border=2):
+        # mask of the white border arc and of the ticks at tick_courses
+        tick_courses = np.asarray(tick_courses, dtype=np.float64)
+
+        def build():
+            mask = np.zeros((self.height, self.width), dtype=np.uint8)
+            outer = self.radius + border
+            cv2.ellipse(mask, self.center, (outer, outer), 0, 180, 360, 255, border)
+            for course in tick_courses:
+                cv2.line(mask, self.point(course, outer - tick_len), self.point(course, outer), 255, 1)
+            return mask > 0
+        return self.lut(('decoration', tick_courses.tobytes(), tick_len, border), build)
+
+    def point(self, course, length):
+        # pixel at length from the center in the direction course
+        cx, cy = self.center
+        return (int(round(cx + length * math.sin(course))), int(round(cy - length * math.cos(course))))
+
+    def composite(self, images, green, alpha, decoration=None):
+        '''
+        Blends the half disk into copies of images (#frames * H * W * 3 uint8): every pixel becomes
+        image * (1 - alpha) + (0, green, 0), green and alpha are scalars or #frames * #pixels.
+        '''
+        out = np.array(images, dtype=np.uint8)
+        pixels = out[:, self.rows, self.cols, :].astype(np.float32)
+        alpha = np.asarray(alpha, dtype=np.float32)
+        pixels *= 1 - (alpha[..., np.newaxis] if alpha.ndim else alpha)
+        pixels[:, :, 1] += green
+        out[:, self.rows, self.cols, :] = np.clip(pixels, 0, 255)
+        if decoration is not None:
+            out[:, decoration] = 255
+        return out
+
+    def arrow(self, image, course, length, color, thickness=2):
+        cv2.arrowedLine(image, self.point(0, 2), self.point(course, length), color, thickness,
+                        cv2.LINE_AA, tipLength=0.1)
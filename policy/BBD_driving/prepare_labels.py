@@ -0,0 +1,87 @@
+'''
+Offline pass that writes a label store (see data_providers/label_store.py): the stop, turn and future
+course/speed labels of every TFRecord of a subset, for every temporal downsample start, computed once
+for the current label flags. Training and evaluation with --label_store=<root> then look them up
+instead of computing them every epoch. Run it once per subset, and again for every label configuration
+of a sweep, stores of other subsets and earlier configurations are kept.
+
+    python prepare_labels.py --data_dir=$DATA_ROOT/tfrecords --subset=train --label_store=$DATA_ROOT/labels
+    python prepare_labels.py --data_dir=$DATA_ROOT/tfrecords --subset=validation --label_store=$DATA_ROOT/labels
+    python prepare_labels.py --model_config=discrete_tcnn1 --subset=train --label_store=$DATA_ROOT/labels
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import importlib
+import multiprocessing
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.example import example_pb2
+
+from data_providers.nexar_large_speed import MyDataset
+from data_providers.label_store import write_label_store, store_path
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('subset', 'train', 'train, validation or test')
+tf.app.flags.DEFINE_string('model_config', '', 'optionally a config function in config.py that sets the flags')
+tf.app.flags.DEFINE_integer('label_workers', 4, 'processes parsing the TFRecords')
+
+
+def labels_of_file(path):
+    # (video name, labels) of every record in the file, labels is None for records too short
+    out = []
+    for serialized in tf.python_io.tf_record_iterator(path):
+        example = example_pb2.Example.FromString(serialized)
+        feature = example.features.feature
+        name = feature['image/class/video_name'].bytes_list.value[0]
+        speeds = feature['image/speeds'].float_list.value
+        out.append((name, MyDataset.labels_of_record(speeds)))
+    return out
+
+
+def main(argv=None):
+    if FLAGS.model_config != "":
+        config = importlib.import_module("config")
+        subset = FLAGS.subset
+        config.common_config("train")
+        getattr(config, FLAGS.model_config)("train")
+        FLAGS.subset = subset
+    if FLAGS.label_store == "":
+        raise ValueError("set --label_store to the root of the label stores")
+
+    label_config = MyDataset.label_config()
+    print("label config", label_config)
+    print("writing", store_path(FLAGS.label_store, label_config, FLAGS.subset))
+    data_files = MyDataset(FLAGS.subset).data_files()
+
+    names = []
+    arrays = {"stop": [], "turn": [], "locs": []}
+    skipped = 0
+    start = time.time()
+    pool = multiprocessing.Pool(FLAGS.label_workers)
+    for i, records in enumerate(pool.imap(labels_of_file, data_files, chunksize=4)):
+        for name, labels in records:
+            if labels is None:
+                skipped += 1
+                continue
+            stop_label, turn, locs = labels
+            names.append(name)
+            arrays["stop"].append(stop_label.astype(np.int8))
+            arrays["turn"].append(turn)
+            arrays["locs"].append(locs)
+        if (i + 1) % 1000 == 0:
+            print("%d/%d files, %.1f files/s" % (i + 1, len(data_files), (i + 1) / (time.time() - start)))
+    pool.close()
+    pool.join()
+
+    path = write_label_store(FLAGS.label_store, label_config, FLAGS.subset, names, arrays)
+    print("%d records in %s, %d too short skipped, %.0f s" % (len(names), path, skipped, time.time() - start))
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -10,12 +10,14 @@ import os, pickle
 import re
 import time
 import importlib
+import multiprocessing
 import sys
 
 import numpy as np
 import tensorflow as tf
 
 import batching
+import cpu_parallel
 import tensorflow.contrib.slim as slim
 from tensorflow.python.framework import ops
 from tensorflow.python.client import timeline
@@ -38,6 +40,14 @@ tf.app.flags.DEFINE_integer('num_gpus', 1,#使用多少GPU训练
                            """How many gpus to use on the system"""
                            """Should be used with CUDA_VISIBLE_DEVICES""")
 
+tf.app.flags.DEFINE_integer('cpu_workers', 0,
+                            """When > 0, train data parallel on the CPU with this """
+                            """many processes, each reading its own shard of the """
+                            """data files. batch_size is split among them.""")
+tf.app.flags.DEFINE_integer('cpu_threads_per_worker', 0,
+                            """Op threads of every cpu worker, 0 to share the """
+                            """cores of the machine among the workers.""")
+
 tf.app.flags.DEFINE_boolean('background_class', True,#图像分割背景类是否训练
                             """Whether to reserve 0 as background.""")
 tf.app.flags.DEFINE_boolean('log_device_placement', False,
@@ -230,13 +240,51 @@ def _tensor_list_splits(tensor_list, nsplit):
             out[i].append(split_item)
     return out
 
-def train():
+def _all_reduce_step(sess, reducer, local_grads, grads, compute_op, apply_op):
+    # runs a training step of a cpu worker: computes the gradients of its own batch, averages them
+    # with the other workers and applies the average. Returns the values of fetches, which are
+    # evaluated with the gradients.
+    local_tensors = [g for g, _ in local_grads]
+    placeholders = [g for g, _ in grads]
+
+    def run(fetches, **kwargs):
+        out = sess.run([compute_op, local_tensors] + fetches, **kwargs)
+        mean = reducer.all_reduce(out[1])
+        sess.run(apply_op, feed_dict=dict(zip(placeholders, mean)))
+        return out[2:]
+    return run
+
+
+def _sync_variables(sess, reducer, variables, assign_op, assign_feeds):
+    # copies the variables of worker 0 to the other cpu workers
+    values = reducer.broadcast(sess.run(variables))
+    if reducer.rank != 0:
+        sess.run(assign_op, feed_dict=dict(zip(assign_feeds, values)))
+
+
+def train(reducer=None):
+  """Train on dataset for a number of steps.
+
+  With a reducer this is one of FLAGS.cpu_workers data parallel workers, see
+  cpu_parallel.py. Only worker 0 writes summaries and checkpoints.
+  """
   dataset = dataset_module.MyDataset(subset=FLAGS.subset)
   #assert dataset.data_files()
 
-  """Train on dataset for a number of steps."""
+  if reducer is not None:
+    assert FLAGS.EWC != "stat", "EWC stat is not supported with cpu_workers"
+    rank = reducer.rank
+    num_splits = FLAGS.cpu_workers
+    tower_devices = ['/cpu:0']
+  else:
+    rank = 0
+    num_splits = FLAGS.num_gpus
+    tower_devices = ['/gpu:%d' % i for i in xrange(FLAGS.num_gpus)]
+  num_towers = len(tower_devices)
+  is_chief = rank == 0
+
   # use gpu:0 instead of cpu0, to avoid RNN GPU variable uninitialized problem
-  with tf.Graph().as_default(), tf.device('/gpu:0'):
+  with tf.Graph().as_default(), tf.device(tower_devices[0]):
     # Create a variable to count the number of train() calls. This equals the
     # number of batches processed * FLAGS.num_gpus.
     global_step = tf.get_variable(
@@ -273,9 +321,9 @@ def train():
       return
 
     # Get images and labels for ImageNet and split the batch across GPUs.
-    assert FLAGS.batch_size % FLAGS.num_gpus == 0, (
-        'Batch size must be divisible by number of GPUs')
-    split_batch_size = int(FLAGS.batch_size / FLAGS.num_gpus)
+    assert FLAGS.batch_size % num_splits == 0, (
+        'Batch size must be divisible by number of GPUs or cpu workers')
+    split_batch_size = int(FLAGS.batch_size / num_splits)
 
     # Override the number of preprocessing threads to account for the increased
     # number of GPU towers.
@@ -283,9 +331,17 @@ def train():
     # choose not to overide, to have a finer control of how many threads to use
     num_preprocess_threads = FLAGS.num_preprocess_threads
 
-    net_inputs, net_outputs = batching.distorted_inputs(
-        dataset,
-        num_preprocess_threads=num_preprocess_threads)
+    if reducer is not None:
+      # every cpu worker reads its own batch from its own files
+      net_inputs, net_outputs = batching.distorted_inputs(
+          dataset,
+          batch_size=split_batch_size,
+          num_preprocess_threads=num_preprocess_threads,
+          shard=(rank, FLAGS.cpu_workers))
+    else:
+      net_inputs, net_outputs = batching.distorted_inputs(
+          dataset,
+          num_preprocess_threads=num_preprocess_threads)
 
     input_summaries = copy.copy(tf.get_collection(tf.GraphKeys.SUMMARIES))
 
@@ -300,13 +356,13 @@ def train():
     
      # Split the batch of images and labels for towers.
     # TODO: this might become invalid if we are doing detection
-    input_splits = _tensor_list_splits(net_inputs, FLAGS.num_gpus)
-    output_splits = _tensor_list_splits(net_outputs, FLAGS.num_gpus)
+    input_splits = _tensor_list_splits(net_inputs, num_towers)
+    output_splits = _tensor_list_splits(net_outputs, num_towers)
 
     # Calculate the gradients for each model tower.
     tower_grads = []
-    for i in xrange(FLAGS.num_gpus):
-      with tf.device('/gpu:%s' % i):
+    for i in xrange(num_towers):
+      with tf.device(tower_devices[i]):
         with tf.name_scope('%s_%d' % (model.TOWER_NAME, i)) as scope:
           if True:
           # I don't see any improvements by pinning all variables on CPU, so I disabled this
@@ -377,6 +433,17 @@ def train():
             out[v.op.name] = g2
             vard[v.op.name] = v
         grads2 = out
+    elif reducer is not None:
+        # the gradients of this worker are averaged with the other workers outside of the graph,
+        # and the averages are fed back in to be applied
+        local_grads = []
+        for g, v in tower_grads[0]:
+            if g is None:
+                print("None gradient for %s" % v.op.name)
+            else:
+                local_grads.append((tf.convert_to_tensor(g), v))
+        grads = [(tf.placeholder(tf.float32, v.get_shape(), name=v.op.name + "_averaged_gradient"), v)
+                 for g, v in local_grads]
     else:
         grads = _average_gradients(tower_grads)
 
@@ -387,7 +454,7 @@ def train():
     summaries.append(tf.scalar_summary('learning_rate', lr))
 
     # Add histograms for gradients.
-    for grad, var in grads:
+    for grad, var in (grads if reducer is None else local_grads):
       if grad is not None:
         summaries.append(
             tf.histogram_summary(var.op.name + '/gradients', grad))
@@ -437,8 +504,13 @@ def train():
 
     # Group all updates to into a single train op.
     batchnorm_updates_op = tf.group(*batchnorm_updates)
-    train_op = tf.group(apply_gradient_op, variables_averages_op,
-                        batchnorm_updates_op)
+    if reducer is not None:
+        # the batch norm statistics are updated with the gradient computation, the average
+        # gradients are applied in a second run that does not read the input
+        train_op = tf.group(apply_gradient_op, variables_averages_op)
+    else:
+        train_op = tf.group(apply_gradient_op, variables_averages_op,
+                            batchnorm_updates_op)
 
     # Create a saver.
     saver = tf.train.Saver(tf.all_variables())
@@ -464,11 +536,22 @@ def train():
     # Start running operations on the Graph. allow_soft_placement must be set to
     # True to build towers on GPU, as some of the ops do not have GPU
     # implementations.
-    config = tf.ConfigProto(
-                allow_soft_placement=True,
-                log_device_placement=FLAGS.log_device_placement,
-                intra_op_parallelism_threads=1)
-    config.gpu_options.allow_growth = True
+    if reducer is not None:
+        threads = FLAGS.cpu_threads_per_worker
+        if threads <= 0:
+            threads = max(1, multiprocessing.cpu_count() // FLAGS.cpu_workers)
+        config = tf.ConfigProto(
+                    allow_soft_placement=True,
+                    log_device_placement=FLAGS.log_device_placement,
+                    device_count={'GPU': 0},
+                    intra_op_parallelism_threads=threads,
+                    inter_op_parallelism_threads=threads)
+    else:
+        config = tf.ConfigProto(
+                    allow_soft_placement=True,
+                    log_device_placement=FLAGS.log_device_placement,
+                    intra_op_parallelism_threads=1)
+        config.gpu_options.allow_growth = True
 
     sess = tf.Session(config=config)
     sess.run(init)
@@ -501,13 +584,26 @@ def train():
       print('%s: Pre-trained model restored from %s' %
             (datetime.now(), FLAGS.pretrained_model_checkpoint_path))
 
+    if reducer is not None:
+        # all the workers start from the (random or restored) variables of worker 0
+        sync_variables = tf.all_variables()
+        sync_feeds = [tf.placeholder(v.dtype.base_dtype, v.get_shape()) for v in sync_variables]
+        sync_op = tf.group(*[tf.assign(v, f) for v, f in zip(sync_variables, sync_feeds)])
+        _sync_variables(sess, reducer, sync_variables, sync_op, sync_feeds)
+        run_train = _all_reduce_step(sess, reducer, local_grads, grads,
+                                     batchnorm_updates_op, train_op)
+    else:
+        def run_train(fetches, **kwargs):
+            return sess.run([train_op] + fetches, **kwargs)[1:]
+
     # Start the queue runners.
     tf.train.start_queue_runners(sess=sess)
     
 
-    summary_writer = tf.train.SummaryWriter(
-        FLAGS.train_dir,
-        graph_def=sess.graph.as_graph_def(add_shapes=True))
+    if is_chief:
+        summary_writer = tf.train.SummaryWriter(
+            FLAGS.train_dir,
+            graph_def=sess.graph.as_graph_def(add_shapes=True))
 
     start_time = time.time()
     duration_compute=0
@@ -562,24 +658,25 @@ def train():
               run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
               run_metadata = tf.RunMetadata()
               start_time_compute = time.time()
-              _, loss_value = sess.run([train_op, loss], options=run_options, run_metadata=run_metadata)
+              loss_value, = run_train([loss], options=run_options, run_metadata=run_metadata)
               duration_compute = duration_compute + time.time() - start_time_compute
 
               # Create the Timeline object, and write it to a json
-              tl = timeline.Timeline(run_metadata.step_stats)
-              ctf = tl.generate_chrome_trace_format()
-              with open(os.path.join(FLAGS.train_dir, 'timeline.json'), 'w') as f:
-                  f.write(ctf)
-              print("generated a time line profile for one session")
+              if is_chief:
+                  tl = timeline.Timeline(run_metadata.step_stats)
+                  ctf = tl.generate_chrome_trace_format()
+                  with open(os.path.join(FLAGS.train_dir, 'timeline.json'), 'w') as f:
+                      f.write(ctf)
+                  print("generated a time line profile for one session")
           else:
               start_time_compute = time.time()
-              if (step + 1) % (FLAGS.display_summary * 10) == 0:
+              if (step + 1) % (FLAGS.display_summary * 10) == 0 and is_chief:
                   has_run_meta = True
                   # profile in a longer interval
                   run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
                   run_metadata = tf.RunMetadata()
-                  _, loss_value, summary_str = \
-                                        sess.run([train_op, loss, summary_op],
+                  loss_value, summary_str = \
+                                        run_train([loss, summary_op],
                                         options=run_options,
                                         run_metadata=run_metadata)
                   summary_writer.add_run_metadata(run_metadata, 'step%d' % step)
@@ -593,12 +690,12 @@ def train():
                       f.write(ctf)
                   print("generated a time line profile for one session")
               else:
-                  _, loss_value = sess.run([train_op, loss])
+                  loss_value, = run_train([loss])
               duration_compute = duration_compute + time.time() - start_time_compute
 
           assert not np.isnan(loss_value), 'Model diverged with loss = NaN'
 
-          if (step+1) % FLAGS.display_loss == 0:
+          if (step+1) % FLAGS.display_loss == 0 and is_chief:
             duration = (time.time() - start_time) / FLAGS.display_loss
             duration_compute = duration_compute / FLAGS.display_loss
 
@@ -611,19 +708,24 @@ def train():
             duration_compute=0
             start_time = time.time()
 
-          if (step+1) % FLAGS.display_summary == 0 and not has_run_meta:
+          if (step+1) % FLAGS.display_summary == 0 and not has_run_meta and is_chief:
             summary_str = sess.run(summary_op)
             summary_writer.add_summary(summary_str, step)
 
           # Save the model checkpoint periodically.
           if step % FLAGS.checkpoint_interval == 0 or (step + 1) == FLAGS.max_steps:
-            checkpoint_path = os.path.join(FLAGS.train_dir, 'model.ckpt')
-            saver.save(sess, checkpoint_path, global_step=global_step)
+            if reducer is not None:
+              # the workers checkpoint together, resynchronized on the variables that are saved
+              _sync_variables(sess, reducer, sync_variables, sync_op, sync_feeds)
+            if is_chief:
+              checkpoint_path = os.path.join(FLAGS.train_dir, 'model.ckpt')
+              saver.save(sess, checkpoint_path, global_step=global_step)
 
     except KeyboardInterrupt:
-        print("Control C pressed. Saving model before exit. ")
-        checkpoint_path = os.path.join(FLAGS.train_dir, 'model.ckpt')
-        saver.save(sess, checkpoint_path, global_step=global_step)
+        if is_chief:
+          print("Control C pressed. Saving model before exit. ")
+          checkpoint_path = os.path.join(FLAGS.train_dir, 'model.ckpt')
+          saver.save(sess, checkpoint_path, global_step=global_step)
         sys.exit()
 
 def main(_):
@@ -650,7 +752,11 @@ def main(_):
         print("resume training from saved model: % s" % ckpt)
   else:
     tf.gfile.MakeDirs(FLAGS.train_dir)
-  train()
+
+  if FLAGS.cpu_workers > 0:
+    cpu_parallel.run_workers(train, FLAGS.cpu_workers)
+  else:
+    train()
 
 if __name__ == '__main__':
   tf.app.run()
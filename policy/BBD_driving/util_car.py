@@ -1,4 +1,3 @@
-from subprocess import call
 import os, time
 import shutil
 import io
@@ -23,27 +22,35 @@ import pylab
 from matplotlib.patches import Wedge
 from scipy.ndimage.filters import gaussian_filter
 from mpl_toolkits.axes_grid1.anchored_artists import AnchoredDrawingArea
-from matplotlib.patches import FancyArrowPatch
+import glob
+from video_sink import VideoSink, make_dirs, video_path, MIME_TYPES
+from overlay import sector_overlay
 
-def images2video_highqual(frame_rate,
-                 name="temp_name", dir_name="temp_dir"):
+def highqual_sink(frame_rate, name="temp_name", dir_name="temp_dir"):
+    # the VideoSink of the rendered visualizations
+    return VideoSink(os.path.join(dir_name, name + '.mp4'), frame_rate, crf=5, preset='veryslow')
 
-    # make dir if not exists
-    if not os.path.isdir(dir_name):
-        os.mkdir(dir_name)
-    pwd = os.getcwd()
-    os.chdir(dir_name)
+def render_figure(fig, **kwargs):
+    # the png fig.savefig(path, **kwargs) would write, rendered in memory
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', **kwargs)
+    return buf.getvalue()
 
-    print("converting to video")
-    video_name = name+'.mp4'
-    cmd = "ffmpeg -y -f image2 -r " + str(frame_rate) + " -pattern_type glob -i '*.png' -crf 5 -preset veryslow " + \
-          "-threads 16 -vcodec libx264  -pix_fmt yuv420p " + video_name
-    call(cmd, shell=True)
+def png_to_rgb(png):
+    return np.asarray(Image.open(io.BytesIO(png)).convert('RGB'))
 
-    call("rm *.png", shell=True)
-    os.chdir(pwd)
+def images2video_highqual(frame_rate,
+                 name="temp_name", dir_name="temp_dir"):
+    # encodes the png files in dir_name, in name order, and deletes them
+    print("converting to video")
+    paths = sorted(glob.glob(os.path.join(dir_name, '*.png')))
+    with highqual_sink(frame_rate, name, dir_name) as sink:
+        for path in paths:
+            sink.write(np.asarray(Image.open(path).convert('RGB')))
+    for path in paths:
+        os.remove(path)
 
-    return os.path.join(dir_name, video_name)
+    return sink.path
 
 def images2video(images, frame_rate,
                  name="temp_name", dir_name="temp_dir", highquality=True):
@@ -52,37 +59,23 @@ def images2video(images, frame_rate,
     assert (len(shape) == 4)
     assert (shape[3] == 3 or shape[3] == 1)
 
-    # make dir if not exists
-    if not os.path.isdir(dir_name):
-        os.mkdir(dir_name)
-    pwd = os.getcwd()
-    os.chdir(dir_name)
-
-    # write out images
-    print("writing images")
-    for i in range(shape[0]):
-        j = Image.fromarray(images[i, :, :, :])
-        j.save("%05d.jpeg" % i, "jpeg", quality=93)
-
+    # the frames are streamed to the encoder, no images are written
     print("converting to video")
-    video_name = name+'.mp4'
-
-    quality_str = '16' if highquality else '28'
-    cmd = "ffmpeg -y -f image2 -r " + str(frame_rate) + " -pattern_type glob -i '*.jpeg' -crf "+quality_str+" -preset veryfast " + \
-          "-threads 16 -vcodec libx264  -pix_fmt yuv420p " + video_name
-    call(cmd, shell=True)
+    quality = 16 if highquality else 28
+    with VideoSink(os.path.join(dir_name, name + '.mp4'), frame_rate, crf=quality, preset='veryfast') as sink:
+        for i in range(shape[0]):
+            sink.write(images[i, :, :, :])
 
-    call("rm *.jpeg", shell=True)
-    os.chdir(pwd)
-
-    return os.path.join(dir_name, video_name)
+    return sink.path
 
 def play_video(path):
     video = io.open(path, 'r+b').read()
     encoded = base64.b64encode(video)
+    # the MJPEG .avi written without ffmpeg plays in few browsers
+    mime = MIME_TYPES.get(os.path.splitext(path)[1].lower(), 'video/mp4')
     return HTML(data='''<video alt="test" controls>
-                    <source src="data:video/mp4;base64,{0}" type="video/mp4" />
-                 </video>'''.format(encoded.decode('ascii')))
+                    <source src="data:{1};base64,{0}" type="{1}" />
+                 </video>'''.format(encoded.decode('ascii'), mime))
 
 def visualize_images(images, frame_rate,
                      name="temp_name", dir_name="temp_dir",delete_temp=True):
@@ -321,7 +314,7 @@ def vis_discrete(tout, predict, frame_rate,
         short_name = short_name.split(".")[0]
         for i in range(10):
             this_name = short_name + "_" + str(i)
-            if not os.path.isfile(os.path.join(dir_name,this_name+'.mp4')):
+            if not os.path.isfile(video_path(os.path.join(dir_name, this_name + '.mp4'))):
                 break
 
         return visualize_images(images, frame_rate,
@@ -383,7 +376,7 @@ def vis_discrete_simplified(tout, predict, frame_rate,
         short_name = short_name.split(".")[0]
         for i in range(10):
             this_name = short_name + "_" + str(i)
-            if not os.path.isfile(os.path.join(dir_name, this_name + '.mp4')):
+            if not os.path.isfile(video_path(os.path.join(dir_name, this_name + '.mp4'))):
                 break
 
         return visualize_images(images, frame_rate,
@@ -632,11 +625,8 @@ def visLoc(locs, label="NotSet"):
 
 def integral(speed, time0):
     out = np.zeros_like(speed)
-    l = speed.shape[0]
-    for i in range(l):
-        s = speed[i, :]
-        if i > 0:
-            out[i, :] = out[i - 1, :] + s * time0
+    # cumsum adds up in order, as a running sum over the frames would
+    np.cumsum(speed[1:] * time0, axis=0, out=out[1:])
     return out
 
 def vis_speed(speed, hz):
@@ -758,6 +748,7 @@ def vis_discrete_colormap_antialias(tout, predict, frame_rate, j=0, save_visuali
 
     _, short_name = os.path.split(name[j])
     short_name = short_name.split(".")[0]
+    sink = highqual_sink(3, short_name, os.path.join(dir_name, 'viz', short_name+string_type))
 
     for i in range(images.shape[0]):
         action_mean = [clamp(turn[i, 0]+0.05), clamp(turn[i, 2]+0.05),
@@ -785,19 +776,13 @@ def vis_discrete_colormap_antialias(tout, predict, frame_rate, j=0, save_visuali
         ax_2.get_xaxis().set_visible(False)
         ax_2.get_yaxis().set_visible(False)
 
-        if not os.path.exists(os.path.join(dir_name,'viz')):
-            os.mkdir(os.path.join(dir_name,'viz'))
-        if not os.path.exists(os.path.join(dir_name,'viz', short_name+string_type)):
-            os.mkdir(os.path.join(dir_name, 'viz', short_name+string_type))
-        fig.savefig(os.path.join(dir_name, 'viz', short_name+string_type,'{0:04}.png'.format(i)),
-                    bbox_inches='tight', pad_inches = -0.04, Transparent=True, dpi=100)
+        sink.write(png_to_rgb(render_figure(fig, bbox_inches='tight', pad_inches = -0.04, Transparent=True, dpi=100)))
 
         print(short_name,' ', i, 'Done!')
         plt.show()
         plt.close()
 
-    images2video_highqual(frame_rate = 3,
-                          name=short_name, dir_name=os.path.join(dir_name, 'viz', short_name+string_type))
+    sink.close()
 
 def vis_continuous_colormap_antialias(tout, predict, frame_rate, car_stop_model,
                  j=0, save_visualize=False, dir_name="temp", vis_radius=10):
@@ -811,95 +796,28 @@ def vis_continuous_colormap_antialias(tout, predict, frame_rate, car_stop_model,
     locs = tout[6]
     decoded = highres
 
-    images = copy.deepcopy(decoded[j, :, :, :, :])
-    #images = images.astype('float64')
-    _, hi, wi, _ = images.shape
+    images = decoded[j, :, :, :, :]
+    nframes, hi, wi, _ = images.shape
     locs = locs[j, :, :]
 
-    def plot_greens(bin_ends, values, image_width, image_height, radius, driver_action):
-        # bins are: [0, bin_ends[0]], [bin_ends[0], bin_ends[1]] ...
-        # and the corresponding values to display are: values[0], values[1]
-        # the final results are added to ada
-
-        ada = AnchoredDrawingArea(radius * 2, radius, 0, 0, loc=10, pad=0., frameon=False)
-        def add_ada_custom(angle_s, angle_e, value, color):
-            add_to_ada(ada, radius, -(image_height / 2 - radius / 2), radius, angle_s, angle_e, None, color, value)
-
-        def add_to_ada(ada, pos_x, pos_y, radius, angle_s, angle_e, ring_width, color_code, alpha_value):
-            ada.drawing_area.add_artist(
-                Wedge((pos_x, pos_y), radius, angle_s, angle_e, width=ring_width, fc=color_code  # '#DAF7A6'
-                      ,ec = 'none', alpha=alpha_value, antialiased=True))
-
-        bin_ends = 180 - np.array(bin_ends)
-        bin_ends = bin_ends[::-1]
-        values = np.array(values)
-        values = np.squeeze(values)
-        values = values[::-1]
-
-        # add a black background
-        add_ada_custom(0, 180, 0.8, "#000000")
-
-        color_shading = "#00FF00"
-        for i in range(len(values)):
-            #print(bin_ends.shape, '____all____bin_____')
-            #print(values.shape, '___all_____values____')
-            if i < 5:
-                print(bin_ends[i], bin_ends[i + 1], values[i], '________________________')
-            add_ada_custom(bin_ends[i], bin_ends[i + 1], values[i], color_shading)
-
-        white_border = 1
-        border_color = '#FFFFFF'
-        add_to_ada(ada, radius, -(image_height / 2 - radius / 2), radius + white_border, 0, 180, white_border,
-                   border_color, 1)
-
-        tick_len = 20
-        tick_color = '#FFFFFF'
-        tick_width = 1.0 / 2
-        for i in range(len(bin_ends)):
-            add_to_ada(ada, radius, -(image_height / 2 - radius / 2), radius + white_border,
-                       bin_ends[i] - tick_width / 2, bin_ends[i] + tick_width / 2, tick_len, tick_color, 10)
-
-        driver_action = driver_action / 180.0 * math.pi
-        start = np.array([radius, -(image_height / 2 - radius / 2) - 2])
-        delta = np.array([radius * math.cos(driver_action), radius * math.sin(driver_action)]) * 0.8
-        color_driver = "#0000FF"
-        ada.drawing_area.add_artist(FancyArrowPatch(start, start + delta, linewidth=2, color=color_driver))
-
-        return ada
+    # every course bin is a wedge shaded by its probability, over a darkened half disk
+    course_bin = np.concatenate(([-math.pi/2], car_stop_model.binning().course_bin, [math.pi/2]))
+    course = softmax(predict[0:nframes, 0:FLAGS.discretize_n_bins])
+    course = course / np.max(course, axis=1, keepdims=True)
+
+    overlay = sector_overlay(hi, wi, int(hi/2))
+    value = overlay.binned(course, course_bin)
+    frames = overlay.composite(images, 255 * value, 1 - 0.2 * (1 - value),
+                               overlay.decoration(course_bin, tick_len=20, border=1))
 
     _, short_name = os.path.split(name[j])
     short_name = short_name.split(".")[0]
-    for i in range(images.shape[0]):
-        # the ground truth course and speed
-        locs[i, 1] = 10.0
-        # get the MAP prediction
-        fig = plt.figure(figsize=(16, 12))
-        course_bin, speed_bin = car_stop_model.get_bins()
-        course_bin = [-math.pi/2] + course_bin + [math.pi/2]
-        course_bin = np.array(course_bin)*180/math.pi + 90
-        ax_original = plt.gca()
-        ax_original.set_axis_off()
-        ax_original.get_xaxis().set_visible(False)
-        ax_original.get_yaxis().set_visible(False)
-        plt.imshow(images[i, :, :, :])
-        plt.axis('off')
-
-        course = softmax(predict[i:(i + 1), 0:FLAGS.discretize_n_bins])
-        course = course/np.max(course)
-
-        print(course_bin, course, '!'*10)
-        ada2 = plot_greens(course_bin, course, 1280, 501, 200, -locs[i, 0]*180/math.pi+90)
-        ax_original.add_artist(ada2)
-        plt.show()
-
-        if not os.path.exists(os.path.join(dir_name,'viz')):
-            os.mkdir(os.path.join(dir_name,'viz'))
-        if not os.path.exists(os.path.join(dir_name,'viz', short_name)):
-            os.mkdir(os.path.join(dir_name, 'viz', short_name))
-        fig.savefig(os.path.join(dir_name, 'viz', short_name, '{0:04}.png'.format(i)),
-                    bbox_inches='tight', pad_inches=-0.04, Transparent=True, dpi=100)
-        plt.close()
-        print(short_name)
+    out_dir_name = os.path.join(dir_name, 'viz', short_name)
+    make_dirs(out_dir_name)
+    for i in range(nframes):
+        # the driver's course
+        overlay.arrow(frames[i], locs[i, 0], 0.8 * overlay.radius, (0, 0, 255))
+        cv2.imwrite(os.path.join(out_dir_name, '{0:04}.png'.format(i)), cv2.cvtColor(frames[i], cv2.COLOR_RGB2BGR))
 
     print("showing visualization for video %s" % name[j])
 
@@ -916,131 +834,37 @@ def vis_continuous_interpolated(tout, predict, frame_rate, car_stop_model,
     locs = tout[6]
     decoded = highres
 
-    images = copy.deepcopy(decoded[j, :, :, :, :])
-
-    _, hi, wi, _ = images.shape
+    images = decoded[j, :, :, :, :]
+    nframes, hi, wi, _ = images.shape
     locs = locs[j, :, :]
 
-    def gen_mask(bin_ends, values, radius, height, width):
-        # convert bin_ends to bin centers
-        new_ends = []
-        for i in range(len(bin_ends) - 1):
-            new_ends.append((bin_ends[i] + bin_ends[i + 1]) / 2)
-
-        # RGBA
-        out = np.zeros((height, width, 4), dtype=np.uint8)
-
-        xy = np.dstack(np.meshgrid(np.arange(width / 2 - radius, width / 2 + radius),
-                                   np.arange(height - radius, height),
-                                   indexing='ij')).reshape((-1, 2))
-
-        # filter out invalid speed
-        v = np.stack((xy[:, 0] - width / 2, height - xy[:, 1]), axis=1)
-        speed_norm = np.sqrt(v[:, 0] ** 2 + v[:, 1] ** 2)
-
-        valid_speed = np.less(speed_norm, radius)
-
-        xy = xy[valid_speed, :]
-        speed_norm = speed_norm[valid_speed]
-        v = v[valid_speed]
-        course_norm = np.arccos(1.0 * v[:, 0] / speed_norm)
-        course_norm = np.degrees(course_norm)
-
-        value = np.interp(course_norm, new_ends, values)
-
-        out[xy[:, 1], xy[:, 0], 1] = 255 * value
-        out[xy[:, 1], xy[:, 0], 3] = 255
-
-        return out
-
-    def plot_greens(bin_ends, values, image_width, image_height, radius, driver_action):
-        ada = AnchoredDrawingArea(radius * 2, radius, 0, 0, loc=10, pad=0., borderpad=0., frameon=False)
-
-        def add_to_ada(ada, pos_x, pos_y, radius, angle_s, angle_e, ring_width, color_code, alpha_value):
-            ada.drawing_area.add_artist(
-                Wedge((pos_x, pos_y), radius, angle_s, angle_e, width=ring_width, fc=color_code  # '#DAF7A6'
-                      , ec='none', alpha=alpha_value, antialiased=True))
-
-        bin_ends = 180 - np.array(bin_ends)
-        bin_ends = bin_ends[::-1]
-        values = np.array(values)
-        values = np.squeeze(values)
-        values = values[::-1]
-
-        mask = gen_mask(bin_ends, values, radius, image_height, image_width)
-        plt.imshow(mask, alpha=0.8)
-
-        white_border = 2
-        border_color = '#FFFFFF'
-        add_to_ada(ada, radius, -(image_height / 2 - radius / 2), radius + white_border, 0, 180, white_border + 1,
-                   border_color, 1)
-
-        tick_len = 20
-        tick_color = '#FFFFFF'
-        tick_width = 1.0 / 2
-        for i in range(len(bin_ends)):
-            if abs(bin_ends[i] - 90) > 10:
-                add_to_ada(ada, radius, -(image_height / 2 - radius / 2), radius + white_border,
-                           bin_ends[i] - tick_width / 2, bin_ends[i] + tick_width / 2, tick_len, tick_color, 10)
-
-        driver_action = driver_action / 180.0 * math.pi
-        start = np.array([radius, -(image_height / 2 - radius / 2)])
-        delta = np.array([radius * math.cos(driver_action), radius * math.sin(driver_action)]) * 0.8
-        color_driver = "#0000FF"
-        ada.drawing_area.add_artist(FancyArrowPatch(start, start + delta, linewidth=2, color=color_driver))
+    # the course probabilities linearly interpolated between the bin centers
+    course_bin = np.concatenate(([-math.pi/2], car_stop_model.binning().course_bin, [math.pi/2]))
+    centers = (course_bin[1:] + course_bin[:-1]) / 2
+    if need_softmax:
+        course = softmax(predict[0:nframes, 0:FLAGS.discretize_n_bins])
+    else:
+        course = predict[0:nframes, 0:FLAGS.discretize_n_bins]
+    course = course / np.max(course, axis=1, keepdims=True)
 
-        return ada
+    overlay = sector_overlay(hi, wi, int(hi/2))
+    ticks = course_bin[np.abs(course_bin) > math.radians(10)]
+    frames = overlay.composite(images, 0.8 * 255 * overlay.interpolated(course, centers), 0.8,
+                               overlay.decoration(ticks, tick_len=20, border=2))
 
     _, short_name = os.path.split(name[j])
     short_name = short_name.split(".")[0]
-    for i in range(images.shape[0]):
-        # the ground truth course and speed
-        locs[i, 1] = 10.0
-        # get the MAP prediction
-
-        # TODO, might change based on machine
-        DPI = 72
-        fig = plt.figure(figsize=(1.0*wi / DPI, 1.0*hi / DPI), dpi=DPI)
-
-        course_bin, speed_bin = car_stop_model.get_bins()
-        course_bin = [-math.pi/2] + course_bin + [math.pi/2]
-        course_bin = np.array(course_bin)*180/math.pi + 90
-
-        #ax_original = plt.gca()
-        ax_original = fig.add_axes([0, 0, 1, 1])
-        ax_original.set_axis_off()
-        ax_original.get_xaxis().set_visible(False)
-        ax_original.get_yaxis().set_visible(False)
-        plt.imshow(images[i, :, :, :])
-        plt.axis('off')
-
-        if need_softmax:
-            course = softmax(predict[i:(i + 1), 0:FLAGS.discretize_n_bins])
-        else:
-            course = predict[i:(i + 1), 0:FLAGS.discretize_n_bins]
-        course = course/np.max(course)
-
-        radius = int(hi/2)
-        ada2 = plot_greens(course_bin, course, wi, hi, radius, -locs[i, 0]*180/math.pi+90)
-        ax_original.add_artist(ada2)
-        #plt.show()
-
-        if not os.path.exists(os.path.join(dir_name,'viz')):
-            os.makedirs(os.path.join(dir_name,'viz'))
-        if not os.path.exists(os.path.join(dir_name,'viz', short_name)):
-            os.mkdir(os.path.join(dir_name, 'viz', short_name))
-        fig.savefig(os.path.join(dir_name, 'viz', short_name, '{0:04}.png'.format(i)),
-                    bbox_inches='tight', pad_inches=0.0, Transparent=True, dpi=DPI)
-        plt.close()
-        print(short_name)
+    out_dir_name = os.path.join(dir_name, 'viz', short_name)
+    make_dirs(out_dir_name)
+    for i in range(nframes):
+        # the driver's course
+        overlay.arrow(frames[i], locs[i, 0], 0.8 * overlay.radius, (0, 0, 255))
+        cv2.imwrite(os.path.join(out_dir_name, '{0:04}.png'.format(i)), cv2.cvtColor(frames[i], cv2.COLOR_RGB2BGR))
 
     print("showing visualization for video %s" % name[j])
     if return_first:
-        path = os.path.join(dir_name, 'viz', name[0], '{0:04}.png'.format(0))
-        image = misc.imread(path, mode='RGB')
-        return image
+        return frames[0]
 
-from scipy import misc
 import matplotlib
 def continuous_vis_single_image(image, predict, method="vis_continuous"):
     matplotlib.use('Agg')
@@ -1093,101 +917,44 @@ def vis_continuous_yang(tout, predict, frame_rate, car_stop_model,
         locs = tout[6]
     decoded = highres
 
-    images = copy.deepcopy(decoded[j, :, :, :, :])
+    images = decoded[j, :, :, :, :]
 
-    _, hi, wi, _ = images.shape
+    nframes, hi, wi, _ = images.shape
     locs = locs[j, :, :]
 
-    def gen_mask(predict, radius, height, width, consistent_upper_bound=0.3):
-        image = np.zeros((height, width, 4), dtype=np.float64)
-        image = draw_sector(image,
-                    predict,
-                    car_stop_model,
-                    course_delta=0.1 / 180 * math.pi,
-                    speed_delta=0.1,
-                    pdf_multiplier=None,
-                    speed_multiplier=radius/30,
-                    h=height, w=width,
-                    max_speed=30,
-                    uniform_speed=False,
-                    consistent_vis=(True, 1e-3, consistent_upper_bound),
-                    has_alpha_channel=True)
-
-        return image.astype("uint8")
-
-    def plot_line(ada, driver_action, driver_speed, image_height, radius, color_driver="#0000FF", linewidth=2.0):
-        # convert the driver action to the language of matplotlib
-        driver_action = -driver_action * 180 / math.pi + 90
-        # then to radian again
-        driver_action = driver_action / 180.0 * math.pi
-
-        start = np.array([radius, -(image_height / 2 - radius / 2)])
-        delta = np.array([driver_speed * math.cos(driver_action), driver_speed * math.sin(driver_action)]) * 0.8
-        ada.drawing_area.add_artist(FancyArrowPatch(start, start + delta, linewidth=linewidth, color=color_driver))
-
-    def plot_greens(predict, image_width, image_height, radius, locs, MAP, amplify_ratio):
-        ada = AnchoredDrawingArea(radius * 2, radius, 0, 0, loc=10, pad=0., borderpad=0., frameon=False)
-
-        def add_to_ada(ada, pos_x, pos_y, radius, angle_s, angle_e, ring_width, color_code, alpha_value):
-            ada.drawing_area.add_artist(
-                Wedge((pos_x, pos_y), radius, angle_s, angle_e, width=ring_width, fc=color_code  # '#DAF7A6'
-                      , ec='none', alpha=alpha_value, antialiased=True))
-
-        # TODO, replace this with a call to draw_sector
-        mask = gen_mask(predict, radius, image_height, image_width)
-        plt.imshow(mask, alpha=0.8)
-
-        white_border = 2
-        border_color = '#FFFFFF'
-        add_to_ada(ada, radius, -(image_height / 2 - radius / 2), radius + white_border, 0, 180, white_border + 1,
-                   border_color, 1)
-
-        plot_line(ada, locs[0], locs[1]*amplify_ratio, image_height, radius, "#FF0000", 1.0)
-        plot_line(ada, MAP[0],  MAP[1]*amplify_ratio,  image_height, radius, "#0000FF", 1.0)
-
-        return ada
+    assert need_softmax
+    radius = int(hi / 2) // 30 * 30
+    amplify_ratio = radius / 30.0
+    overlay = sector_overlay(hi, wi, radius)
+
+    # the pdf of every frame at the course and speed of every pixel, for a max speed of 30 at the
+    # radius, mapped consistently between methods: sqrt scaled between 1e-3 and 0.3
+    pdf = car_stop_model.continous_pdf([predict[0:nframes, :]],
+                                       overlay.course_speed(1.0 / amplify_ratio),
+                                       "multi_querys_batch")
+    MIN, MAX = 1e-3, 0.3
+    green = np.sqrt((np.clip(pdf, MIN, MAX) - MIN) / (MAX - MIN)) * 255
+    frames = overlay.composite(images, 0.8 * green, 0.8, overlay.decoration(border=3))
+    MAPs = car_stop_model.continous_MAP([predict[0:nframes, :]])
 
     _, short_name = os.path.split(name[j])
     short_name = short_name.split(".")[0]
-    for i in range(images.shape[0]):
-        # TODO, might change based on machine
-        DPI = 72
-        fig = plt.figure(figsize=(1.0*wi / DPI, 1.0*hi / DPI), dpi=DPI)
-
-        #ax_original = plt.gca()
-        ax_original = fig.add_axes([0, 0, 1, 1])
-        ax_original.set_axis_off()
-        ax_original.get_xaxis().set_visible(False)
-        ax_original.get_yaxis().set_visible(False)
-        plt.imshow(images[i, :, :, :])
-        plt.axis('off')
-
-        assert need_softmax
-
-        radius = int(hi/2) / 30 * 30
-
-        # TODO: add the MAP prediction.
-        ada2 = plot_greens(predict[i:(i+1), :], wi, hi, radius,
-                           locs[i, :],
-                           car_stop_model.continous_MAP([predict[i:(i + 1), :]]).ravel(),
-                           radius / 30.0)
-        ax_original.add_artist(ada2)
-        #plt.show()
-
-        out_dir_name = dir_name
-        if not os.path.exists(out_dir_name):
-            os.makedirs(out_dir_name)
-        # This line take most of the time, because all the rendering happens here
-        fig.savefig(os.path.join(out_dir_name, '{0:05}.png'.format(i)),
-                    bbox_inches='tight', pad_inches=-0.1, Transparent=True, dpi=DPI)
-        plt.close()
-        print(short_name)
+    if save_video:
+        sink = highqual_sink(frame_rate, short_name, dir_name)
+    else:
+        make_dirs(dir_name)
+    for i in range(nframes):
+        # the driver's and the MAP course and speed
+        overlay.arrow(frames[i], locs[i, 0], 0.8 * locs[i, 1] * amplify_ratio, (255, 0, 0), 1)
+        overlay.arrow(frames[i], MAPs[i, 0], 0.8 * MAPs[i, 1] * amplify_ratio, (0, 0, 255), 1)
+        if save_video:
+            sink.write(frames[i])
+        else:
+            cv2.imwrite(os.path.join(dir_name, '{0:05}.png'.format(i)), cv2.cvtColor(frames[i], cv2.COLOR_RGB2BGR))
 
     if save_video:
-        images2video_highqual(frame_rate=frame_rate, name=short_name, dir_name=dir_name)
+        sink.close()
 
     print("showing visualization for video %s" % name[j])
     if return_first:
-        path = os.path.join(out_dir_name, '{0:05}.png'.format(0))
-        image = misc.imread(path, mode='RGB')
-        return image
+        return frames[0]
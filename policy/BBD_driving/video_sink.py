@@ -0,0 +1,172 @@
+'''
+Streaming video sink for the visualizations.
+
+Frames are handed to an encoder as they are rendered instead of being written as images to a temp
+dir first. With an ffmpeg binary on the PATH the raw RGB frames are piped to it over stdin and encoded
+to H.264, otherwise they are encoded in process to MJPEG in an .avi by OpenCV. A writer thread feeds
+the encoder from a bounded queue, so rendering the next frame overlaps encoding and memory stays
+bounded. Nothing depends on the working directory or on shared temp files, so several visualization
+jobs can run in parallel as long as they write different videos.
+
+    with VideoSink("out/video.mp4", frame_rate=3) as sink:
+        for frame in frames:
+            sink.write(frame)
+    print(sink.path)
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import subprocess
+import threading
+
+try:
+    import queue
+    from shutil import which
+except ImportError:
+    import Queue as queue
+    from distutils.spawn import find_executable as which
+
+import cv2
+import numpy as np
+
+
+def make_dirs(dir_name):
+    # safe when several jobs create the same folder at once
+    try:
+        os.makedirs(dir_name)
+    except OSError:
+        if not os.path.isdir(dir_name):
+            raise
+
+
+def has_ffmpeg():
+    return which('ffmpeg') is not None
+
+
+def video_path(path, use_ffmpeg=None):
+    # the file a VideoSink of path writes: path itself with ffmpeg, path with an .avi extension without
+    if use_ffmpeg is None:
+        use_ffmpeg = has_ffmpeg()
+    return path if use_ffmpeg else os.path.splitext(path)[0] + '.avi'
+
+
+MIME_TYPES = {'.mp4': 'video/mp4', '.avi': 'video/x-msvideo'}
+
+
+class VideoSink(object):
+    '''
+    Encodes RGB (or single channel) uint8 frames of a constant size to path. crf and preset are the
+    libx264 quality settings of the ffmpeg encoder, jpeg_quality the one of the in process MJPEG
+    encoder. When the MJPEG encoder is used the video goes to path with an .avi extension, path holds
+    the written file, video_path(path) gives it before the sink is created.
+    '''
+
+    def __init__(self, path, frame_rate, crf=16, preset='veryfast', jpeg_quality=93, queue_size=16,
+                 use_ffmpeg=None):
+        if use_ffmpeg is None:
+            use_ffmpeg = has_ffmpeg()
+        self.use_ffmpeg = use_ffmpeg
+        self.path = video_path(path, use_ffmpeg)
+        self.frame_rate = frame_rate
+        self.crf = crf
+        self.preset = preset
+        self.jpeg_quality = jpeg_quality
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.size = None
+        self.count = 0
+        self.error = None
+        self.thread = None
+        dir_name = os.path.dirname(self.path)
+        if dir_name:
+            make_dirs(dir_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open_encoder(self, height, width):
+        if self.use_ffmpeg:
+            cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height),
+                   '-r', str(self.frame_rate), '-i', '-',
+                   '-vcodec', 'libx264', '-crf', str(self.crf), '-preset', self.preset,
+                   '-pix_fmt', 'yuv420p', self.path]
+            return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'MJPG'), self.frame_rate, (width, height))
+        if not writer.isOpened():
+            raise IOError("could not open an MJPEG writer for %s" % self.path)
+        writer.set(cv2.VIDEOWRITER_PROP_QUALITY, self.jpeg_quality)
+        return writer
+
+    def run(self, encoder):
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                if self.use_ffmpeg:
+                    encoder.stdin.write(frame.tobytes())
+                else:
+                    encoder.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+        except Exception as e:
+            self.error = e
+            # keep consuming, so write() and close() never block on a full queue
+            while frame is not None:
+                frame = self.frames.get()
+        finally:
+            if self.use_ffmpeg:
+                try:
+                    encoder.stdin.close()
+                except IOError:
+                    pass
+                if encoder.wait() != 0 and self.error is None:
+                    self.error = RuntimeError("ffmpeg failed to encode %s" % self.path)
+            else:
+                encoder.release()
+
+    def write(self, frame):
+        if self.error is not None:
+            raise self.error
+        frame = np.asarray(frame)
+        if frame.ndim == 3 and frame.shape[2] == 1:
+            frame = frame[:, :, 0]
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame.astype(np.uint8), cv2.COLOR_GRAY2RGB)
+        frame = frame[:, :, :3]
+
+        if self.size is None:
+            height, width = frame.shape[:2]
+            # yuv420p needs an even size
+            if self.use_ffmpeg:
+                height, width = height + height % 2, width + width % 2
+            self.size = (height, width)
+            self.thread = threading.Thread(target=self.run, args=(self.open_encoder(height, width),))
+            self.thread.daemon = True
+            self.thread.start()
+
+        # a copy of the frame in the video size, the caller may reuse its buffer
+        out = np.zeros(self.size + (3,), dtype=np.uint8)
+        height, width = min(self.size[0], frame.shape[0]), min(self.size[1], frame.shape[1])
+        if frame.shape[:2] != (height, width):
+            # frames of a different size than the first are fit to it
+            frame = cv2.resize(np.ascontiguousarray(frame, dtype=np.uint8), (self.size[1], self.size[0]),
+                               interpolation=cv2.INTER_AREA)
+            height, width = self.size
+        out[:height, :width] = frame[:height, :width]
+        self.frames.put(out)
+        self.count += 1
+
+    def close(self):
+        '''Flushes the queue and finishes the video, returns its path.'''
+        if self.thread is not None:
+            self.frames.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
+        return self.path
@@ -8,7 +8,7 @@ format input. Instead, it accepts inputs of images, and output actions on the fl
 
 import tensorflow as tf
 import models.car_stop_model as model
-from scipy.misc import imresize
+import cv2
 import numpy as np
 
 # The following import populates some FLAGS default value
@@ -25,18 +25,8 @@ import importlib, sys, time
 IMSZ = 228
 
 class Wrapper:
-    def __init__(self, model_config_name, model_path, truncate_len=20, config_name="config", config_path=".", is_lstm=False):
-        self.is_lstm = is_lstm
-        if is_lstm:
-            assert truncate_len==1, \
-                "using lstm should set truncate_len to 1, otherwise waste of computing resource"
-
-        # currently, we use a sliding window fashion for evaluation, that's inefficient but convenient to implement
-        self.truncate_len = truncate_len
-        self.latest_frames = []
-        for _ in range(truncate_len):
-            self.latest_frames.append(np.zeros((IMSZ, IMSZ, 3), dtype=np.uint8))
-
+    def __init__(self, model_config_name, model_path, truncate_len=20, config_name="config", config_path=".",
+                 is_lstm=False, incremental=False):
         # call the config.py for setup
         sys.path.append(config_path)
         config = importlib.import_module(config_name)
@@ -45,6 +35,23 @@ class Wrapper:
         config_fun("eval")
         common_config_post("eval")
 
+        # incremental: the CNN runs once per frame. An LSTM carries its state from frame to frame,
+        # other temporal nets rerun only on the cached CNN features of the last truncate_len frames
+        if incremental and FLAGS.temporal_net == "LSTM":
+            is_lstm = True
+            truncate_len = 1
+        self.is_lstm = is_lstm
+        if is_lstm:
+            assert truncate_len==1, \
+                "using lstm should set truncate_len to 1, otherwise waste of computing resource"
+        self.incremental = incremental and not is_lstm
+
+        # the sliding window of the last truncate_len frames (or their features) is kept twice in a
+        # ring of 2*truncate_len, so the window is the contiguous slice after the newest position
+        self.truncate_len = truncate_len
+        self.pos = truncate_len - 1
+        self.frame = np.zeros((1, 1, IMSZ, IMSZ, 3), dtype=np.uint8)
+
         # Tensors in has the format: [images, speed] for basic usage, excluding only_seg
         # For now, we decide not to support previous speed as input, thus we use a fake speed (-1) now
         # and ensures the speed is not used by asserting FLAGS.use_previous_speed_feature==False
@@ -54,12 +61,14 @@ class Wrapper:
         self.speed = None
 
         if is_lstm:
-            self.initial_state = ((tf.placeholder(tf.float32,
-                                                  shape=(1, int(FLAGS.lstm_hidden_units)),
-                                                  name="state_placeholder1"),
-                                  tf.placeholder(tf.float32,
-                                                 shape=(1, int(FLAGS.lstm_hidden_units)),
-                                                 name="state_placeholder2")), )
+            hidden_units = [int(x.strip()) for x in FLAGS.lstm_hidden_units.split(",")]
+            self.initial_state = tuple((tf.placeholder(tf.float32,
+                                                       shape=(1, hidden),
+                                                       name="state_placeholder%d" % (2 * i + 1)),
+                                        tf.placeholder(tf.float32,
+                                                       shape=(1, hidden),
+                                                       name="state_placeholder%d" % (2 * i + 2)))
+                                       for i, hidden in enumerate(hidden_units))
 
             FLAGS.phase = "rnn_inference"
         else:
@@ -67,6 +76,20 @@ class Wrapper:
         logits_all = model.inference([self.tensors_in, self.speed], -1, for_training=False,
                                      initial_state=self.initial_state)
 
+        if self.incremental:
+            # the window graph is fed the cached features, which skips its CNN. The CNN of each new
+            # frame runs in a second, single frame graph that shares the variables
+            self.window_in = tf.get_collection(model.TEMPORAL_FEATURES)[-1]
+            self.frame_in = tf.placeholder(tf.uint8, shape=(1, 1, IMSZ, IMSZ, 3), name="frame_input")
+            with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+                model.inference([self.frame_in, self.speed], -1, for_training=False)
+            self.frame_features = tf.get_collection(model.TEMPORAL_FEATURES)[-1]
+            feature_dim = self.window_in.get_shape()[2].value
+            self.window = np.zeros((2 * truncate_len, feature_dim), dtype=np.float32)
+        else:
+            self.window_in = self.tensors_in
+            self.window = np.zeros((2 * truncate_len, IMSZ, IMSZ, 3), dtype=np.uint8)
+
         # Restore the moving average version of the learned variables for eval.
         variable_averages = tf.train.ExponentialMovingAverage(model.MOVING_AVERAGE_DECAY)
         variables_to_restore = variable_averages.variables_to_restore()
@@ -81,12 +104,16 @@ class Wrapper:
         self.logits = logits_all[0]
         if is_lstm:
             self.state_tensor = logits_all[-1]
-            self.state_value=[[np.zeros((1, int(FLAGS.lstm_hidden_units)), dtype=np.float32),
-                               np.zeros((1, int(FLAGS.lstm_hidden_units)), dtype=np.float32)]]
+            self.state_value = [[np.zeros((1, hidden), dtype=np.float32),
+                                 np.zeros((1, hidden), dtype=np.float32)] for hidden in hidden_units]
 
         init_op = tf.initialize_local_variables()
         self.sess.run(init_op)
 
+        if self.incremental:
+            # the window starts with black frames, as in the sliding window mode
+            self.window[:] = self.sess.run(self.frame_features, feed_dict={self.frame_in: self.frame})[0, 0]
+
     def observe_a_frame(self, image):
         '''
         Assuming the input frequency is 3Hz
@@ -97,19 +124,22 @@ class Wrapper:
         Returns:
             an action output from the model
         '''
-        image = self.process_frame(image)
-        self.latest_frames.append(image)
-        if len(self.latest_frames) > self.truncate_len:
-            self.latest_frames = self.latest_frames[-self.truncate_len:]
-
-        batch = np.stack(self.latest_frames, axis=0)
-        batch = batch[np.newaxis]
-
+        self.process_frame(image, out=self.frame[0, 0])
         time0 = time.time()
-        fd = {self.tensors_in: batch}
+        if self.incremental:
+            value = self.sess.run(self.frame_features, feed_dict={self.frame_in: self.frame})[0, 0]
+        else:
+            value = self.frame[0, 0]
+        self.pos = (self.pos + 1) % self.truncate_len
+        self.window[self.pos] = value
+        self.window[self.pos + self.truncate_len] = value
+        window = self.window[np.newaxis, self.pos + 1:self.pos + 1 + self.truncate_len]
+
+        fd = {self.window_in: window}
         if self.is_lstm:
-            fd[self.initial_state[0][0]] = self.state_value[0][0]
-            fd[self.initial_state[0][1]] = self.state_value[0][1]
+            for placeholders, values in zip(self.initial_state, self.state_value):
+                fd[placeholders[0]] = values[0]
+                fd[placeholders[1]] = values[1]
             logits_v, self.state_value = self.sess.run([self.logits, self.state_tensor], feed_dict=fd)
         else:
             logits_v = self.sess.run(self.logits, feed_dict=fd)
@@ -128,8 +158,10 @@ class Wrapper:
         # MAPs = model.continous_MAP([logits_all])
         return [logits_v]
 
-    def process_frame(self, image):
-        return imresize(image, (IMSZ, IMSZ))
+    def process_frame(self, image, out=None):
+        # area interpolation when shrinking, like the antialiased bilinear filter of imresize
+        interpolation = cv2.INTER_AREA if image.shape[0] > IMSZ else cv2.INTER_LINEAR
+        return cv2.resize(image, (IMSZ, IMSZ), dst=out, interpolation=interpolation)
 
     def continuous_muti_querys_pdf(self, logits, querys):
         return model.continous_pdf(logits, querys, "multi_querys")
@@ -0,0 +1,184 @@
+import numpy as np
+import cv2
+
+#
+# Batch version of the per-image augmentation in util.py (shift_img,
+# flip_img, brightness_img, generate_shadow) and proc_data.py
+# (random_translate, random_horz_flip, random_brightness).
+#
+# Every random parameter is drawn once per batch as an array. Whole pixel
+# shifts, the default at full camera resolution, are plain slice copies per
+# image. Fractional shifts treat the batch as one tall (N*H, W) image: flip,
+# horizontal and vertical shift become one coordinate map and a single
+# cv2.remap with the same bilinear interpolation warpAffine uses.
+# Brightness is a per-image scale, only shadowed images get a per-pixel gain.
+# Scaling V in HSV with H and S fixed is the same as scaling R, G and B, so
+# no colour conversion is needed.
+#
+
+
+class BatchAugmenter:
+    """
+    Augments a (N, H, W, C) uint8 batch and its steering angles at once.
+
+    Defaults reproduce util.generate_train: horizontal shift of up to
+    max_shift camera pixels with max_ang steering per max_shift, random
+    flip, brightness gain in `brightness` with probability p_bright,
+    clipped steering. shift_scale converts camera pixels to pixels of the
+    (cropped) batch. p_shadow enables generate_shadow, noise adds gaussian
+    pixel noise and steer_noise gaussian steering noise. max_vshift shifts
+    vertically like random_translate, replicate selects its border mode.
+    """
+
+    def __init__(self, max_shift=55, max_ang=0.14, shift_scale=1., max_vshift=0, vshift_scale=1.,
+                 p_flip=0.5, brightness=(0.4, 0.8), p_bright=0.5, p_shadow=0., shadow_alpha=(0.5, 0.75),
+                 noise=0., steer_noise=0., clip_steering=True, replicate=False, seed=None):
+        self.max_shift = max_shift
+        self.max_ang = max_ang
+        self.shift_scale = shift_scale
+        self.max_vshift = max_vshift
+        self.vshift_scale = vshift_scale
+        self.p_flip = p_flip
+        self.brightness = brightness
+        self.p_bright = p_bright
+        self.p_shadow = p_shadow
+        self.shadow_alpha = shadow_alpha
+        self.noise = noise
+        self.steer_noise = steer_noise
+        self.clip_steering = clip_steering
+        self.replicate = replicate
+        self.rng = np.random.RandomState(seed)
+        self.shape = None
+
+    def _prepare(self, shape):
+        # coordinate maps, rebuilt only when the batch shape changes
+        n, rows, cols = shape[:3]
+        self.shape = shape
+        self.map_x = np.empty((n, rows, cols), dtype=np.float32)
+        self.map_y = np.empty((n, rows, cols), dtype=np.float32)
+        self.x = np.arange(cols, dtype=np.float32)
+        self.y = np.arange(rows, dtype=np.float32)
+        # remap addresses fewer than 2**15 rows, bigger batches go in chunks
+        self.per_call = max(1, (2 ** 15 - 1) // rows)
+        self.first_row = (np.arange(n) % self.per_call * rows).astype(np.float32)
+        self.map_y_shifted = True
+        self.warped = np.empty((n * rows, cols) + tuple(c for c in shape[3:] if c != 1), dtype=np.uint8)
+
+    def _remap(self, stacked, flip, dx, dy):
+        n, rows, cols = self.shape[:3]
+        # output pixel x reads source pixel x - dx, mirrored first if flipped
+        x = np.where(flip[:, None], cols - 1 - self.x, self.x) - dx[:, None].astype(np.float32)
+        self.map_x[...] = x[:, None, :]
+        if dy is not None:
+            y = self.y[None, :] - dy[:, None].astype(np.float32)
+            if self.replicate:
+                y = np.clip(y, 0, rows - 1)
+            else:
+                # rows outside the image would read its neighbour in the stack
+                self.map_x[(y < 0) | (y > rows - 1)] = -1
+            self.map_y[...] = (self.first_row[:, None] + y)[:, :, None]
+            self.map_y_shifted = True
+        elif self.map_y_shifted:
+            # without vertical shift map_y stays the same from batch to batch
+            self.map_y[...] = (self.first_row[:, None] + self.y[None, :])[:, :, None]
+            self.map_y_shifted = False
+
+        border = cv2.BORDER_REPLICATE if self.replicate else cv2.BORDER_CONSTANT
+        map_x = self.map_x.reshape(n * rows, cols)
+        map_y = self.map_y.reshape(n * rows, cols)
+        warped = self.warped
+        step = self.per_call * rows
+        for start in range(0, n * rows, step):
+            cv2.remap(stacked[start:start + step], map_x[start:start + step], map_y[start:start + step],
+                      cv2.INTER_LINEAR, dst=warped[start:start + step], borderMode=border)
+
+    def _copy(self, stacked, flip, dx, dy):
+        # whole pixel shifts: bilinear remap would copy the pixels unchanged
+        rows, cols = self.shape[1:3]
+        for i in range(len(flip)):
+            src = stacked[i * rows:(i + 1) * rows]
+            dst = self.warped[i * rows:(i + 1) * rows]
+            x, y = int(dx[i]), 0 if dy is None else int(dy[i])
+            if flip[i]:
+                # mirrored source pixel cols - 1 - (x - dx) reads at x + dx
+                src, x = src[:, ::-1], -x
+            x0, x1, y0, y1 = max(x, 0), min(cols, cols + x), max(y, 0), min(rows, rows + y)
+            dst[y0:y1, x0:x1] = src[y0 - y:y1 - y, x0 - x:x1 - x]
+            if self.replicate:
+                dst[y0:y1, :x0] = dst[y0:y1, x0:x0 + 1]
+                dst[y0:y1, x1:] = dst[y0:y1, x1 - 1:x1]
+                dst[:y0] = dst[y0:y0 + 1]
+                dst[y1:] = dst[y1 - 1:y1]
+            else:
+                dst[:y0] = 0
+                dst[y1:] = 0
+                dst[y0:y1, :x0] = 0
+                dst[y0:y1, x1:] = 0
+
+    def __call__(self, images, steering, out=None, rng=None):
+        """
+        Returns (augmented images, steering). out may be images for in-place,
+        rng replaces the augmenter's own RandomState for this batch.
+        """
+        rng = self.rng if rng is None else rng
+        n, rows, cols = images.shape[:3]
+        if self.shape != images.shape:
+            self._prepare(images.shape)
+        steering = np.asarray(steering, dtype=np.float64)
+
+        # flip and translation, steering follows the camera pixel shift
+        shift = rng.randint(-self.max_shift, self.max_shift + 1, n)
+        steering = steering + shift * (self.max_ang / self.max_shift)
+        if self.clip_steering:
+            steering = np.clip(steering, -1, 1)
+        flip = rng.rand(n) < self.p_flip
+        steering = np.where(flip, -steering, steering)
+        dx = shift * self.shift_scale
+        dy = None
+        if self.max_vshift:
+            dy = rng.randint(-self.max_vshift, self.max_vshift + 1, n) * self.vshift_scale
+
+        stacked = images.reshape((n * rows, cols) + images.shape[3:])
+        if stacked.ndim == 3 and stacked.shape[2] == 1:
+            stacked = stacked[:, :, 0]
+        whole = np.all(dx == np.round(dx)) and np.all(np.abs(dx) < cols)
+        if dy is not None:
+            whole = whole and np.all(dy == np.round(dy)) and np.all(np.abs(dy) < rows)
+        if whole:
+            self._copy(stacked, flip, dx, dy)
+        else:
+            self._remap(stacked, flip, dx, dy)
+        warped = self.warped
+
+        # brightness per image, shadow as a per-pixel gain on the shadowed images only
+        bright = np.where(rng.rand(n) < self.p_bright, rng.uniform(*self.brightness, size=n), 1.)
+        shadow = np.zeros(n, dtype=bool)
+        if self.p_shadow:
+            shadow = rng.rand(n) < self.p_shadow
+            side = np.where(rng.rand(n) < 0.5, -1., 1.)
+            top_x, bottom_x = rng.randint(0, cols, (2, n))
+            alpha = rng.uniform(*self.shadow_alpha, size=n)
+            # left side is x <= edge, right side x >= edge
+            for i in np.flatnonzero(shadow):
+                edge = (top_x[i] + (bottom_x[i] - top_x[i]) * (self.y / rows)).astype(np.float32)
+                inside = (self.x[None, :] - edge[:, None]) * np.float32(side[i]) >= 0
+                gain = np.float32(bright[i]) - inside * np.float32(bright[i] * alpha[i])
+                image = warped[i * rows:(i + 1) * rows]
+                if image.ndim == 3:
+                    gain = cv2.merge([gain] * image.shape[2])
+                cv2.multiply(image, gain, dst=image, dtype=cv2.CV_8U)
+        for i in np.flatnonzero((bright != 1) & ~shadow):
+            image = warped[i * rows:(i + 1) * rows]
+            cv2.convertScaleAbs(image, dst=image, alpha=bright[i])
+        result = warped
+
+        if self.noise:
+            noisy = result + rng.normal(0, self.noise, result.shape)
+            result = np.clip(noisy + 0.5, 0, 255).astype(np.uint8)
+        if self.steer_noise:
+            steering = steering + rng.normal(0, self.steer_noise, n)
+
+        if out is None:
+            out = np.empty(images.shape, dtype=np.uint8)
+        out.reshape(result.shape)[...] = result
+        return out, steering
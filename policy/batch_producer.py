@@ -0,0 +1,143 @@
+import multiprocessing as mp
+import queue
+import time
+import traceback
+
+import numpy as np
+
+#
+# Background batch production for fit_generator: worker processes load and
+# augment batches straight into a ring of shared-memory buffers, the trainer
+# only waits when no finished batch is ready.
+#
+# Batch j is always made with a RandomState seeded with (seed, j), and the
+# global np.random is seeded the same way for code that uses it, so the
+# sequence of batches only depends on the seed, not on the number of workers
+# or their timing. Batches are handed out in order.
+#
+
+# seconds between checks that the workers are still alive
+POLL_INTERVAL = 1.
+
+
+def _worker(make_batch, images, steering, shape, n_buffers, tasks, done):
+    images = np.frombuffer(images, dtype=np.uint8).reshape((n_buffers,) + shape)
+    steering = np.frombuffer(steering, dtype=np.float64).reshape(n_buffers, shape[0])
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        j, slot, seed = task
+        try:
+            np.random.seed([seed, j])
+            make_batch(images[slot], steering[slot], np.random.RandomState([seed, j]))
+        except Exception:
+            done.put((j, slot, traceback.format_exc()))
+            break
+        done.put((j, slot, None))
+
+
+class BatchProducer:
+    """
+    Iterator of (images, steering) batches made by worker processes.
+
+    make_batch(images, steering, rng) fills one uint8 batch of `shape` and its
+    steering angles in place; it is sent to every worker once, so it has to
+    be picklable with the spawn start method. n_buffers shared buffers form
+    the ring, a buffer goes back to the workers only after the trainer has
+    moved on. With copy set every batch is copied out of shared memory,
+    which is safe with consumers that queue batches ahead (Keras'
+    fit_generator does). Without it a batch is a view that stays valid until
+    the next batch is requested.
+
+    wait_time accumulates the time the trainer spent waiting for batches.
+    """
+
+    def __init__(self, make_batch, shape, workers=2, n_buffers=None, seed=0, copy=True):
+        self.shape = tuple(shape)
+        self.n_buffers = n_buffers or 2 * workers + 1
+        self.seed = seed
+        self.copy = copy
+        batch_bytes = int(np.prod(self.shape))
+        self.shared_images = mp.RawArray('B', self.n_buffers * batch_bytes)
+        self.shared_steering = mp.RawArray('d', self.n_buffers * self.shape[0])
+        self.images = np.frombuffer(self.shared_images, dtype=np.uint8).reshape((self.n_buffers,) + self.shape)
+        self.steering = np.frombuffer(self.shared_steering, dtype=np.float64).reshape(self.n_buffers, self.shape[0])
+
+        self.tasks = mp.Queue()
+        self.done = mp.Queue()
+        self.workers = [mp.Process(target=_worker,
+                                   args=(make_batch, self.shared_images, self.shared_steering, self.shape,
+                                         self.n_buffers, self.tasks, self.done))
+                        for i in range(workers)]
+        for w in self.workers:
+            w.daemon = True
+            w.start()
+
+        # every buffer starts out filling, batch j in slot j
+        self.scheduled = 0
+        for slot in range(self.n_buffers):
+            self._schedule(slot)
+        self.next_batch = 0
+        self.finished = {}
+        self.held = None
+        self.wait_time = 0.
+        self.batches = 0
+
+    def _schedule(self, slot):
+        self.tasks.put((self.scheduled, slot, self.seed))
+        self.scheduled += 1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.held is not None:
+            # the trainer is done with the previous view
+            self._schedule(self.held)
+            self.held = None
+
+        start = time.time()
+        while self.next_batch not in self.finished:
+            try:
+                j, slot, error = self.done.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                # errors in make_batch are reported, a killed worker is not
+                for w in self.workers:
+                    if w.exitcode not in (None, 0):
+                        self.close()
+                        raise RuntimeError('batch worker died with exit code {}'.format(w.exitcode))
+                continue
+            if error is not None:
+                self.close()
+                raise RuntimeError('batch worker failed:\n' + error)
+            self.finished[j] = slot
+        self.wait_time += time.time() - start
+
+        slot = self.finished.pop(self.next_batch)
+        self.next_batch += 1
+        self.batches += 1
+        if self.copy:
+            batch = self.images[slot].copy(), self.steering[slot].copy()
+            self._schedule(slot)
+        else:
+            batch = self.images[slot], self.steering[slot]
+            self.held = slot
+        return batch
+
+    next = __next__
+
+    def close(self):
+        for w in self.workers:
+            self.tasks.put(None)
+        for w in self.workers:
+            w.join(1)
+            if w.is_alive():
+                w.terminate()
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
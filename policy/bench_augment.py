@@ -0,0 +1,95 @@
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import util
+import proc_data
+from batch_augment import BatchAugmenter
+from image_cache import imread
+from bench_image_cache import synthetic_recording
+
+# Per-image augmentation loops of util.py / proc_data.py against
+# BatchAugmenter: throughput in images/second, and statistics of the
+# augmented steering and pixels to check both draw from the same
+# distribution.
+
+
+def util_loop(images, steering, shadow=False, scale=1.):
+    out = np.empty_like(images)
+    steer_out = np.empty(len(images))
+    for i in range(len(images)):
+        image, steer = util.shift_img(images[i], steering[i], scale)
+        image, steer = util.flip_img(image, steer)
+        image = util.brightness_img(image)
+        if shadow:
+            image = util.generate_shadow(image)
+        out[i], steer_out[i] = image, steer
+    return out, steer_out
+
+
+def proc_data_loop(images, steering):
+    out = np.empty_like(images)
+    steer_out = np.empty(len(images))
+    for i in range(len(images)):
+        image = proc_data.random_brightness(images[i])
+        image, steer = proc_data.random_horz_flip(image, steering[i])
+        out[i], steer_out[i] = proc_data.random_translate(image, steer)
+    return out, steer_out
+
+
+def rate(augment, images, steering, repeat):
+    augment(images, steering)
+    start = time.time()
+    for r in range(repeat):
+        augment(images, steering)
+    return repeat * len(images) / (time.time() - start)
+
+
+def stats(augment, images, steering, repeat):
+    steer, pixels, black = [], [], []
+    for r in range(repeat):
+        out, s = augment(images, steering)
+        steer.append(s)
+        pixels.append(out.reshape(len(out), -1).mean(axis=1))
+        black.append((out.max(axis=3) == 0).mean(axis=(1, 2)))
+    steer, pixels, black = np.concatenate(steer), np.concatenate(pixels), np.concatenate(black)
+    return 'steer {:6.3f} +- {:5.3f}  pixel {:6.1f} +- {:5.1f}  border {:5.3f}'.format(
+        steer.mean(), steer.std(), pixels.mean(), pixels.std(), black.mean())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch augmentation benchmark')
+    parser.add_argument('--batch-size', type=int, default=250)
+    parser.add_argument('--repeat', type=int, default=10, help='Batches timed per variant.')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        csv_path = synthetic_recording(folder, args.batch_size)
+        cache = util.load_cache(csv_path)[0]
+        frames = np.array([imread(p) for p in cache.paths[:, 0]])
+        crops = np.array(cache.images[:, 0])
+        steering = np.full(args.batch_size, 0.1)
+    finally:
+        shutil.rmtree(folder)
+
+    scale = util.Cols / 319.
+    variants = [
+        ('util 64x64', crops,
+         lambda x, s: util_loop(x, s, scale=scale), BatchAugmenter(shift_scale=scale)),
+        ('util 64x64 + shadow', crops,
+         lambda x, s: util_loop(x, s, True, scale), BatchAugmenter(shift_scale=scale, p_shadow=0.5)),
+        ('util 160x320', frames, util_loop, BatchAugmenter()),
+        ('proc_data 160x320', frames, proc_data_loop,
+         BatchAugmenter(max_shift=30, max_ang=30 * 0.004, max_vshift=5, brightness=(0.25, 1.25),
+                        p_bright=1., clip_steering=False, replicate=True)),
+    ]
+    for name, images, loop, augmenter in variants:
+        print(name)
+        print('  loop  {:8.0f} img/s  {}'.format(rate(loop, images, steering, args.repeat),
+                                                 stats(loop, images, steering, args.repeat)))
+        print('  batch {:8.0f} img/s  {}'.format(rate(augmenter, images, steering, args.repeat),
+                                                 stats(augmenter, images, steering, args.repeat)))
@@ -0,0 +1,83 @@
+import argparse
+import shutil
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+
+import util
+from batch_producer import BatchProducer
+from image_cache import read_driving_log
+from bench_image_cache import synthetic_recording
+
+# Trainer stall time per epoch, i.e. time spent waiting in next() for a
+# batch, for the in-thread generators of util.py and for BatchProducer.
+# The training step itself is simulated by sleeping, like a GPU step that
+# leaves the CPU to the data pipeline.
+
+
+def stall_per_epoch(generator, epochs, steps, step_time):
+    stalls = []
+    next(generator)
+    for e in range(epochs):
+        stall = 0.
+        for s in range(steps):
+            start = time.time()
+            next(generator)
+            stall += time.time() - start
+            time.sleep(step_time)
+        stalls.append(stall)
+    return stalls
+
+
+def digest(producer, n):
+    return [hash(next(producer)[0].tobytes()) for i in range(n)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch producer benchmark')
+    parser.add_argument('--rows', type=int, default=1000, help='Rows of the synthetic driving_log.csv.')
+    parser.add_argument('--batch-size', type=int, default=250)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--steps', type=int, default=20, help='Batches per epoch.')
+    parser.add_argument('--step-ms', type=float, default=100., help='Simulated training step.')
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        csv_path = synthetic_recording(folder, args.rows)
+        paths, values = read_driving_log(csv_path)
+        center, left, right = list(paths[:, 0]), list(paths[:, 1]), list(paths[:, 2])
+        steer = list(values[:, 0])
+        cache = util.load_cache(csv_path)[0]
+        rows = np.arange(len(cache))
+        shape = (args.batch_size, util.Rows, util.Cols, 3)
+        fill_jpeg = partial(util.fill_train_batch, center, left, right, steer)
+        fill_cached = partial(util.fill_train_batch_cached, cache, rows, util.cache_augmenter())
+
+        variants = [
+            ('generate_train_batch', lambda: util.generate_train_batch(center, left, right, steer, args.batch_size)),
+            ('generate_train_batch_cached', lambda: util.generate_train_batch_cached(cache, rows, args.batch_size)),
+            ('BatchProducer jpeg', lambda: BatchProducer(fill_jpeg, shape, args.workers)),
+            ('BatchProducer cached', lambda: BatchProducer(fill_cached, shape, args.workers)),
+        ]
+        step_time = args.step_ms / 1000.
+        print('{} epochs of {} steps, {:.0f} ms per step, {} workers'.format(
+            args.epochs, args.steps, args.step_ms, args.workers))
+        for name, make in variants:
+            generator = make()
+            stalls = stall_per_epoch(generator, args.epochs, args.steps, step_time)
+            if isinstance(generator, BatchProducer):
+                generator.close()
+            print('{:>28}: stall per epoch {}'.format(name, '  '.join('{:6.2f} s'.format(s) for s in stalls)))
+
+        # same seed, same batches, whatever the number of workers
+        runs = []
+        for workers in (1, 3):
+            with BatchProducer(fill_cached, shape, workers, seed=7) as producer:
+                runs.append(digest(producer, 8))
+        print('deterministic across worker counts:', runs[0] == runs[1])
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,124 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+import data_prep
+import transforms
+
+# prep_data of data_prep.py against the list based version it replaced:
+# time and peak numpy memory (tracemalloc) on a synthetic trainx/trainy.npy,
+# and a check that the batch transforms match the per-image ones.
+
+
+def legacy_balance_data(x, y):
+    random_transforms = [transforms.brightness, transforms.noise, transforms.shift]
+    bins = np.arange(-1, 1.01, 0.1)
+    angles_hist, _ = np.histogram(y, bins)
+    max_bin = max(angles_hist)
+    for steer_bin in range(len(angles_hist)):
+        bin_num = angles_hist[steer_bin]
+        if 0 < bin_num < max_bin:
+            lower_bound = bins[steer_bin]
+            upper_bound = bins[steer_bin + 1]
+            bin_indexes = np.where((y >= lower_bound) & (y <= upper_bound))[0]
+            x_bin, y_bin = [], []
+            for i in range(max_bin-bin_num):
+                bin_img_index = np.random.choice(bin_indexes)
+                transform = np.random.choice(random_transforms)
+                new_bin_x, new_bin_y = transform(x[bin_img_index], y[bin_img_index])
+                x_bin.append(new_bin_x)
+                y_bin.append(new_bin_y)
+            x = np.concatenate((x, x_bin))
+            y = np.concatenate((y, y_bin))
+    return x, y
+
+
+def legacy_augment_data(x_train, y_train):
+    x_aug, y_aug = [], []
+    for img, angle in zip(x_train, y_train):
+        img_blur, angle_blur = transforms.blur(img, angle)
+        img_gray, angle_gray = transforms.gray(img, angle)
+        img_mirror, angle_mirror = transforms.mirror(img, angle)
+        x_aug.extend([img_blur, img_gray, img_mirror])
+        y_aug.extend([angle_blur, angle_gray, angle_mirror])
+    x_train = np.concatenate((x_train, x_aug))
+    y_train = np.concatenate((y_train, y_aug))
+    return x_train, y_train
+
+
+def legacy_prep_data(trainx_data, trainy_data):
+    x_train, y_train = data_prep.load_data(trainx_data, trainy_data)
+    x_train = np.array([cv2.resize(img, (data_prep.new_width, data_prep.new_height),
+                                   interpolation=cv2.INTER_AREA) for img in x_train])
+    x_train, x_validation, y_train, y_validation = train_test_split(x_train, y_train, test_size=0.2)
+    x_train, y_train = legacy_augment_data(x_train, y_train)
+    x_train, y_train = legacy_balance_data(x_train, y_train)
+    return x_train, x_validation, y_train, y_validation
+
+
+def measure(prep, *args):
+    tracemalloc.start()
+    start = time.time()
+    result = prep(*args)
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def check_transforms(size=64, n=64):
+    rng = np.random.RandomState(0)
+    imgs = rng.randint(0, 256, (n, size, size, 3)).astype(np.uint8)
+    angles = rng.uniform(-1, 1, n)
+    pairs = [(transforms.mirror, transforms.mirror_batch), (transforms.blur, transforms.blur_batch),
+             (transforms.gray, transforms.gray_batch)]
+    for single, batch in pairs:
+        expected = [single(img, angle) for img, angle in zip(imgs, angles)]
+        out, out_angles = batch(imgs, angles)
+        same = np.array_equal(out, [e[0] for e in expected]) and np.allclose(out_angles, [e[1] for e in expected])
+        print('{:>16} matches {}: {}'.format(batch.__name__, single.__name__, same))
+    # a shifted image is warpAffine's shift by the angle offset and some vertical shift
+    out, out_angles = transforms.shift_batch(imgs, angles, rng=rng)
+    dx = np.rint((out_angles - angles) / 0.005)
+    ok = all(any(np.array_equal(out[i], cv2.warpAffine(imgs[i], np.float32([[1, 0, dx[i]], [0, 1, dy]]), (size, size)))
+                 for dy in range(-16, 17)) for i in range(n))
+    print('{:>16} matches {}: {}'.format('shift_batch', 'shift', ok))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='data_prep benchmark')
+    parser.add_argument('--images', type=int, default=3000)
+    args = parser.parse_args()
+
+    check_transforms()
+    folder = tempfile.mkdtemp()
+    try:
+        rng = np.random.RandomState(0)
+        x_path, y_path = os.path.join(folder, 'trainx.npy'), os.path.join(folder, 'trainy.npy')
+        x = np.lib.format.open_memmap(x_path, mode='w+', dtype=np.uint8,
+                                      shape=(args.images, data_prep.height, data_prep.width, data_prep.depth))
+        for start in range(0, args.images, 500):
+            x[start:start + 500] = rng.randint(0, 256, (1, data_prep.height, data_prep.width, data_prep.depth))
+        del x
+        # mostly straight driving like the recordings
+        steering = np.where(rng.rand(args.images) < 0.6, 0., rng.normal(0, 0.3, args.images))
+        np.save(y_path, np.clip(steering, -1, 1))
+
+        print('{} images of {}x{}'.format(args.images, data_prep.width, data_prep.height))
+        for name, prep in (('legacy prep_data', legacy_prep_data), ('prep_data', data_prep.prep_data)):
+            np.random.seed(0)
+            t, peak, (x_train, x_valid, y_train, y_valid) = measure(prep, x_path, y_path)
+            print('{:>17}: {:6.2f} s  peak {:6.0f} MB  train {} ({:.0f} MB)  validation {}'.format(
+                name, t, peak / 2. ** 20, len(x_train), x_train.nbytes / 2. ** 20, len(x_valid)))
+            hist = np.histogram(y_train, np.arange(-1, 1.01, 0.1))[0]
+            print('{:>17}  filled bins {} of {}, min {} max {}'.format(
+                '', (hist > 0).sum(), len(hist), hist[hist > 0].min(), hist.max()))
+            del x_train, x_valid
+    finally:
+        shutil.rmtree(folder)
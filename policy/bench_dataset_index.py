@@ -0,0 +1,91 @@
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_index import DatasetIndex
+
+# Metadata load time of driving_log.csv recordings: csv.DictReader and
+# pandas (what util.load_csv / proc_data.load_data do) against opening the
+# columnar DatasetIndex, plus the cost of appending one new session.
+
+
+def synthetic_session(folder, n_rows, seed):
+    rng = np.random.RandomState(seed)
+    os.makedirs(folder)
+    steering = np.where(rng.rand(n_rows) < 0.5, 0., rng.normal(0, 0.3, n_rows))
+    with open(os.path.join(folder, 'driving_log.csv'), 'w') as f:
+        f.write('center,left,right,steering,throttle,brake,speed\n')
+        for i in range(n_rows):
+            stamp = '2017_03_{:02d}_{:08d}'.format(seed, i)
+            f.write('IMG/center_{0}.jpg, IMG/left_{0}.jpg, IMG/right_{0}.jpg,{1:.6f},0.5,0,30.1\n'.format(
+                stamp, steering[i]))
+
+
+def timed(f):
+    start = time.time()
+    result = f()
+    return time.time() - start, result
+
+
+def dictreader(folders):
+    rows = 0
+    for folder in folders:
+        with open(os.path.join(folder, 'driving_log.csv')) as f:
+            for row in csv.DictReader(f):
+                float(row['steering'])
+                rows += 1
+    return rows
+
+
+def pandas(folders):
+    return sum(len(pd.read_csv(os.path.join(folder, 'driving_log.csv'))) for folder in folders)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dataset index benchmark')
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--rows', type=int, default=100000, help='Rows per session.')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        folders = [os.path.join(root, 'run{}'.format(i)) for i in range(args.sessions + 1)]
+        for i, folder in enumerate(folders):
+            synthetic_session(folder, args.rows, i)
+        old, new = folders[:-1], folders[-1]
+        total = args.sessions * args.rows
+        index_path = os.path.join(root, 'index')
+
+        t, n = timed(lambda: dictreader(old))
+        print('csv.DictReader           {:7.2f} s  {} rows'.format(t, n))
+        t, n = timed(lambda: pandas(old))
+        print('pandas.read_csv          {:7.2f} s  {} rows'.format(t, n))
+        t, n = timed(lambda: DatasetIndex(index_path).update(old))
+        print('index build              {:7.2f} s  {} rows'.format(t, n))
+        t, n = timed(lambda: DatasetIndex(index_path).update(old))
+        print('index update, no change  {:7.3f} s  {} rows added'.format(t, n))
+        t, n = timed(lambda: DatasetIndex(index_path).add(new))
+        print('append one session       {:7.2f} s  {} rows added'.format(t, n))
+
+        t, index = timed(lambda: DatasetIndex(index_path))
+        print('open index               {:7.4f} s  {} rows'.format(t, len(index)))
+        t, s = timed(lambda: float(index.steering.mean()))
+        print('mean steering            {:7.4f} s'.format(t))
+        t, rows = timed(lambda: index.sample_balanced(250))
+        print('balanced batch of 250    {:7.4f} s'.format(t))
+        t, paths = timed(lambda: index.paths(rows))
+        print('paths of the batch       {:7.4f} s  {}'.format(t, os.path.relpath(paths[0], root)))
+        counts = np.bincount(index.bin_of(index.steering[index.sample_balanced(100000)]),
+                             minlength=len(index.bin_counts))
+        filled = index.bin_counts > 0
+        print('balanced sample per bin: min {} max {} over {} bins'.format(
+            counts[filled].min(), counts[filled].max(), filled.sum()))
+        assert len(index) == total + args.rows
+    finally:
+        shutil.rmtree(root)
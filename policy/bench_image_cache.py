@@ -0,0 +1,91 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import cv2
+
+import util
+import proc_data
+from image_cache import read_driving_log, CENTER
+
+# Batch generators reading JPEGs per sample vs. gathering from the image
+# cache, on a synthetic recording written to a temporary folder.
+
+
+def synthetic_recording(folder, n_rows, seed=0):
+    rng = np.random.RandomState(seed)
+    os.makedirs(os.path.join(folder, 'IMG'))
+    frame = np.empty((160, 320, 3), dtype=np.uint8)
+    lines = ['center,left,right,steering,throttle,brake,speed']
+    for i in range(n_rows):
+        names = []
+        for cam in ('center', 'left', 'right'):
+            frame[:70] = (230, 180, 135)
+            frame[70:] = (90, 90, 90)
+            cv2.line(frame, (rng.randint(0, 320), 70), (rng.randint(0, 320), 160), (255, 255, 255), 3)
+            frame += rng.randint(0, 20, frame.shape).astype(np.uint8)
+            name = 'IMG/{}_{:05d}.jpg'.format(cam, i)
+            cv2.imwrite(os.path.join(folder, name), frame)
+            names.append(name)
+        steering = rng.uniform(-0.5, 0.5) if rng.rand() < 0.5 else 0.
+        lines.append('{},{},{},{},0.5,0,20'.format(names[0], names[1], names[2], steering))
+    csv_path = os.path.join(folder, 'driving_log.csv')
+    with open(csv_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return csv_path
+
+
+def rate(generator, n_batches, batch_size):
+    next(generator)
+    start = time.time()
+    for i in range(n_batches):
+        next(generator)
+    return n_batches * batch_size / (time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Image cache benchmark')
+    parser.add_argument('--rows', type=int, default=2000, help='Rows of the synthetic driving_log.csv.')
+    parser.add_argument('--batches', type=int, default=20, help='Batches timed per generator.')
+    parser.add_argument('--batch-size', type=int, default=250)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        csv_path = synthetic_recording(folder, args.rows)
+        paths, values = read_driving_log(csv_path)
+        rows = np.arange(len(paths))
+
+        start = time.time()
+        cache = util.load_cache(csv_path)[0]
+        print('util cache build      {:8.2f} s for {} images'.format(time.time() - start, paths.size))
+        start = time.time()
+        cache_proc = proc_data.load_cache(csv_path, folder)
+        print('proc_data cache build {:8.2f} s'.format(time.time() - start))
+
+        legacy = util.generate_train_batch(list(paths[:, 0]), list(paths[:, 1]), list(paths[:, 2]),
+                                           list(values[:, 0]), args.batch_size)
+        cached = util.generate_train_batch_cached(cache, rows, args.batch_size)
+        print('util.generate_train_batch        {:8.0f} img/s'.format(rate(legacy, args.batches, args.batch_size)))
+        print('util.generate_train_batch_cached {:8.0f} img/s'.format(rate(cached, args.batches, args.batch_size)))
+
+        data = np.empty((len(paths), 5), dtype=object)
+        data[:, :3] = paths
+        data[:, 3:] = values[:, :2]
+        legacy = proc_data.generate_train_data_batch(data, args.batch_size)
+        cached = proc_data.generate_train_data_batch(rows, args.batch_size, cache=cache_proc)
+        print('proc_data.generate_batch         {:8.0f} img/s'.format(rate(legacy, args.batches, args.batch_size)))
+        print('proc_data.generate_batch cached  {:8.0f} img/s'.format(rate(cached, args.batches, args.batch_size)))
+
+        out = np.empty((args.batch_size,) + cache.images.shape[2:], dtype=np.uint8)
+        cams = np.full(args.batch_size, CENTER)
+        start = time.time()
+        for i in range(args.batches):
+            cache.gather(np.random.randint(0, len(cache), args.batch_size), cams, out)
+        print('ImageCache.gather only           {:8.0f} img/s'.format(
+            args.batches * args.batch_size / (time.time() - start)))
+    finally:
+        shutil.rmtree(folder)
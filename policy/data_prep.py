@@ -9,56 +9,113 @@ depth = 3
 new_width = 64
 new_height = 64
 
+# images transformed per OpenCV call, bounds the temporary copies
+chunk_size = 1024
 
-def balance_data(x, y):
-    random_transforms = [transforms.brightness, transforms.noise, transforms.shift]
+
+def balance_plan(y, rng=np.random):
+    """
+    Oversampling of every steering bin up to the fullest one: (source index,
+    transform number) of every new sample, grouped by transform.
+    """
     bins = np.arange(-1, 1.01, 0.1)
     angles_hist, _ = np.histogram(y, bins)
     max_bin = max(angles_hist)
+    sources = []
     for steer_bin in range(len(angles_hist)):
         bin_num = angles_hist[steer_bin]
         if 0 < bin_num < max_bin:
             lower_bound = bins[steer_bin]
             upper_bound = bins[steer_bin + 1]
             bin_indexes = np.where((y >= lower_bound) & (y <= upper_bound))[0]
-            x_bin, y_bin = [], []
-            for i in range(max_bin-bin_num):
-                bin_img_index = np.random.choice(bin_indexes)
-                transform = np.random.choice(random_transforms)
-                new_bin_x, new_bin_y = transform(x[bin_img_index], y[bin_img_index])
-                x_bin.append(new_bin_x)
-                y_bin.append(new_bin_y)
-            x = np.concatenate((x, x_bin))
-            y = np.concatenate((y, y_bin))
-    return x, y
-
-
-def load_data():
-    trainx_data = '../udacity-data/trainx.npy'
-    trainy_data = '../udacity-data/trainy.npy'
-    with open(trainx_data, 'rb') as fx, open(trainy_data, 'rb') as fy:
-        x_train = np.load(fx)
-        y_train = np.load(fy)
-    return x_train, y_train
+            sources.append(rng.choice(bin_indexes, max_bin - bin_num))
+    sources = np.concatenate(sources) if sources else np.zeros(0, dtype=np.int64)
+    transform = rng.randint(3, size=len(sources))
+    order = np.argsort(transform, kind='stable')
+    return sources[order], transform[order]
+
 
+def balance_data(x, y, out=None, plan=None, rng=np.random):
+    """
+    Appends the oversampled images of plan (default balance_plan(y)) to x.
+    out, if given, holds at least len(x) + len(plan[0]) images and may start
+    with x itself, so the balanced set is written without concatenating.
+    """
+    random_transforms = [transforms.brightness_batch, transforms.noise_batch, transforms.shift_batch]
+    if plan is None:
+        plan = balance_plan(y, rng)
+    sources, transform = plan
+    n, total = len(x), len(x) + len(sources)
+    if out is None:
+        out = np.empty((total,) + x.shape[1:], dtype=x.dtype)
+    out = out[:total]
+    if not np.shares_memory(out, x):
+        out[:n] = x
+    y_out = np.empty(total, dtype=np.result_type(y, np.float64))
+    y_out[:n] = y
+    for t, random_transform in enumerate(random_transforms):
+        group = np.flatnonzero(transform == t)
+        for start in range(0, len(group), chunk_size):
+            chunk = group[start:start + chunk_size]
+            rows = sources[chunk]
+            dst = slice(n + chunk[0], n + chunk[-1] + 1)
+            _, y_out[dst] = random_transform(x[rows], y[rows], out=out[dst], rng=rng)
+    return out, y_out
 
-def augment_data(x_train, y_train):
-    x_aug, y_aug = [], []
-    for img, angle in zip(x_train, y_train):
-        img_blur, angle_blur = transforms.blur(img, angle)
-        img_gray, angle_gray = transforms.gray(img, angle)
-        img_mirror, angle_mirror = transforms.mirror(img, angle)
-        x_aug.extend([img_blur, img_gray, img_mirror])
-        y_aug.extend([angle_blur, angle_gray, angle_mirror])
-    x_train = np.concatenate((x_train, x_aug))
-    y_train = np.concatenate((y_train, y_aug))
+
+def load_data(trainx_data='../udacity-data/trainx.npy', trainy_data='../udacity-data/trainy.npy',
+              mmap_mode=None):
+    x_train = np.load(trainx_data, mmap_mode=mmap_mode)
+    y_train = np.load(trainy_data)
     return x_train, y_train
 
 
-def prep_data():
-    x_train, y_train = load_data()
-    x_train = np.array([cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA) for img in x_train])
-    x_train, x_validation, y_train, y_validation = train_test_split(x_train, y_train, test_size=0.2)
-    x_train, y_train = augment_data(x_train, y_train)
-    x_train, y_train = balance_data(x_train, y_train)
-    return x_train, x_validation, y_train, y_validation
+def augment_labels(y_train):
+    """Steering of augment_data's output, without the images."""
+    return np.concatenate((y_train, y_train, y_train, -y_train))
+
+
+def augment_data(x_train, y_train, out=None):
+    """
+    Appends a blurred, a grayed and a mirrored copy of every image, as three
+    blocks after x_train. out, if given, holds at least 4 * len(x_train)
+    images and may start with x_train itself.
+    """
+    n = len(x_train)
+    if out is None:
+        out = np.empty((4 * n,) + x_train.shape[1:], dtype=x_train.dtype)
+    out = out[:4 * n]
+    if not np.shares_memory(out, x_train):
+        out[:n] = x_train
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        x, y = out[start:end], y_train[start:end]
+        transforms.blur_batch(x, y, out=out[n + start:n + end])
+        transforms.gray_batch(x, y, out=out[2 * n + start:2 * n + end])
+        transforms.mirror_batch(x, y, out=out[3 * n + start:3 * n + end])
+    return out, augment_labels(y_train)
+
+
+def resize_data(x, rows, out=None):
+    """x[rows] resized to new_width x new_height, one image read at a time."""
+    if out is None:
+        out = np.empty((len(rows), new_height, new_width, depth), dtype=x.dtype)
+    for i, row in enumerate(rows):
+        cv2.resize(x[row], (new_width, new_height), dst=out[i], interpolation=cv2.INTER_AREA)
+    return out
+
+
+def prep_data(trainx_data='../udacity-data/trainx.npy', trainy_data='../udacity-data/trainy.npy'):
+    # the full resolution images stay on disk, everything after the resize
+    # lives in one array sized up front for augmentation and balancing
+    x_full, y_full = load_data(trainx_data, trainy_data, mmap_mode='r')
+    train, validation = train_test_split(np.arange(len(y_full)), test_size=0.2)
+    n = len(train)
+    y_train = augment_labels(y_full[train])
+    plan = balance_plan(y_train)
+    x_train = np.empty((4 * n + len(plan[0]), new_height, new_width, depth), dtype=x_full.dtype)
+    resize_data(x_full, train, out=x_train[:n])
+    augment_data(x_train[:n], y_full[train], out=x_train)
+    x_train, y_train = balance_data(x_train[:4 * n], y_train, out=x_train, plan=plan)
+    x_validation = resize_data(x_full, validation)
+    return x_train, x_validation, y_train, y_full[validation]
@@ -0,0 +1,202 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from image_cache import read_columns, resolve_path, CENTER
+
+#
+# Columnar index over any number of recording folders (each with a
+# driving_log.csv and IMG/). Every column is a flat binary file that is
+# appended per recording session and memory-mapped on load, so opening the
+# index costs the same for a thousand frames or millions:
+#
+#   meta.json        sessions (folder, csv size/mtime, first row, rows),
+#                    steering bin edges and rows per bin
+#   steering.f32 throttle.f32 brake.f32 speed.f32
+#   session.i32      session number of every row
+#   paths.bin        utf-8 image paths as written in the csv, center/left/right
+#                    of every row, resolved against the session folder on access
+#   paths.i64        offsets into paths.bin, 3 per row plus the end
+#   bins-<rows>.i32  rows sorted by steering bin, for balanced sampling,
+#                    named by row count, meta.json names the current one
+#
+# meta.json is replaced last, rows past its row count are left overs of an
+# interrupted append and are cut off by the next one, the previous bins file
+# is deleted only once meta.json points at the new one.
+#
+
+COLUMNS = ('steering', 'throttle', 'brake', 'speed')
+
+
+class DatasetIndex:
+    """
+    Opens (or creates) the index in folder `path`.
+
+    add() and update() index new recording sessions, steering, throttle,
+    brake, speed and session are read-only memory-mapped columns, paths()
+    resolves image paths and sample_balanced() draws rows evenly over the
+    steering histogram.
+    """
+
+    def __init__(self, path, bin_edges=None):
+        self.path = path
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            if bin_edges is None:
+                bin_edges = np.linspace(-1, 1, 26)
+            self.meta = {'sessions': [], 'rows': 0, 'path_bytes': 0, 'bin_file': 'bins-0.i32',
+                         'bin_edges': [float(e) for e in bin_edges],
+                         'bin_counts': [0] * (len(bin_edges) - 1)}
+        self._map()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _column(self, name, dtype, count):
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode='r', shape=(count,))
+
+    def _map(self):
+        n = self.meta['rows']
+        for name in COLUMNS:
+            setattr(self, name, self._column(name + '.f32', np.float32, n))
+        self.session = self._column('session.i32', np.int32, n)
+        self.bin_order = self._column(self.meta.get('bin_file', 'bins.i32'), np.int32, n)
+        self.path_offsets = self._column('paths.i64', np.int64, 3 * n + 1 if n else 0)
+        self.path_blob = self._column('paths.bin', np.uint8, self.meta['path_bytes'])
+        self.bin_edges = np.array(self.meta['bin_edges'])
+        self.bin_counts = np.array(self.meta['bin_counts'], dtype=np.int64)
+        self.bin_start = np.concatenate(([0], np.cumsum(self.bin_counts)))
+
+    def __len__(self):
+        return self.meta['rows']
+
+    @property
+    def sessions(self):
+        return self.meta['sessions']
+
+    def _append(self, name, array, keep_bytes):
+        # cut left overs of an interrupted append, then append
+        with open(self._file(name), 'ab') as f:
+            f.truncate(keep_bytes)
+            f.write(np.ascontiguousarray(array).tobytes())
+
+    def add(self, folder, csv_name='driving_log.csv'):
+        """
+        Indexes one recording session, returns the number of rows added.
+        Sessions that are indexed already and unchanged are skipped.
+        """
+        folder = os.path.abspath(folder)
+        csv_path = os.path.join(folder, csv_name)
+        stat = os.stat(csv_path)
+        for session in self.sessions:
+            if session['folder'] == folder and session['csv'] == csv_name:
+                if session['csv_size'] == stat.st_size and session['csv_mtime'] == stat.st_mtime:
+                    return 0
+                raise ValueError('{} changed since it was indexed, rebuild the index'.format(csv_path))
+
+        paths, values = read_columns(csv_path)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        n, count = self.meta['rows'], len(paths)
+
+        for i, name in enumerate(COLUMNS):
+            self._append(name + '.f32', values[:, i].astype('<f4'), n * 4)
+        self._append('session.i32', np.full(count, len(self.sessions), dtype='<i4'), n * 4)
+
+        flat = paths.ravel()
+        blob = ''.join(flat).encode('utf-8')
+        lengths = pd.Series(flat).str.len().values.astype(np.int64)
+        if lengths.sum() != len(blob):
+            # non-ascii paths, count bytes instead of characters
+            lengths = np.array([len(p.encode('utf-8')) for p in flat], dtype=np.int64)
+        offsets = self.meta['path_bytes'] + np.cumsum(lengths)
+        if n == 0:
+            offsets = np.concatenate(([0], offsets))
+        self._append('paths.i64', offsets.astype('<i8'), (3 * n + 1) * 8 if n else 0)
+        self._append('paths.bin', np.frombuffer(blob, dtype=np.uint8), self.meta['path_bytes'])
+
+        # rows sorted by steering bin: all old rows keep their relative order
+        steering = np.concatenate((np.asarray(self.steering), values[:, 0]))
+        bins = self.bin_of(steering)
+        order = np.argsort(bins, kind='stable').astype('<i4')
+        old_bin_file = self.meta.get('bin_file', 'bins.i32')
+        bin_file = 'bins-{}.i32'.format(n + count)
+        tmp = self._file(bin_file + '.tmp')
+        order.tofile(tmp)
+        os.replace(tmp, self._file(bin_file))
+
+        self.meta['sessions'].append({'folder': folder, 'csv': csv_name, 'csv_size': stat.st_size,
+                                      'csv_mtime': stat.st_mtime, 'start': n, 'rows': count})
+        self.meta['rows'] = n + count
+        self.meta['path_bytes'] = int(offsets[-1])
+        self.meta['bin_counts'] = np.bincount(bins, minlength=len(self.bin_edges) - 1).tolist()
+        self.meta['bin_file'] = bin_file
+        tmp = self._file('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._file('meta.json'))
+        self._map()
+        if old_bin_file != bin_file and os.path.exists(self._file(old_bin_file)):
+            os.remove(self._file(old_bin_file))
+        return count
+
+    def update(self, folders, csv_name='driving_log.csv'):
+        """Indexes every folder not indexed yet, returns the number of rows added."""
+        return sum(self.add(folder, csv_name) for folder in folders)
+
+    def session_rows(self, folder, csv_name='driving_log.csv'):
+        """Rows of an indexed recording session."""
+        folder = os.path.abspath(folder)
+        for session in self.sessions:
+            if session['folder'] == folder and session['csv'] == csv_name:
+                return np.arange(session['start'], session['start'] + session['rows'])
+        raise KeyError(folder)
+
+    def bin_of(self, steering):
+        """Steering bin of every value, values outside the edges go to the outer bins."""
+        return np.clip(np.searchsorted(self.bin_edges, steering, side='right') - 1, 0, len(self.bin_counts) - 1)
+
+    def paths(self, rows, cam=CENTER):
+        """Image paths of camera cam (CENTER, LEFT, RIGHT) for rows."""
+        rows = np.asarray(rows)
+        starts = self.path_offsets[3 * rows + cam]
+        ends = self.path_offsets[3 * rows + cam + 1]
+        folders = [session['folder'] for session in self.sessions]
+        blob = self.path_blob
+        return [resolve_path(blob[s:e].tobytes().decode('utf-8'), folders[session])
+                for s, e, session in zip(starts, ends, self.session[rows])]
+
+    def rows_in_bin(self, b):
+        return self.bin_order[self.bin_start[b]:self.bin_start[b + 1]]
+
+    def sample_balanced(self, n, rng=np.random):
+        """n rows drawn with replacement, the same number from every non-empty steering bin."""
+        filled = np.flatnonzero(self.bin_counts)
+        bins = filled[rng.randint(len(filled), size=n)]
+        offsets = (rng.random_sample(n) * self.bin_counts[bins]).astype(np.int64)
+        return self.bin_order[self.bin_start[bins] + offsets]
+
+    def histogram(self):
+        """(counts, edges) of the steering column."""
+        return self.bin_counts, self.bin_edges
+
+    def driving_log(self, rows=None):
+        """
+        Rows as an object array in proc_data.load_data layout (center, left,
+        right, steering, throttle, brake, speed), for the existing generators.
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        data = np.empty((len(rows), 7), dtype=object)
+        for cam in range(3):
+            data[:, cam] = self.paths(rows, cam)
+        for i, name in enumerate(COLUMNS):
+            data[:, 3 + i] = getattr(self, name)[rows]
+        return data
@@ -25,7 +25,9 @@ from keras.models import load_model, model_from_json
 from keras.layers.normalization import BatchNormalization
 from keras import backend as K
 import gc
+from functools import partial
 from util import *
+from batch_producer import BatchProducer
 from keras.preprocessing.image import ImageDataGenerator# keras 数据批量生成
 def network_model():
     """
@@ -59,14 +61,27 @@ def network_model():
     model.summary()
     return model
 
-def main():
+def main(use_cache=True, workers=2, seed=0):
     batch_size = 250
     epoch = 10
     #csv_path = '../../datasets/run/driving_log.csv'
     csv_path = '../../../run1/driving_log.csv'
-    center_db,left_db,right_db,steer_db,img_valid,steer_valid=load_csv(csv_path)
-    train_generator = generate_train_batch(center_db, left_db, right_db, steer_db, batch_size)
-    image_val, steer_val = generate_valid(img_valid, steer_valid)
+    if use_cache:
+        # images cropped once into a memory-mapped cache, see image_cache.py
+        cache, rows, valid_rows = load_cache(csv_path)
+        fill_batch = partial(fill_train_batch_cached, cache, rows, cache_augmenter())
+        image_val, steer_val = generate_valid_cached(cache, valid_rows)
+    else:
+        center_db,left_db,right_db,steer_db,img_valid,steer_valid=load_csv(csv_path)
+        fill_batch = partial(fill_train_batch, center_db, left_db, right_db, steer_db)
+        image_val, steer_val = generate_valid(img_valid, steer_valid)
+    if workers:
+        # batches made by worker processes into shared memory, see batch_producer.py
+        train_generator = BatchProducer(fill_batch, (batch_size, Rows, Cols, 3), workers, seed=seed)
+    elif use_cache:
+        train_generator = generate_train_batch_cached(cache, rows, batch_size, seed)
+    else:
+        train_generator = generate_train_batch(center_db, left_db, right_db, steer_db, batch_size)
     model = network_model()
     adam = Adam(lr=1e-4, beta_1=0.9, beta_2=0.999, epsilon=1e-08, decay=0.0)
     model.compile(optimizer=adam, loss='mse')
@@ -85,6 +100,9 @@ def main():
                               #validation_data=(image_val, steer_val), verbose=1)
     history = model.fit_generator(train_generator, steps_per_epoch=200, nb_epoch=epoch,
                               validation_data=(image_val, steer_val), verbose=1)
+    if workers:
+        print('waited {:.1f} s for {} batches'.format(train_generator.wait_time, train_generator.batches))
+        train_generator.close()
     
     try:
         os.remove(model_json)
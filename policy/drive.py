@@ -12,6 +12,7 @@ import base64
 from datetime import datetime
 import os
 import shutil
+import socket
 import cv2
 import socketio
 import eventlet
@@ -23,10 +24,17 @@ from keras.models import model_from_json
 from keras.models import load_model
 import h5py
 from keras import __version__ as keras_version
+import sys
+
+# the telemetry format and the micro-batcher are shared with the Controller server
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Controller'))
+from telemetry import TelemetryDecoder
+from inference import MicroBatcher, keras_predict
 
 sio = socketio.Server()
 app = Flask(__name__)
 model = None
+batcher = None
 prev_image_array = None
 
 Rows, Cols = 64, 64
@@ -79,9 +87,18 @@ class SimplePIController:
 
 
 
-controller = SimplePIController(0.1, 0.002)
 set_speed = 9
-controller.set_desired(set_speed)
+# per connected car: PI controller and telemetry decoder (owns a frame buffer)
+sessions = {}
+
+
+def get_session(sid):
+    session = sessions.get(sid)
+    if session is None:
+        controller = SimplePIController(0.1, 0.002)
+        controller.set_desired(set_speed)
+        session = sessions[sid] = (controller, TelemetryDecoder())
+    return session
 
 
 @sio.on('telemetry')
@@ -100,12 +117,14 @@ def telemetry(sid, data):
         image_array = crop_img(image_pre)
         print('load img')
         #transformed_image_array = image_array[None, :, :, :]
-        steering_angle = float(model.predict(image_array[None, :, :, :], batch_size=1))
+        output, queue_latency, compute_latency = batcher.predict(image_array)
+        steering_angle = float(np.squeeze(output))
         # This model currently assumes that the features of the model are just the images. Feel free to change this.
         #steering_angle = 1.0*float(model.predict(transformed_image_array, batch_size=1))
         # The driving model currently just outputs a constant throttle. Feel free to edit this.
+        controller = get_session(sid)[0]
         throttle = controller.update(float(speed))
-        print('pre ok')
+        print('pre ok', '{:.1f}/{:.1f} ms'.format(queue_latency * 1e3, compute_latency * 1e3))
 
         # smoothing by using previous steering angles
         #steering.append(steering_angle)
@@ -121,7 +140,7 @@ def telemetry(sid, data):
         #throttle = 0.3
         print(steering_angle, throttle)
         #print("steering_angle : {:.3f}, throttle : {:.2f}".format(steering_angle, throttle))
-        send_control(steering_angle, throttle)
+        send_control(steering_angle, throttle, sid)
        
 
         # save frame
@@ -134,20 +153,52 @@ def telemetry(sid, data):
         sio.emit('manual', data={}, skip_sid=True)
 
 
+@sio.on('telemetry_bin')
+def telemetry_bin(sid, data):
+    # Binary telemetry: fixed header with speed, steering and throttle
+    # followed by a raw or JPEG frame, see Controller/telemetry.py
+    controller, decoder = get_session(sid)
+    image_pre, speed, steering_angle, throttle = decoder.decode(data)
+    image_array = crop_img(image_pre)
+    output, queue_latency, compute_latency = batcher.predict(image_array)
+    steering_angle = float(np.squeeze(output))
+    throttle = controller.update(speed)
+    send_control_bin(steering_angle, throttle, sid)
+
+    # save frame
+    if args.image_folder != '':
+        timestamp = datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')[:-3]
+        image_filename = os.path.join(args.image_folder, timestamp)
+        Image.fromarray(image_pre).save('{}.jpg'.format(image_filename))
+
+
 @sio.on('connect')
 def connect(sid, environ):
     print("connect ", sid)
-    send_control(0, 0)
+    send_control(0, 0, sid)
+
+
+@sio.on('disconnect')
+def disconnect(sid):
+    sessions.pop(sid, None)
 
 
-def send_control(steering_angle, throttle):
+def send_control(steering_angle, throttle, sid=None):
+    # with a sid only that car gets the reply
     sio.emit(
         "steer",
         data={
             'steering_angle': steering_angle.__str__(),
             'throttle': throttle.__str__()
         },
-        skip_sid=True)
+        room=sid,
+        skip_sid=True if sid is None else None)
+
+
+def send_control_bin(steering_angle, throttle, sid=None):
+    # plain floats, a binary attachment would cost a second websocket message
+    sio.emit("steer_bin", data=[steering_angle, throttle], room=sid,
+             skip_sid=True if sid is None else None)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Remote Driving')
@@ -163,6 +214,23 @@ if __name__ == '__main__':
         default='',
         help='Path to image folder. This is where the images from the run will be saved.'
     )
+    parser.add_argument(
+        '--max-batch',
+        type=int,
+        default=16,
+        help='Largest number of frames from different cars predicted together.'
+    )
+    parser.add_argument(
+        '--max-wait',
+        type=float,
+        default=2.,
+        help='Milliseconds to wait for more frames before running a batch.'
+    )
+    parser.add_argument(
+        '--threaded',
+        action='store_true',
+        help='Run the model in a worker thread so frames keep arriving meanwhile.'
+    )
     args = parser.parse_args()
 
     # check that model Keras version is same as local Keras version
@@ -194,6 +262,7 @@ if __name__ == '__main__':
     
     model.load_weights(weights_file)
     print('load weight')
+    batcher = MicroBatcher(keras_predict(model), args.max_batch, args.max_wait / 1000., args.threaded)
     """
     json_string='model.json'
     model = model_from_json(json_string)
@@ -219,8 +288,11 @@ if __name__ == '__main__':
     # wrap Flask application with engineio's middleware
     app = socketio.Middleware(sio, app)
 
-    # deploy as an eventlet WSGI server
-eventlet.wsgi.server(eventlet.listen(('', 4567)), app)
+    # deploy as an eventlet WSGI server, without Nagle delaying the small
+    # second message socket.io sends for binary attachments
+    sock = eventlet.listen(('', 4567))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    eventlet.wsgi.server(sock, app)
 
  
 
@@ -0,0 +1,159 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import cv2
+
+#
+# One-time ingest of a driving_log.csv recording: every center/left/right
+# image is decoded, cropped and resized once and stored as uint8 in a single
+# memory-mapped .npy file, next to an index with the csv columns. Batch
+# generators then gather frames from the mapped array instead of decoding
+# JPEGs for every sample of every epoch.
+#
+#   <cache_path>.npy        uint8 (n_rows, 3, height, width, channels)
+#   <cache_path>.index.npz  image paths, steering/throttle/brake/speed and
+#                           size/mtime of the csv the cache was built from
+#
+
+CENTER, LEFT, RIGHT = 0, 1, 2
+COLUMNS = ('steering', 'throttle', 'brake', 'speed')
+
+
+def resolve_path(path, data_dir):
+    # the Udacity sample stores paths relative to its folder, recordings
+    # store absolute paths which may come from another machine
+    if not os.path.isabs(path):
+        return os.path.join(data_dir, path)
+    if os.path.exists(path):
+        return path
+    return os.path.join(data_dir, 'IMG', os.path.basename(path.replace('\\', '/')))
+
+
+#
+# Reads driving_log.csv, with or without the header line. The one parser of
+# the csv, DatasetIndex ingests through it too.
+# Params: csv_path - path to the driving_log.csv file.
+# Returns: (n, 3) object array of image paths as written in the csv, (n, 4)
+#          float32 array of steering, throttle, brake and speed.
+#
+def read_columns(csv_path):
+    with open(csv_path) as f:
+        header = f.readline().startswith('center')
+    frame = pd.read_csv(csv_path, header=0 if header else None, skipinitialspace=True)
+    paths = frame.iloc[:, :3].astype(str).apply(lambda column: column.str.strip()).values
+    return paths, frame.iloc[:, 3:7].values.astype(np.float32)
+
+
+#
+# read_columns with the image paths resolved.
+# Params: csv_path - path to the driving_log.csv file.
+#         data_dir - folder image paths are relative to, default the csv folder.
+# Returns: (n, 3) array of image paths, (n, 4) float32 array of steering,
+#          throttle, brake and speed.
+#
+def read_driving_log(csv_path, data_dir=None):
+    if data_dir is None:
+        data_dir = os.path.dirname(os.path.abspath(csv_path))
+    paths, values = read_columns(csv_path)
+    paths = [resolve_path(p, data_dir) for p in paths.ravel()]
+    return np.array(paths, dtype=str).reshape(-1, 3), values
+
+
+def imread(path):
+    img = cv2.imread(path)
+    if img is None:
+        raise IOError('cannot read image ' + path)
+    return img
+
+
+#
+# Builds the cache files for a recording.
+# Params: csv_path - path to the driving_log.csv file.
+#         preprocess - maps a BGR frame from cv2.imread to the uint8 image stored.
+#         cache_path - cache file name without extension.
+#         workers - decoding threads, cv2 releases the GIL.
+#
+def build_cache(csv_path, preprocess, cache_path, data_dir=None, workers=4):
+    paths, values = read_driving_log(csv_path, data_dir)
+    if not len(paths):
+        raise ValueError('no rows in ' + csv_path)
+    shape = preprocess(imread(paths[0, CENTER])).shape
+
+    # write under a temporary name so an interrupted ingest is not picked up
+    tmp_path = cache_path + '.tmp.npy'
+    images = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8,
+                                       shape=(len(paths), 3) + shape)
+
+    def ingest(i):
+        for cam in (CENTER, LEFT, RIGHT):
+            images[i, cam] = preprocess(imread(paths[i, cam]))
+
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(ingest, range(len(paths))))
+    images.flush()
+    del images
+    os.replace(tmp_path, cache_path + '.npy')
+
+    stat = os.stat(csv_path)
+    np.savez(cache_path + '.index.npz', paths=paths, values=values,
+             source=np.array([stat.st_size, stat.st_mtime]))
+
+
+def is_stale(csv_path, cache_path):
+    if not (os.path.exists(cache_path + '.npy') and os.path.exists(cache_path + '.index.npz')):
+        return True
+    stat = os.stat(csv_path)
+    with np.load(cache_path + '.index.npz') as index:
+        return not np.array_equal(index['source'], [stat.st_size, stat.st_mtime])
+
+
+class ImageCache:
+    """
+    Memory-mapped preprocessed images of one recording.
+
+    images[row, cam] is the frame of camera cam (CENTER, LEFT, RIGHT) in csv
+    row `row`, read-only. steering, throttle, brake and speed are the csv
+    columns, uncorrected for the side cameras.
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.images = np.load(cache_path + '.npy', mmap_mode='r')
+        with np.load(cache_path + '.index.npz') as index:
+            self.paths = index['paths']
+            values = index['values']
+        self.steering, self.throttle, self.brake, self.speed = values.T
+
+    def __getstate__(self):
+        # worker processes map the file themselves instead of copying it
+        return self.cache_path
+
+    def __setstate__(self, cache_path):
+        self.__init__(cache_path)
+
+    def __len__(self):
+        return len(self.images)
+
+    def gather(self, rows, cams, out=None):
+        """Copies images[rows[k], cams[k]] into out[k]."""
+        if out is None:
+            out = np.empty((len(rows),) + self.images.shape[2:], dtype=np.uint8)
+        for k in range(len(rows)):
+            out[k] = self.images[rows[k], cams[k]]
+        return out
+
+
+#
+# Opens the cache of a recording, building it first if it is missing or
+# older than the csv.
+# Params: cache_path - cache file name without extension, should name the
+#                      preprocessing since caches of different geometries
+#                      can exist side by side.
+#
+def open_cache(csv_path, preprocess, cache_path, data_dir=None, rebuild=False):
+    if rebuild or is_stale(csv_path, cache_path):
+        print('building image cache', cache_path)
+        build_cache(csv_path, preprocess, cache_path, data_dir)
+    return ImageCache(cache_path)
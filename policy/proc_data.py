@@ -1,4 +1,4 @@
-from os.path import join
+from os.path import join, splitext
 import cv2
 import numpy as np
 import pandas as pd
@@ -6,6 +6,9 @@ import matplotlib.pyplot as plt
 from sklearn.model_selection import train_test_split
 
 import config as cf
+from image_cache import open_cache
+from batch_augment import BatchAugmenter
+from dataset_index import DatasetIndex
 
 
 
@@ -31,6 +34,24 @@ def load_data(csv_driving_data, min_throttle=0.0, verbose=False):
     return data
     
 
+#
+# Loads data of several recording folders through a dataset index, folders
+# are parsed only the first time they are seen.
+# Params: index_path - folder of the dataset_index.DatasetIndex.
+#         folders - recording folders, each with a driving_log.csv.
+#         balanced - number of rows sampled evenly over the steering
+#                    histogram, all rows if None.
+# Returns: numpy array of rows in the layout of load_data.
+#
+def load_index(index_path, folders=(), balanced=None):
+    index = DatasetIndex(index_path)
+    index.update(folders)
+    rows = None
+    if balanced:
+        rows = index.sample_balanced(balanced)
+    return index.driving_log(rows)
+
+
 #
 # Splitting of data set to training and validation sets.
 # Params: data - data - array of records from driving_log.csv file.
@@ -81,6 +102,34 @@ def read_sample(data, idx, cam_idx, data_dir=cf.DATA_FOLDER):
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     return img, steering
 
+
+#
+# Image cache of driving_log.csv: every camera image is read and cropped once
+# (same as read_sample + crop_image) into a memory-mapped array, rebuilt when
+# the csv changes. Use np.arange(len(cache)) as data for the generators below.
+# Params: csv_driving_data - path to the driving_log.csv file.
+# Returns: image_cache.ImageCache.
+#
+def load_cache(csv_driving_data=cf.DRIVING_LOG, data_dir=cf.DATA_FOLDER):
+    def preprocess(img):
+        return crop_image(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    cache_path = '{}_{}x{}x{}'.format(splitext(csv_driving_data)[0], cf.IN_Height, cf.IN_Width, cf.IN_Channels)
+    return open_cache(csv_driving_data, preprocess, cache_path, data_dir)
+
+
+#
+# read_sample from the image cache, the returned image is already cropped.
+# Params: cache - image_cache.ImageCache.
+#         idx - row in driving_log.csv.
+#
+def read_cached_sample(cache, idx, cam_idx):
+    steering = cache.steering[idx]
+    if (cam_idx == cf.LEFT):
+        steering = steering + cf.CAM_STEERING_SHIFT
+    elif (cam_idx == cf.RIGHT):
+        steering = steering - cf.CAM_STEERING_SHIFT
+    return cache.images[idx, cam_idx], steering
+
     
 #
 # Cropping of RGB image (to remove part of sky and bonnet), resizing to the
@@ -203,7 +252,8 @@ def generate_train_sample(data, s_i, verbose=False):
 #         bias - value [0..1] to control frequency of samples with steering angle close
 #                to zero in batch.
 #         augment - enable/disable augmentation.
-def generate_batch(data, batch_size=32, bias=1.0, augment=True):
+#         cache - image cache from load_cache, data is then an array of row indices.
+def generate_batch(data, batch_size=32, bias=1.0, augment=True, cache=None):
     #
     # Augmentation: using all three cameras to learn the following scenarious:
     #       driving in the center of road, driving from left/right part of road
@@ -215,6 +265,9 @@ def generate_batch(data, batch_size=32, bias=1.0, augment=True):
     # measures of accuracy (in terms of bais, varience, etc.)- random sampling
     # with replacement.
     #
+    if cache is not None:
+        return generate_cached_batch(cache, data, batch_size, bias, augment)
+
     batch_im = np.zeros((batch_size, cf.IN_Height, cf.IN_Width, cf.IN_Channels))
     batch_st = np.zeros(batch_size)
     
@@ -258,6 +311,53 @@ def generate_batch(data, batch_size=32, bias=1.0, augment=True):
     return batch_im, batch_st
 
 
+#
+# Batch augmenter with the augmentation of generate_batch, for cropped images.
+# Same camera pixel shifts as random_translate, scaled to the crop.
+#
+def cached_augmenter(seed=None):
+    return BatchAugmenter(max_shift=30, max_ang=30 * 0.004, shift_scale=float(cf.IN_Width) / 320,
+                          max_vshift=5, vshift_scale=float(cf.IN_Height) / len(cf.IN_Crop),
+                          brightness=(0.25, 1.25), p_bright=1., clip_steering=False, replicate=True,
+                          seed=seed)
+
+
+#
+# generate_batch on the image cache: candidates are gathered and augmented a
+# batch at a time with BatchAugmenter, then filtered by bias.
+# Params: rows - row indices of the cache to sample from.
+#
+def generate_cached_batch(cache, rows, batch_size=32, bias=1.0, augment=True, augmenter=None):
+    if augmenter is None:
+        augmenter = cached_augmenter()
+    rng = augmenter.rng
+
+    batch_im = np.zeros((batch_size,) + cache.images.shape[2:], dtype=np.uint8)
+    batch_st = np.zeros(batch_size)
+    shifts = np.array([0., cf.CAM_STEERING_SHIFT, -cf.CAM_STEERING_SHIFT])
+    # a few spare candidates so that one round usually fills the batch
+    n_candidates = batch_size + batch_size // 4
+    candidates = np.empty((n_candidates,) + batch_im.shape[1:], dtype=np.uint8)
+
+    n_samples = 0
+    while n_samples < batch_size:
+        idx = rows[rng.randint(len(rows), size=n_candidates)]
+        cam_i = rng.randint(3, size=n_candidates) if augment else np.full(n_candidates, cf.CENTER)
+        cache.gather(idx, cam_i, candidates)
+        steering = cache.steering[idx] + shifts[cam_i]
+        if augment:
+            candidates, steering = augmenter(candidates, steering, candidates)
+
+        # same bias test as generate_batch
+        keep = np.flatnonzero((np.abs(steering) + bias) >= rng.rand(n_candidates))
+        keep = keep[:batch_size - n_samples]
+        batch_im[n_samples:n_samples + len(keep)] = candidates[keep]
+        batch_st[n_samples:n_samples + len(keep)] = steering[keep]
+        n_samples += len(keep)
+
+    return batch_im, batch_st
+
+
 
 #
 # Preprocessing of input frame for prediction: cropping and resizing of
@@ -271,22 +371,32 @@ def preprocess_predict_image(img, verbose=False):
 # Returns generator of batch for training of the model.
 # Params: data - array of records from driving_log.csv file.
 #         batch_size - size of generated batch.
+#         cache - optional image cache, see generate_batch.
+#         seed - seed of the batch augmenter when cache is used.
 #            
-def generate_train_data_batch(data, batch_size=32, bias=0.8, augment=True, pb_thresh=0.1):
+def generate_train_data_batch(data, batch_size=32, bias=0.8, augment=True, pb_thresh=0.1, cache=None, seed=None):
+    augmenter = cached_augmenter(seed) if cache is not None else None
     while 1:
-        batch_imgs, batch_steering = generate_batch(data, batch_size, bias, augment)
+        if cache is None:
+            batch_imgs, batch_steering = generate_batch(data, batch_size, bias, augment)
+        else:
+            batch_imgs, batch_steering = generate_cached_batch(cache, data, batch_size, bias, augment, augmenter)
         yield  batch_imgs, batch_steering    
         
         
 #       
 # Returns generator of batch for validation of the model.
 # Params: data - array of records from driving_log.csv file.
+#         cache - optional image cache, see generate_batch.
 #
-def generate_valid_data(data):
+def generate_valid_data(data, cache=None):
     while True:
         for i in range(len(data)):
-            x,y = read_sample(data, i, cf.CENTER)
-            x = crop_image(x)
+            if cache is None:
+                x,y = read_sample(data, i, cf.CENTER)
+                x = crop_image(x)
+            else:
+                x,y = read_cached_sample(cache, data[i], cf.CENTER)
             x = x.reshape(1, x.shape[0], x.shape[1], x.shape[2])
             y = np.array([[y]])
             yield x, y
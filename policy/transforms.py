@@ -2,6 +2,8 @@ import cv2
 import numpy as np
 from matplotlib import pyplot as plt
 
+from batch_augment import BatchAugmenter
+
 
 def mirror(img, angle):
     mirrored_img = cv2.flip(img, 1)
@@ -40,7 +42,7 @@ def gray(img, angle):
 def shift(img, angle, size=64):
     angle_offset_per_pixel = 0.005
     max_shift = 16
-    x_shift, y_shift = np.random.random_integers(-max_shift, max_shift, 2)
+    x_shift, y_shift = np.random.randint(-max_shift, max_shift + 1, 2)
     shifted_angle = angle + x_shift * angle_offset_per_pixel
     trans_m = np.float32([[1, 0, x_shift], [0, 1, y_shift]])
     shifted_img = cv2.warpAffine(img, trans_m, (size, size))
@@ -48,6 +50,73 @@ def shift(img, angle, size=64):
     return shifted_img, shifted_angle
 
 
+#
+# Batch versions of the transforms above for (N, size, size, depth) uint8
+# arrays. Each returns (images, angles) like its single image version and
+# writes into out, which may be imgs itself. Where the transform allows it
+# the batch goes through OpenCV as one tall (N*size, size) image.
+#
+
+def _tall(imgs):
+    return imgs.reshape((-1,) + imgs.shape[2:])
+
+
+def _out(imgs, out):
+    return np.empty_like(imgs) if out is None else out
+
+
+def mirror_batch(imgs, angles, out=None, rng=np.random):
+    out = _out(imgs, out)
+    cv2.flip(_tall(imgs), 1, dst=_tall(out))
+    return out, -angles
+
+
+def noise_batch(imgs, angles, out=None, rng=np.random):
+    out = _out(imgs, out)
+    noise_max = 20
+    # random bytes scaled to [0, noise_max), far cheaper than randint
+    random_bytes = np.frombuffer(rng.bytes(imgs.size), dtype=np.uint8).reshape(imgs.shape)
+    noise_mask = (random_bytes.astype(np.uint16) * noise_max >> 8).astype(np.uint8)
+    cv2.add(_tall(imgs), _tall(noise_mask), dst=_tall(out))
+    return out, angles
+
+
+def brightness_batch(imgs, angles, out=None, rng=np.random):
+    out = _out(imgs, out)
+    hsv = cv2.cvtColor(_tall(imgs), cv2.COLOR_RGB2HSV).reshape(imgs.shape)
+    random_bright = 0.25 + rng.uniform(size=len(imgs))
+    # saturates instead of wrapping around above 255
+    value = hsv[..., 2] * random_bright[:, None, None]
+    hsv[..., 2] = np.minimum(value, 255)
+    cv2.cvtColor(_tall(hsv), cv2.COLOR_HSV2RGB, dst=_tall(out))
+    return out, angles
+
+
+def blur_batch(imgs, angles, out=None, rng=np.random):
+    # a tall image would blur across neighbouring images
+    out = _out(imgs, out)
+    kernel = 3
+    for i in range(len(imgs)):
+        cv2.GaussianBlur(imgs[i], (kernel, kernel), 0, dst=out[i])
+    return out, angles
+
+
+def gray_batch(imgs, angles, out=None, rng=np.random):
+    out = _out(imgs, out)
+    grayed = cv2.cvtColor(_tall(imgs), cv2.COLOR_RGB2GRAY)
+    cv2.cvtColor(grayed, cv2.COLOR_GRAY2RGB, dst=_tall(out))
+    return out, angles
+
+
+def shift_batch(imgs, angles, out=None, rng=np.random):
+    # integer shifts, the bilinear remap of BatchAugmenter is exact
+    angle_offset_per_pixel = 0.005
+    max_shift = 16
+    shifter = BatchAugmenter(max_shift=max_shift, max_ang=max_shift * angle_offset_per_pixel,
+                             max_vshift=max_shift, p_flip=0., p_bright=0., clip_steering=False)
+    return shifter(imgs, angles, out=out, rng=rng)
+
+
 if __name__ == '__main__':
     img_test = plt.imread('images/resized.jpg')
     img_test, img_angle = gray(img_test, 0.5)
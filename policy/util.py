@@ -12,6 +12,10 @@ import pandas as pd
 import os, sys
 import json
 
+from image_cache import open_cache
+from batch_augment import BatchAugmenter
+from dataset_index import DatasetIndex
+
 #defining needed functions
 """
 Suffle multiple arrays with respect of its indexing
@@ -134,6 +138,32 @@ def load_datasets (datasets):
 
     return all_steering, all_center
 
+"""
+load_datasets through a dataset_index.DatasetIndex stored in @index_path,
+every dataset folder is parsed only the first time it is seen
+Args:
+    datasets: same as load_datasets
+    index_path: folder of the index
+Returns:
+    same as load_datasets
+"""
+def load_datasets_indexed (datasets, index_path='datasets.index'):
+    index = DatasetIndex (index_path)
+    all_rows = []
+    for dataset in datasets:
+        dataset_file = dataset
+        dataset_size = 1
+        if (isinstance(dataset, tuple)):
+            dataset_file, dataset_size = dataset
+        index.add (dataset_file)
+        rows = index.session_rows (dataset_file)
+        if (dataset_size < 1):
+            rows = np.random.permutation (rows)[0:int(dataset_size * len(rows))]
+        all_rows.append (rows)
+
+    rows = np.concatenate (all_rows)
+    return index.steering[rows].astype(np.float64), np.asarray (index.paths (rows))
+
 #loading dataset images
 """
 Loades dataset images
@@ -229,10 +259,13 @@ def crop_img(image):
     img = cv2.cvtColor(resized_img, cv2.COLOR_BGR2RGB)
     return resized_img
 
-def shift_img(image, steer):
+def shift_img(image, steer, scale=1.):
     """
     randomly shift image horizontally
     add proper steering angle to each image
+
+    scale converts the shift from camera frame pixels to image pixels,
+    for images that were already cropped & resized
     """
     max_shift = 55
     max_ang = 0.14  # ang_per_pixel = 0.0025
@@ -244,7 +277,7 @@ def shift_img(image, steer):
     if abs(dst_steer) > 1:
         dst_steer = -1 if (dst_steer < 0) else 1
 
-    mat = np.float32([[1, 0, random_x], [0, 1, 0]])
+    mat = np.float32([[1, 0, random_x * scale], [0, 1, 0]])
     dst_img = cv2.warpAffine(image, mat, (cols, rows))
     return dst_img, dst_steer
 
@@ -348,6 +381,91 @@ def generate_train_batch(center, left, right, steering, batch_size):
         yield image_set, steering_set
 
 
+def load_cache(csv_path, show=False):
+    """
+    image cache version of load_csv
+
+    crops every camera image of the recording once into a memory-mapped
+    cache and returns (cache, train rows, valid rows) instead of paths.
+    same straight angle subsampling and split as load_csv
+    """
+    cache = open_cache(csv_path, crop_img, os.path.splitext(csv_path)[0] + '_{}x{}'.format(Rows, Cols))
+
+    steer = cache.steering
+    keep = (steer != 0.0) | (np.random.uniform(size=len(steer)) <= 0.15)
+    rows = shuffle(np.flatnonzero(keep))
+    valid_rows = rows[:int(len(rows) * 0.1)]
+
+    if show is True:
+        plt.hist(steer[rows], bins= 50, color= 'orange')
+        plt.xlabel('steering value')
+        plt.ylabel('counts')
+        plt.show()
+    else:
+        return cache, rows, valid_rows
+
+def select_cached(cache, num, offsets=0.22):
+    """ select_img on the image cache """
+    rand = np.random.randint(3)
+    image = cache.images[num, rand]
+    steering = cache.steering[num] + (0., offsets, -offsets)[rand]
+    if abs(steering) > 1:
+        steering = -1 if (steering < 0) else 1
+
+    return image, steering
+
+def generate_train_cached(cache, rows):
+    """
+    generate_train on the image cache
+    images are already cropped, so the shift is scaled to the crop
+    """
+    num = rows[np.random.randint(0, len(rows))]
+    image, steering = select_cached(cache, num, offset)
+
+    image, steering = shift_img(image, steering, Cols / 319.)
+    image, steering = flip_img(image, steering)
+    image = brightness_img(image)
+    return image, steering
+
+def generate_valid_cached(cache, valid_rows):
+    """ generate validation set from center images of the cache """
+    img_set = cache.gather(valid_rows, np.zeros(len(valid_rows), dtype=int))
+    steer_set = cache.steering[valid_rows].astype(np.float64)
+    return img_set, steer_set
+
+def cache_augmenter(seed=None):
+    """ BatchAugmenter doing generate_train_cached's augmentation """
+    return BatchAugmenter(shift_scale=Cols / 319., seed=seed)
+
+def fill_train_batch_cached(cache, rows, augmenter, image_set, steering_set, rng):
+    """
+    fill one training batch from the image cache in place
+    same augmentation as generate_train_cached, done on the whole batch
+    """
+    batch_size = len(image_set)
+    nums = rows[rng.randint(0, len(rows), batch_size)]
+    cams = rng.randint(3, size=batch_size)
+    cache.gather(nums, cams, image_set)
+    steer = cache.steering[nums] + np.array([0., offset, -offset])[cams]
+    steer = np.clip(steer, -1, 1)
+    steering_set[:] = augmenter(image_set, steer, image_set, rng)[1]
+
+def fill_train_batch(center, left, right, steering, image_set, steering_set, rng=None):
+    """ fill one training batch in place with generate_train, uses np.random """
+    for i in range(len(image_set)):
+        image_set[i], steering_set[i] = generate_train(center, left, right, steering)
+
+def generate_train_batch_cached(cache, rows, batch_size, seed=None):
+    """ compose training batch set from the image cache """
+    augmenter = cache_augmenter(seed)
+    image_set = np.zeros((batch_size, Rows, Cols, 3), dtype=np.uint8)
+    steering_set = np.zeros(batch_size)
+
+    while 1:
+        fill_train_batch_cached(cache, rows, augmenter, image_set, steering_set, augmenter.rng)
+        yield image_set, steering_set
+
+
 def saveModel(model,model_json,model_weights):
     #Save model
     #from keras.models import model_from_json